@@ -0,0 +1,212 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict, deque
+
+from starlette.responses import JSONResponse
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+WRITE_RATE_PER_SECOND = _env_float("ADMISSION_WRITE_RATE", 10.0)
+WRITE_BURST = _env_int("ADMISSION_WRITE_BURST", 20)
+QUEUE_TIMEOUT_SECONDS = _env_float("ADMISSION_QUEUE_TIMEOUT", 2.0)
+RETRY_AFTER_SECONDS = _env_int("ADMISSION_RETRY_AFTER", 1)
+MAX_TRACKED_BUCKETS = 100_000
+
+WRITE_PREFIXES = ("/activities", "/sleep", "/blood")
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests for one route and parks a bounded number of
+    extra requests in a FIFO queue. Anything beyond that is shed."""
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    async def acquire(self) -> bool:
+        if self.in_flight < self.max_concurrent and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as error:
+            # Timed out, or the request was cancelled (client gone, shutdown)
+            if waiter.done():
+                # The slot was handed over just as we gave up; pass it on.
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                waiter.cancel()
+            if not isinstance(error, asyncio.TimeoutError):
+                raise
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self):
+        # Hand the slot straight to the next waiter so a newly arriving
+        # request can't jump the queue.
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+        }
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets. Idle buckets are dropped LRU-first once
+    MAX_TRACKED_BUCKETS keys are being tracked."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = MAX_TRACKED_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, key: str) -> float:
+        """Consume one token for key. Returns 0 when allowed, otherwise the
+        number of seconds until a token becomes available."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+            self.allowed += 1
+        else:
+            wait = (1 - tokens) / self.rate
+            self.limited += 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "tracked_keys": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+def default_route_limits() -> list:
+    """(method, path regex, limiter) for the expensive routes."""
+    return [
+        ("GET", re.compile(r"^/get_health_score$"), ConcurrencyLimiter(
+            "health_score",
+            _env_int("ADMISSION_HEALTH_SCORE_CONCURRENCY", 8),
+            _env_int("ADMISSION_HEALTH_SCORE_QUEUE", 16),
+            QUEUE_TIMEOUT_SECONDS,
+        )),
+        ("GET", re.compile(r"^/(activities|sleep|blood)/user/\d+$|^/users/?$"), ConcurrencyLimiter(
+            "list_endpoints",
+            _env_int("ADMISSION_LIST_CONCURRENCY", 8),
+            _env_int("ADMISSION_LIST_QUEUE", 16),
+            QUEUE_TIMEOUT_SECONDS,
+        )),
+    ]
+
+
+def _rate_limit_key(scope) -> str:
+    # The API has no authenticated identity, and user ids in headers or the
+    # query string are chosen by the client, so buckets are per client address.
+    client = scope.get("client")
+    return "client:" + (client[0] if client else "unknown")
+
+
+def _rejection(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionControlMiddleware:
+    """Bounds concurrency on expensive routes (shedding with 503) and
+    rate-limits writes per client (rejecting with 429)."""
+
+    def __init__(self, app, route_limits=None, write_limiter=None):
+        self.app = app
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self.write_limiter = write_limiter or WRITE_LIMITER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method, path = scope["method"], scope["path"]
+
+        if method in WRITE_METHODS and path.startswith(WRITE_PREFIXES):
+            wait = self.write_limiter.take(_rate_limit_key(scope))
+            if wait:
+                return await _rejection(429, "Rate limit exceeded", wait)(scope, receive, send)
+
+        limiter = self._match(method, path)
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        if not await limiter.acquire():
+            return await _rejection(503, "Server busy, try again later", RETRY_AFTER_SECONDS)(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    def _match(self, method: str, path: str):
+        for route_method, pattern, limiter in self.route_limits:
+            if method == route_method and pattern.match(path):
+                return limiter
+        return None
+
+
+ROUTE_LIMITS = default_route_limits()
+WRITE_LIMITER = TokenBucketLimiter(WRITE_RATE_PER_SECOND, WRITE_BURST)
+
+
+def stats() -> dict:
+    return {
+        "routes": {limiter.name: limiter.stats() for _, _, limiter in ROUTE_LIMITS},
+        "write_rate_limit": WRITE_LIMITER.stats(),
+    }
@@ -0,0 +1,40 @@
+"""Client-supplied external_id, unique per user, for idempotent ingestion
+
+Existing rows get a NULL external_id, which never conflicts, so the
+constraints can be added before running dedup.py.
+
+Revision ID: 0002_external_ids
+Revises: 0001_baseline
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_external_ids"
+down_revision: Union[str, Sequence[str], None] = "0001_baseline"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("physical_activities", "sleep_activities", "blood_tests")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        # Batch mode recreates the table on SQLite, which can't add constraints in place
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(sa.Column("external_id", sa.String(), nullable=True))
+            batch.create_unique_constraint(f"uq_{table}_user_external_id", ["user_id", "external_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_constraint(f"uq_{table}_user_external_id", type_="unique")
+            batch.drop_column("external_id")
@@ -0,0 +1,40 @@
+"""Nightly sleep totals and the (user_id, start_time) index they are built from
+
+Fill the new table with `python sleep_nights.py --rebuild` after upgrading.
+
+Revision ID: 0003_sleep_nights
+Revises: 0002_external_ids
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_sleep_nights"
+down_revision: Union[str, Sequence[str], None] = "0002_external_ids"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_sleep_activities_user_start_time", "sleep_activities", ["user_id", "start_time"])
+    op.create_table(
+        "sleep_nights",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("night", sa.Date(), nullable=False),
+        sa.Column("total_minutes", sa.Integer(), nullable=False),
+        sa.Column("segment_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "night"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("sleep_nights")
+    op.drop_index("ix_sleep_activities_user_start_time", table_name="sleep_activities")
@@ -0,0 +1,30 @@
+"""users.deleted_at for asynchronous purges
+
+Revision ID: 0004_soft_delete
+Revises: 0003_sleep_nights
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_soft_delete"
+down_revision: Union[str, Sequence[str], None] = "0003_sleep_nights"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("users") as batch:
+        batch.add_column(sa.Column("deleted_at", sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("users") as batch:
+        batch.drop_column("deleted_at")
@@ -0,0 +1,32 @@
+"""Covering indexes for the activity and blood test summaries
+
+Revision ID: 0005_summary_indexes
+Revises: 0004_soft_delete
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_summary_indexes"
+down_revision: Union[str, Sequence[str], None] = "0004_soft_delete"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_physical_activities_user_type_timestamp", "physical_activities",
+                    ["user_id", "activity_type", "timestamp"], postgresql_include=["duration"])
+    op.create_index("ix_blood_tests_user_test_timestamp", "blood_tests",
+                    ["user_id", "test_name", "timestamp"], postgresql_include=["result", "unit"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_blood_tests_user_test_timestamp", table_name="blood_tests")
+    op.drop_index("ix_physical_activities_user_type_timestamp", table_name="physical_activities")
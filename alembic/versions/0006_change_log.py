@@ -0,0 +1,39 @@
+"""change_log outbox behind GET /changes
+
+Revision ID: 0006_change_log
+Revises: 0005_summary_indexes
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_change_log"
+down_revision: Union[str, Sequence[str], None] = "0005_summary_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "change_log",
+        sa.Column("seq", sa.BigInteger().with_variant(sa.Integer(), "sqlite"), autoincrement=True, nullable=False),
+        sa.Column("entity", sa.String(), nullable=False),
+        sa.Column("entity_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("operation", sa.String(), nullable=False),
+        sa.Column("changed_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("seq"),
+    )
+    op.create_index("ix_change_log_changed_at", "change_log", ["changed_at"])
+    op.create_index("ix_change_log_entity_seq", "change_log", ["entity", "entity_id", "seq"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("change_log")
@@ -0,0 +1,40 @@
+"""Latest health score per user for the population statistics
+
+Fill it with `python population.py --recompute` after upgrading.
+
+Revision ID: 0007_user_scores
+Revises: 0006_change_log
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_user_scores"
+down_revision: Union[str, Sequence[str], None] = "0006_change_log"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "user_scores",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("overall", sa.Float(), nullable=False),
+        sa.Column("physical", sa.Float(), nullable=False),
+        sa.Column("sleep", sa.Float(), nullable=False),
+        sa.Column("blood", sa.Float(), nullable=False),
+        sa.Column("computed_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("user_scores")
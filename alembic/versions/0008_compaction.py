@@ -0,0 +1,54 @@
+"""Daily activity aggregates, watermarks and merged sleep sessions for compaction.py
+
+Revision ID: 0008_compaction
+Revises: 0007_user_scores
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_compaction"
+down_revision: Union[str, Sequence[str], None] = "0007_user_scores"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "activity_daily_aggregates",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("activity_type", sa.String(), nullable=False),
+        sa.Column("session_count", sa.Integer(), nullable=False),
+        sa.Column("total_duration", sa.Float(), nullable=False),
+        sa.Column("last_timestamp", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "day", "activity_type"),
+    )
+    op.create_table(
+        "compaction_watermarks",
+        sa.Column("entity", sa.String(), nullable=False),
+        sa.Column("compacted_before", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("entity"),
+    )
+    op.create_table(
+        "sleep_sessions",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("start_time", sa.DateTime(), nullable=False),
+        sa.Column("end_time", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id", "start_time"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("sleep_sessions")
+    op.drop_table("compaction_watermarks")
+    op.drop_table("activity_daily_aggregates")
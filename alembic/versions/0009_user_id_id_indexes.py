@@ -0,0 +1,32 @@
+"""(user_id, id) indexes for the per-user listings
+
+Revision ID: 0009_user_id_id_indexes
+Revises: 0008_compaction
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_user_id_id_indexes"
+down_revision: Union[str, Sequence[str], None] = "0008_compaction"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("physical_activities", "sleep_activities", "blood_tests")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table in TABLES:
+        op.create_index(f"ix_{table}_user_id_id", table, ["user_id", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_user_id_id", table_name=table)
@@ -0,0 +1,118 @@
+"""Benchmark for the embedded SQLite mode.
+
+Runs writer threads ingesting activity batches and reader threads
+computing health scores against a fresh database file for a fixed time,
+then reports sustained rates and latencies:
+
+    python bench_embedded.py --seconds 30 --writers 2 --readers 4
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from database import RoutingSession, create_sqlite_engines
+from healthDB import Base, User
+from healthscore import calculate_health_score_components
+from schemas import PhysicalActivityCreate, UserCreate
+
+ACTIVITY_TYPES = ("walking", "running", "cycling", "swimming")
+
+
+def _percentile(samples: list, q: float) -> float:
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def run(path: str, seconds: float, writers: int, readers: int, batch: int, users: int) -> dict:
+    writer, reader = create_sqlite_engines(f"sqlite:///{path}", readers=readers)
+    Base.metadata.create_all(bind=writer)
+    SessionLocal = sessionmaker(class_=RoutingSession, writer=writer, reader=reader,
+                                autoflush=False, autocommit=False)
+    with SessionLocal() as db:
+        for index in range(users):
+            crud.create_user(db, UserCreate(username=f"bench{index}", email=f"bench{index}@example.com"))
+        user_ids = [user_id for (user_id,) in db.query(User.id)]
+
+    stop = threading.Event()
+    ingest_latencies, score_latencies = [], []
+    rows_written = [0]
+    lock = threading.Lock()
+
+    def ingest():
+        with SessionLocal() as db:
+            while not stop.is_set():
+                items = [
+                    (random.choice(user_ids),
+                     PhysicalActivityCreate(activity_type=random.choice(ACTIVITY_TYPES), duration=random.uniform(5, 90)),
+                     None)
+                    for _ in range(batch)
+                ]
+                started = time.perf_counter()
+                crud.ingest_physical_activities(db, items)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    ingest_latencies.append(elapsed)
+                    rows_written[0] += batch
+
+    def score():
+        with SessionLocal() as db:
+            while not stop.is_set():
+                started = time.perf_counter()
+                user = db.get(User, random.choice(user_ids))
+                calculate_health_score_components(user, db)
+                db.rollback()
+                elapsed = time.perf_counter() - started
+                with lock:
+                    score_latencies.append(elapsed)
+
+    threads = [threading.Thread(target=ingest) for _ in range(writers)]
+    threads += [threading.Thread(target=score) for _ in range(readers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "seconds": round(elapsed, 1),
+        "ingest_rows_per_second": round(rows_written[0] / elapsed),
+        "ingest_batch_ms_p50": round(_percentile(ingest_latencies, 0.5) * 1000, 2),
+        "ingest_batch_ms_p99": round(_percentile(ingest_latencies, 0.99) * 1000, 2),
+        "scores_per_second": round(len(score_latencies) / elapsed),
+        "score_ms_p50": round(_percentile(score_latencies, 0.5) * 1000, 2),
+        "score_ms_p99": round(_percentile(score_latencies, 0.99) * 1000, 2),
+        "score_ms_mean": round(statistics.fmean(score_latencies) * 1000, 2) if score_latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and score reads on embedded SQLite.")
+    parser.add_argument("--path", help="database file (default: a temporary file)")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=100, help="activities per ingest transaction")
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.path or os.path.join(directory, "bench.db")
+        report = run(path, args.seconds, args.writers, args.readers, args.batch, args.users)
+    for name, value in report.items():
+        print(f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Change-data feed backed by the change_log outbox table.
+
+Every write in crud appends (entity, entity_id, user_id, operation) rows to
+change_log inside the same transaction, so an entry exists exactly when the
+write committed. Consumers page through GET /changes?after=<seq> and keep
+the last seq they processed as their cursor.
+
+Writers append without any shared lock, so seq order need not match commit
+order: seq N+1 may commit while N is still in flight, and a consumer that
+read N+1 would skip N. On Postgres, readers therefore only return entries
+up to a committed high-water mark. Each read notes the sequence's last
+value L and the next transaction id X. Once every transaction below X has
+finished, every seq up to L is either committed or will never appear,
+because a writer's transaction id is assigned before it draws a seq. A read
+never waits for that. It returns the newest L whose transactions are all
+done, as noted by earlier reads in this worker or by itself. While a long
+write transaction runs, the mark stays where it was and pages come back
+short or empty. SQLite has a single writer, so everything visible is final
+there.
+
+After a commit that recorded changes, every function in commit_listeners
+is called with the ids of the users whose data changed. Maintenance jobs
+that rewrite data without feed entries (compaction, purges, rebuilds) call
+mark_changed so the listeners still hear about it.
+
+Deleting a user is recorded as a single "user" delete; the user's
+activities, sleep and blood tests go with it without entries of their own.
+
+Old entries are removed by retention (drop entries older than N days) and
+compaction (keep only the newest entry per entity among older entries):
+
+    python changefeed.py --retention-days 30
+    python changefeed.py --compact-before-seq 100000
+"""
+import argparse
+import os
+import threading
+from collections import deque
+from datetime import timedelta
+
+from sqlalchemy import delete, event, insert, select, text
+from sqlalchemy.orm import Session, aliased
+
+import shm_cache
+from healthDB import ChangeLog, utcnow
+
+# Pending (L, X) pairs kept per worker; the oldest are dropped beyond this
+MAX_CHECKPOINTS = 1000
+RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", 30))
+PRUNE_BATCH_SIZE = 10_000
+
+INSERT, UPDATE, DELETE = "insert", "update", "delete"
+
+# Called with a set of user ids after each commit that changed their data
+commit_listeners = [shm_cache.bump_data_versions]
+
+
+def record_changes(db: Session, entity: str, operation: str, rows) -> None:
+    """Append one entry per (entity_id, user_id) pair. Call last, right
+    before committing."""
+    rows = [
+        {"entity": entity, "entity_id": entity_id, "user_id": user_id,
+         "operation": operation, "changed_at": utcnow()}
+        for entity_id, user_id in rows
+    ]
+    if not rows:
+        return
+    mark_changed(db, (row["user_id"] for row in rows if row["user_id"] is not None))
+    if db.get_bind().dialect.name == "postgresql":
+        # Make sure the transaction id exists before any seq is drawn (see _high_water)
+        db.execute(text("SELECT txid_current()"))
+    db.execute(insert(ChangeLog), rows)
+
+
+def mark_changed(db: Session, user_ids) -> None:
+    """Pass user_ids to commit_listeners after the next commit, without a feed entry."""
+    db.info.setdefault("changed_user_ids", set()).update(user_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_commit(session):
+    user_ids = session.info.pop("changed_user_ids", None)
+    if user_ids:
+        for listener in commit_listeners:
+            listener(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changes(session):
+    session.info.pop("changed_user_ids", None)
+
+
+def record_change(db: Session, entity: str, operation: str, entity_id: int, user_id: int | None) -> None:
+    record_changes(db, entity, operation, [(entity_id, user_id)])
+
+
+_checkpoints = deque(maxlen=MAX_CHECKPOINTS)
+_checkpoint_lock = threading.Lock()
+_final_seq = 0
+
+
+def _high_water(db: Session) -> int:
+    """Highest seq known to be final on Postgres, without waiting for the
+    transactions in flight. Run outside any write transaction: read
+    committed takes a fresh snapshot per statement."""
+    global _final_seq
+    last = db.scalar(text("SELECT pg_sequence_last_value(pg_get_serial_sequence('change_log', 'seq')::regclass)"))
+    horizon = db.scalar(text("SELECT txid_snapshot_xmax(txid_current_snapshot())"))
+    oldest = db.scalar(text("SELECT txid_snapshot_xmin(txid_current_snapshot())"))
+    with _checkpoint_lock:
+        if last is not None and (not _checkpoints or _checkpoints[-1][0] != last):
+            _checkpoints.append((last, horizon))
+        while _checkpoints and _checkpoints[0][1] <= oldest:
+            _final_seq = max(_final_seq, _checkpoints.popleft()[0])
+        return _final_seq
+
+
+def get_changes(db: Session, after: int = 0, limit: int = 100) -> list:
+    query = db.query(ChangeLog).filter(ChangeLog.seq > after)
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.filter(ChangeLog.seq <= _high_water(db))
+    return query.order_by(ChangeLog.seq).limit(limit).all()
+
+
+def _delete_in_batches(db: Session, condition) -> int:
+    removed = 0
+    while True:
+        batch = select(ChangeLog.seq).where(condition).limit(PRUNE_BATCH_SIZE).scalar_subquery()
+        deleted = db.execute(delete(ChangeLog).where(ChangeLog.seq.in_(batch))).rowcount
+        db.commit()
+        removed += deleted
+        if deleted < PRUNE_BATCH_SIZE:
+            return removed
+
+
+def prune_changes(db: Session, retention_days: int = RETENTION_DAYS) -> int:
+    """Delete entries older than the retention window. Returns rows removed."""
+    cutoff = utcnow() - timedelta(days=retention_days)
+    return _delete_in_batches(db, ChangeLog.changed_at < cutoff)
+
+
+def compact_changes(db: Session, before_seq: int) -> int:
+    """Among entries with seq < before_seq keep only the newest per
+    (entity, entity_id). A consumer behind before_seq still ends up with
+    the latest operation for every entity. Returns rows removed."""
+    newer = aliased(ChangeLog)
+    superseded = select(newer.seq).where(
+        newer.entity == ChangeLog.entity,
+        newer.entity_id == ChangeLog.entity_id,
+        newer.seq > ChangeLog.seq,
+        newer.seq < before_seq,
+    ).exists()
+    return _delete_in_batches(db, (ChangeLog.seq < before_seq) & superseded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune and compact the change_log table.")
+    parser.add_argument("--retention-days", type=int, help="delete entries older than this many days")
+    parser.add_argument("--compact-before-seq", type=int, help="keep only the newest entry per entity below this seq")
+    args = parser.parse_args()
+    if args.retention_days is None and args.compact_before_seq is None:
+        parser.error("pass --retention-days and/or --compact-before-seq")
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.compact_before_seq is not None:
+            print(f"{compact_changes(db, args.compact_before_seq)} entries compacted")
+        if args.retention_days is not None:
+            print(f"{prune_changes(db, args.retention_days)} entries pruned")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
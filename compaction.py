@@ -0,0 +1,291 @@
+"""Retention job folding old raw rows into per-user daily aggregates.
+
+Physical activities older than RAW_RETENTION_DAYS are summed into
+activity_daily_aggregates (one row per user, day and activity type) and
+deleted, COMPACTION_BATCH_SIZE rows per transaction. Each batch deletes its
+rows with DELETE ... RETURNING and adds what was returned to the
+aggregates in the same transaction, so an interrupted run loses nothing, a
+rerun picks up where it stopped, and concurrent runs never fold the same
+row twice: a row is only returned to the run that deleted it, and rows
+locked by another run are skipped. Rows arriving late with old timestamps
+are folded in by the next run.
+
+Sleep segments are already summarised per user and night in sleep_nights.
+Compaction moves the sleep watermark forward, which freezes every night
+before it (see sleep_nights.py), then replaces the segments of those nights
+with their merged sessions in sleep_sessions, also in batches. Segments that
+arrive later for a frozen night are merged with the stored sessions on the
+next run, and the night's total takes the minutes they add. Merges for a
+user are serialised on the user's row, like sleep_nights.refresh_nights.
+
+The health score and GET /activities/user/{id}/summary read raw rows and
+aggregates together, so they report the same totals before and after
+compaction. Compaction is not recorded in the change feed, but cached
+scores of the users it touches are invalidated (changefeed.mark_changed).
+
+    python compaction.py --dry-run     # report what would be compacted
+    python compaction.py --verify      # compact, then check per-user totals
+
+Set COMPACTION_INTERVAL_SECONDS to also run it from every API worker; runs in
+several workers at once split the batches between them.
+"""
+import argparse
+import logging
+import os
+import threading
+from bisect import bisect_right
+from datetime import timedelta
+from itertools import groupby
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+
+from changefeed import mark_changed
+from crud import dialect_insert
+from healthDB import (ActivityDailyAggregate, CompactionWatermark, PhysicalActivity, SleepActivity, SleepNight,
+                      SleepSession, User, utcnow)
+from sleep_nights import SLEEP_WATERMARK, frozen_before, merge_sessions, night_of, night_start, session_minutes
+
+RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", 365))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", 5000))
+# 0 disables the in-process schedule; run the CLI from cron instead
+INTERVAL_SECONDS = int(os.getenv("COMPACTION_INTERVAL_SECONDS", 0))
+
+logger = logging.getLogger(__name__)
+
+
+def _cutoff(retention_days: int):
+    # Raw timestamps are stored naive UTC
+    return (utcnow() - timedelta(days=retention_days)).replace(tzinfo=None)
+
+
+def _claim(db: Session, model, criteria, order_by, batch_size: int, columns) -> list:
+    """Delete up to batch_size rows matching criteria and return their columns.
+    Rows locked by a concurrent run are skipped rather than waited for."""
+    batch = select(model.id).where(criteria).order_by(*order_by).limit(batch_size).with_for_update(skip_locked=True)
+    return db.execute(delete(model).where(model.id.in_(batch.scalar_subquery())).returning(*columns)).all()
+
+
+def _greatest(db: Session):
+    return func.max if db.get_bind().dialect.name == "sqlite" else func.greatest
+
+
+def _add_to_aggregates(db: Session, rows) -> None:
+    groups = {}
+    for row in rows:
+        key = (row.user_id, row.timestamp.date(), row.activity_type)
+        group = groups.setdefault(key, {
+            "user_id": key[0], "day": key[1], "activity_type": key[2],
+            "session_count": 0, "total_duration": 0.0, "last_timestamp": row.timestamp,
+        })
+        group["session_count"] += 1
+        group["total_duration"] += row.duration
+        group["last_timestamp"] = max(group["last_timestamp"], row.timestamp)
+
+    greatest = _greatest(db)
+    stmt = dialect_insert(db, ActivityDailyAggregate).values(list(groups.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ActivityDailyAggregate.user_id, ActivityDailyAggregate.day, ActivityDailyAggregate.activity_type],
+        set_={
+            "session_count": ActivityDailyAggregate.session_count + stmt.excluded.session_count,
+            "total_duration": ActivityDailyAggregate.total_duration + stmt.excluded.total_duration,
+            "last_timestamp": greatest(ActivityDailyAggregate.last_timestamp, stmt.excluded.last_timestamp),
+        },
+    )
+    db.execute(stmt)
+
+
+def compact_activities(db: Session, cutoff, batch_size: int = COMPACTION_BATCH_SIZE, dry_run: bool = False) -> int:
+    """Fold physical activities older than cutoff into daily aggregates.
+    Returns the number of raw rows compacted (or eligible, on a dry run)."""
+    old = PhysicalActivity.timestamp < cutoff
+    if dry_run:
+        return db.scalar(select(func.count()).select_from(PhysicalActivity).where(old))
+
+    compacted = 0
+    while True:
+        rows = _claim(db, PhysicalActivity, old, [PhysicalActivity.id], batch_size, [
+            PhysicalActivity.user_id, PhysicalActivity.activity_type, PhysicalActivity.duration,
+            PhysicalActivity.timestamp,
+        ])
+        if not rows:
+            return compacted
+        _add_to_aggregates(db, rows)
+        mark_changed(db, {row.user_id for row in rows})
+        db.commit()
+        compacted += len(rows)
+
+
+def _merge_into_sessions(db: Session, user_id: int, segments: list, frozen) -> None:
+    """Merge one user's segments, sorted by start_time, with the stored
+    sessions they can overlap and replace those sessions. Nights before
+    frozen were compacted by an earlier run, so their totals take the
+    difference; later nights are current already (see refresh_nights)."""
+    # Serialise with other compactions and sleep writes of this user
+    db.query(User.id).filter(User.id == user_id).with_for_update(key_share=True).first()
+    # Merged sessions are assumed to be shorter than a day, as in refresh_nights
+    stored = [tuple(row) for row in db.execute(
+        select(SleepSession.start_time, SleepSession.end_time)
+        .where(SleepSession.user_id == user_id,
+                SleepSession.start_time >= segments[0][0] - timedelta(days=1),
+                SleepSession.start_time <= max(end for _, end in segments))
+    )]
+    sessions = list(merge_sessions(sorted(segments + stored)))
+
+    if frozen is not None:
+        nights = {}
+        for start, end in stored:
+            nights.setdefault(night_of(start), [0, 0])[0] -= session_minutes(start, end)
+        for start, end, _ in sessions:
+            nights.setdefault(night_of(start), [0, 0])[0] += session_minutes(start, end)
+        starts = [start for start, _, _ in sessions]
+        for start, _ in segments:
+            nights[night_of(starts[bisect_right(starts, start) - 1])][1] += 1
+        rows = [
+            {"user_id": user_id, "night": night, "total_minutes": minutes, "segment_count": count}
+            for night, (minutes, count) in nights.items() if night < frozen and (minutes or count)
+        ]
+        if rows:
+            stmt = dialect_insert(db, SleepNight).values(rows)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[SleepNight.user_id, SleepNight.night],
+                set_={
+                    "total_minutes": SleepNight.total_minutes + stmt.excluded.total_minutes,
+                    "segment_count": SleepNight.segment_count + stmt.excluded.segment_count,
+                },
+            ))
+
+    if stored:
+        db.execute(delete(SleepSession).where(SleepSession.user_id == user_id,
+                                              SleepSession.start_time.in_([start for start, _ in stored])))
+    db.execute(insert(SleepSession), [
+        {"user_id": user_id, "start_time": start, "end_time": end} for start, end, _ in sessions
+    ])
+
+
+def compact_sleep(db: Session, cutoff, batch_size: int = COMPACTION_BATCH_SIZE, dry_run: bool = False) -> int:
+    """Freeze the nights before cutoff and replace their raw segments with
+    merged sessions, folding in segments that arrived late for nights frozen
+    earlier. Returns the number of segments compacted (or eligible, on a dry
+    run)."""
+    horizon = night_of(cutoff)
+    frozen = frozen_before(db)
+    if frozen is not None:
+        horizon = max(horizon, frozen)
+    old = SleepActivity.start_time < night_start(horizon)
+    if dry_run:
+        return db.scalar(select(func.count()).select_from(SleepActivity).where(old))
+
+    # Freeze first so no refresh recomputes a night from partially deleted segments.
+    # The watermark only moves forward, whichever concurrent run commits last.
+    stmt = dialect_insert(db, CompactionWatermark).values(entity=SLEEP_WATERMARK,
+                                                          compacted_before=night_start(horizon))
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[CompactionWatermark.entity],
+        set_={"compacted_before": _greatest(db)(CompactionWatermark.compacted_before,
+                                                stmt.excluded.compacted_before)},
+    ))
+    db.commit()
+    compacted = 0
+    while True:
+        rows = _claim(db, SleepActivity, old, [SleepActivity.user_id, SleepActivity.start_time], batch_size,
+                      [SleepActivity.user_id, SleepActivity.start_time, SleepActivity.end_time])
+        if not rows:
+            return compacted
+        # RETURNING has no order. A user split across batches is merged with the
+        # sessions the previous batch stored.
+        rows.sort(key=lambda row: (row.user_id, row.start_time))
+        for user_id, user_rows in groupby(rows, key=lambda row: row.user_id):
+            _merge_into_sessions(db, user_id, [(row.start_time, row.end_time) for row in user_rows], frozen)
+        mark_changed(db, {row.user_id for row in rows})
+        db.commit()
+        compacted += len(rows)
+
+
+def _totals(db: Session) -> dict:
+    """Per-user (activity sessions, activity minutes, sleep minutes) across raw and compacted data."""
+    totals = {}
+
+    def add(rows, index):
+        for user_id, value in rows:
+            totals.setdefault(user_id, [0, 0.0, 0])[index] += value or 0
+
+    add(db.execute(select(PhysicalActivity.user_id, func.count()).group_by(PhysicalActivity.user_id)), 0)
+    add(db.execute(select(ActivityDailyAggregate.user_id, func.sum(ActivityDailyAggregate.session_count))
+                   .group_by(ActivityDailyAggregate.user_id)), 0)
+    add(db.execute(select(PhysicalActivity.user_id, func.sum(PhysicalActivity.duration))
+                   .group_by(PhysicalActivity.user_id)), 1)
+    add(db.execute(select(ActivityDailyAggregate.user_id, func.sum(ActivityDailyAggregate.total_duration))
+                   .group_by(ActivityDailyAggregate.user_id)), 1)
+    add(db.execute(select(SleepNight.user_id, func.sum(SleepNight.total_minutes)).group_by(SleepNight.user_id)), 2)
+    return {user_id: (count, round(minutes, 6), sleep) for user_id, (count, minutes, sleep) in totals.items()}
+
+
+def _mismatched(before: dict, after: dict, late_sleep: set) -> list[int]:
+    mismatched = []
+    for user_id in before.keys() | after.keys():
+        old, new = before.get(user_id, (0, 0.0, 0)), after.get(user_id, (0, 0.0, 0))
+        # Late segments legitimately add to frozen nights
+        compared = 2 if user_id in late_sleep else 3
+        if old[:compared] != new[:compared]:
+            mismatched.append(user_id)
+    return sorted(mismatched)
+
+
+def compact(db: Session, retention_days: int = RETENTION_DAYS, batch_size: int = COMPACTION_BATCH_SIZE,
+            dry_run: bool = False, verify: bool = False) -> dict:
+    """Compact activities and sleep segments older than retention_days. With
+    verify, per-user totals are compared before and after and the user ids
+    whose totals changed are reported under "mismatched_users"."""
+    cutoff = _cutoff(retention_days)
+    before = _totals(db) if verify and not dry_run else None
+    frozen = frozen_before(db)
+    late_sleep = set()
+    if before is not None and frozen is not None:
+        late_sleep = set(db.scalars(select(SleepActivity.user_id).where(
+            SleepActivity.start_time < night_start(frozen))))
+
+    report = {
+        "cutoff": cutoff,
+        "dry_run": dry_run,
+        "physical_activities": compact_activities(db, cutoff, batch_size, dry_run),
+        "sleep_activities": compact_sleep(db, cutoff, batch_size, dry_run),
+    }
+    if before is not None:
+        report["mismatched_users"] = _mismatched(before, _totals(db), late_sleep)
+    return report
+
+
+def run_periodic_compaction(session_factory, stop: threading.Event, interval: int = INTERVAL_SECONDS):
+    """Thread target: compact every interval seconds until stop is set."""
+    while not stop.wait(interval):
+        db = session_factory()
+        try:
+            compact(db)
+        except Exception:
+            logger.exception("Compaction failed; retrying in %s seconds", interval)
+        finally:
+            db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold old raw activity and sleep rows into daily aggregates.")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS, help="keep raw rows this many days")
+    parser.add_argument("--batch-size", type=int, default=COMPACTION_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would be compacted")
+    parser.add_argument("--verify", action="store_true", help="check per-user totals are unchanged afterwards")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        report = compact(db, args.retention_days, args.batch_size, args.dry_run, args.verify)
+    finally:
+        db.close()
+    print(report)
+    if report.get("mismatched_users"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,360 @@
-from sqlalchemy.orm import Session
-from healthDB import User, PhysicalActivity, SleepActivity, BloodTest
-from schemas import UserCreate, PhysicalActivityCreate, SleepActivityCreate, BloodTestCreate
+from sqlalchemy import Integer, case, cast, column, delete, extract, func, insert, select, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.orm.attributes import set_committed_value
+from healthDB import User, PhysicalActivity, ActivityDailyAggregate, SleepActivity, SleepNight, SleepSession, BloodTest, UserScore, utcnow
+from schemas import (UserCreate, PhysicalActivityCreate, SleepActivityCreate, BloodTestCreate,
+                     PhysicalActivityBulkPatch, SleepActivityBulkPatch, BloodTestBulkPatch)
 from datetime import datetime
+from sleep_nights import refresh_nights
+from changefeed import INSERT, UPDATE, DELETE, record_change, record_changes
 
 
+def _live_user(model):
+    """Limits model's rows to users that exist and are not soft-deleted."""
+    return select(User.id).where(User.id == model.user_id, User.deleted_at.is_(None)).exists()
+
+
+def _only(query, model, fields):
+    # Restrict the SELECT to the requested columns; the primary key is always loaded.
+    if fields:
+        query = query.options(load_only(*(getattr(model, name) for name in fields)))
+    return query
+
+
+STREAM_CHUNK_SIZE = 1000
+
+
+def _stream_rows(db: Session, model, fields: list[str], *criteria, skip: int = 0, limit: int | None = None,
+                 chunk_size: int = STREAM_CHUNK_SIZE):
+    """Yield lists of at most chunk_size row dicts. yield_per fetches through
+    a server-side cursor where the driver has one (psycopg2 named cursors),
+    so only one chunk is ever held in memory."""
+    stmt = (select(*(getattr(model, name) for name in fields)).where(*criteria)
+            .order_by(model.id).offset(skip).limit(limit))
+    result = db.execute(stmt.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+    finally:
+        result.close()
+
+
+UPSERT_CHUNK_SIZE = 500
+
+def dialect_insert(db: Session, model):
+    """INSERT for model supporting on_conflict_do_update on the session's database."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {dialect}")
+
+def _upsert_rows(db: Session, model, rows: list[dict], update_columns: list[str]) -> list[dict]:
+    """Insert rows in multi-row statements. Rows carrying an external_id are
+    upserted on (user_id, external_id) so client retries update instead of
+    duplicating. Returns one {id, external_id, created} per input row, in
+    order. Does not commit."""
+    results = [None] * len(rows)
+
+    # Last occurrence wins when a batch repeats an external_id
+    keyed = {}
+    for index, row in enumerate(rows):
+        if row.get("external_id"):
+            keyed.setdefault((row["user_id"], row["external_id"]), []).append(index)
+    plain = [index for index, row in enumerate(rows) if not row.get("external_id")]
+
+    keys = list(keyed)
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        chunk = keys[start:start + UPSERT_CHUNK_SIZE]
+        existing = set(
+            db.query(model.user_id, model.external_id)
+            .filter(model.user_id.in_({user_id for user_id, _ in chunk}),
+                    model.external_id.in_({external_id for _, external_id in chunk}))
+            .all()
+        )
+        stmt = dialect_insert(db, model).values([rows[keyed[key][-1]] for key in chunk])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.user_id, model.external_id],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        ).returning(model.id, model.user_id, model.external_id)
+        for row_id, user_id, external_id in db.execute(stmt):
+            created = (user_id, external_id) not in existing
+            for index in keyed[(user_id, external_id)]:
+                results[index] = {"id": row_id, "external_id": external_id, "created": created}
+                # Repeats within the batch hit the row the first one created
+                created = False
+
+    for start in range(0, len(plain), UPSERT_CHUNK_SIZE):
+        chunk = plain[start:start + UPSERT_CHUNK_SIZE]
+        stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+        for index, (row_id,) in zip(chunk, db.execute(stmt, [rows[index] for index in chunk])):
+            results[index] = {"id": row_id, "external_id": None, "created": True}
+
+    return results
+
+def _record_upserts(db: Session, entity: str, rows: list[dict], results: list[dict]):
+    for operation, created in ((INSERT, True), (UPDATE, False)):
+        record_changes(db, entity, operation, [
+            (result["id"], row["user_id"]) for row, result in zip(rows, results) if result["created"] is created
+        ])
+
+def _values_source(db: Session, table, names: tuple, rows: list[tuple]):
+    """(VALUES ...) AS patch (names...) as a FROM source. SQLite doesn't
+    take a column list on the alias, so its columns are renamed from
+    column1, column2, ... in a subquery instead."""
+    if db.get_bind().dialect.name == "sqlite":
+        raw = values(*(column(f"column{index}", table.c[name].type) for index, name in enumerate(names, 1))).data(rows)
+        return select(*(raw.c[f"column{index}"].label(name) for index, name in enumerate(names, 1))).subquery("patch")
+    return values(*(column(name, table.c[name].type) for name in names), name="patch").data(rows)
+
+def _patch_rows(db: Session, model, patches: list[dict], computed=None, returning=()) -> list:
+    """Apply {id, **changes} patches with one UPDATE ... FROM (VALUES ...)
+    per set of changed columns and chunk; later patches of the same id win.
+    computed(new) may add SET expressions derived from the new values.
+    Returns the RETURNING rows (id, user_id, *returning) of the rows that
+    exist and belong to a live user. Does not commit."""
+    merged = {}
+    for patch in patches:
+        merged.setdefault(patch["id"], {}).update({key: value for key, value in patch.items() if key != "id"})
+    groups = {}
+    for row_id, changes in merged.items():
+        if changes:
+            groups.setdefault(tuple(sorted(changes)), []).append({"id": row_id, **changes})
+
+    updated = []
+    table = model.__table__
+    for columns, rows in groups.items():
+        names = ("id", *columns)
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+            source = _values_source(db, table, names, [tuple(row[name] for name in names) for row in chunk])
+            new = {name: source.c[name] for name in columns}
+            if db.get_bind().dialect.name != "sqlite":
+                # Postgres types VALUES columns from their first row; pin them to the target types
+                new = {name: cast(value, table.c[name].type) for name, value in new.items()}
+            assignments = dict(new)
+            if computed is not None:
+                assignments.update(computed(new))
+            stmt = (
+                update(model)
+                .where(model.id == source.c.id, _live_user(model))
+                .values(assignments)
+                .returning(model.id, model.user_id, *returning)
+                .execution_options(synchronize_session=False)
+            )
+            updated.extend(db.execute(stmt).all())
+    return updated
+
+def _patch_results(patches: list[dict], updated) -> list[dict]:
+    updated_ids = {row.id for row in updated}
+    return [{"id": patch["id"], "updated": patch["id"] in updated_ids} for patch in patches]
+
 def create_user(db: Session, user: UserCreate):
     db_user = User(username=user.username, email=user.email)
     db.add(db_user)
+    db.flush()
+    record_change(db, "user", INSERT, db_user.id, db_user.id)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(User).offset(skip).limit(limit).all()
+def get_users(db: Session, skip: int = 0, limit: int = 100, fields: list[str] | None = None):
+    return _only(db.query(User), User, fields).filter(User.deleted_at.is_(None)).offset(skip).limit(limit).all()
+
+def stream_users(db: Session, fields: list[str], skip: int = 0, limit: int | None = None):
+    return _stream_rows(db, User, fields, User.deleted_at.is_(None), skip=skip, limit=limit)
+
+def get_user(db: Session, user_id: int, fields: list[str] | None = None):
+    return _only(db.query(User), User, fields).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+
+def user_is_live(db: Session, user_id: int) -> bool:
+    return db.scalar(select(User.id).where(User.id == user_id, User.deleted_at.is_(None))) is not None
 
-def get_user(db: Session, user_id: int):
-    return db.query(User).filter(User.id == user_id).first()
+def live_user_ids(db: Session, user_ids) -> set[int]:
+    return set(db.scalars(select(User.id).where(User.id.in_(set(user_ids)), User.deleted_at.is_(None))))
+
+def get_user_profile(db: Session, user_id: int, limit: int = 50):
+    """Load a user with the most recent `limit` rows of each relationship in
+    four queries, whatever the size of the history."""
+    db_user = get_user(db, user_id)
+    if not db_user:
+        return None
+    recent = {
+        "physical_activities": db.query(PhysicalActivity).filter(PhysicalActivity.user_id == user_id)
+            .order_by(PhysicalActivity.timestamp.desc(), PhysicalActivity.id.desc()),
+        "sleep_activities": db.query(SleepActivity).filter(SleepActivity.user_id == user_id)
+            .order_by(SleepActivity.start_time.desc(), SleepActivity.id.desc()),
+        "blood_tests": db.query(BloodTest).filter(BloodTest.user_id == user_id)
+            .order_by(BloodTest.timestamp.desc(), BloodTest.id.desc()),
+    }
+    for relationship, query in recent.items():
+        # Populate the collection without triggering its lazy load of the full history
+        set_committed_value(db_user, relationship, query.limit(limit).all())
+    return db_user
 
 def update_user(db: Session, user_id: int, updates: dict):
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = get_user(db, user_id)
     if not db_user:
         return None
     for key, value in updates.items():
         setattr(db_user, key, value)
+    record_change(db, "user", UPDATE, user_id, user_id)
     db.commit()
     db.refresh(db_user)
     return db_user
 
+# Tables holding per-user rows, purged before the user row itself
+USER_DATA_MODELS = (PhysicalActivity, ActivityDailyAggregate, SleepActivity, SleepNight, SleepSession, BloodTest,
+                    UserScore)
+
 def delete_user(db: Session, user_id: int):
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = get_user(db, user_id)
     if not db_user:
         return None
+    # One set-based DELETE per table instead of loading every row through the ORM cascade
+    for model in USER_DATA_MODELS:
+        db.execute(delete(model).where(model.user_id == user_id))
     db.delete(db_user)
+    record_change(db, "user", DELETE, user_id, user_id)
+    db.commit()
+    return db_user
+
+def soft_delete_user(db: Session, user_id: int):
+    """Hide a user from reads right away; user_purge.purge_user removes the data later."""
+    db_user = get_user(db, user_id)
+    if not db_user:
+        return None
+    db_user.deleted_at = utcnow()
+    record_change(db, "user", DELETE, user_id, user_id)
     db.commit()
+    db.refresh(db_user)
     return db_user
 
+def _physical_activity_row(user_id: int, activity: PhysicalActivityCreate, timestamp: datetime | None = None) -> dict:
+    return {
+        "user_id": user_id,
+        "activity_type": activity.activity_type,
+        "duration": activity.duration,
+        "timestamp": timestamp or utcnow(),
+        "external_id": activity.external_id,
+    }
+
 def create_physical_activity(db: Session, user_id: int, activity: PhysicalActivityCreate):
+    if activity.external_id:
+        return db.get(PhysicalActivity, upsert_physical_activities(db, user_id, [activity])[0]["id"])
     db_activity = PhysicalActivity(user_id=user_id, activity_type=activity.activity_type, duration=activity.duration)
     db.add(db_activity)
+    db.flush()
+    record_change(db, "physical_activity", INSERT, db_activity.id, user_id)
     db.commit()
     db.refresh(db_activity)
     return db_activity
 
-def get_physical_activity(db: Session, activity_id: int):
-    return db.query(PhysicalActivity).filter(PhysicalActivity.id == activity_id).first()
+def upsert_physical_activities(db: Session, user_id: int, activities: list[PhysicalActivityCreate]):
+    return ingest_physical_activities(db, [(user_id, activity, None) for activity in activities])
+
+def ingest_physical_activities(db: Session, items: list[tuple[int, PhysicalActivityCreate, datetime | None]]):
+    """Upsert (user_id, activity, timestamp) items for any number of users
+    in one transaction; a None timestamp means now."""
+    rows = [_physical_activity_row(user_id, activity, timestamp) for user_id, activity, timestamp in items]
+    results = _upsert_rows(db, PhysicalActivity, rows, ["activity_type", "duration"])
+    _record_upserts(db, "physical_activity", rows, results)
+    db.commit()
+    return results
+
+def get_physical_activity(db: Session, activity_id: int, fields: list[str] | None = None):
+    return _only(db.query(PhysicalActivity), PhysicalActivity, fields).filter(
+        PhysicalActivity.id == activity_id, _live_user(PhysicalActivity)).first()
 
-def get_user_activities(db: Session, user_id: int):
-    return db.query(PhysicalActivity).filter(PhysicalActivity.user_id == user_id).all()
+def get_user_activities(db: Session, user_id: int, fields: list[str] | None = None):
+    return _only(db.query(PhysicalActivity), PhysicalActivity, fields).filter(
+        PhysicalActivity.user_id == user_id, _live_user(PhysicalActivity)).all()
+
+def stream_user_activities(db: Session, user_id: int, fields: list[str]):
+    return _stream_rows(db, PhysicalActivity, fields, PhysicalActivity.user_id == user_id, _live_user(PhysicalActivity))
+
+def get_activity_summary(db: Session, user_id: int, start: datetime | None = None, end: datetime | None = None):
+    """Count, total/mean duration and last timestamp per activity type in
+    one GROUP BY over [start, end), combined with the daily aggregates of
+    compacted rows. Compacted days are filtered by calendar day."""
+    query = db.query(
+        PhysicalActivity.activity_type,
+        func.count(PhysicalActivity.id).label("count"),
+        func.sum(PhysicalActivity.duration).label("total_duration"),
+        func.max(PhysicalActivity.timestamp).label("last_timestamp"),
+    ).filter(PhysicalActivity.user_id == user_id, _live_user(PhysicalActivity))
+    compacted = db.query(
+        ActivityDailyAggregate.activity_type,
+        func.sum(ActivityDailyAggregate.session_count).label("count"),
+        func.sum(ActivityDailyAggregate.total_duration).label("total_duration"),
+        func.max(ActivityDailyAggregate.last_timestamp).label("last_timestamp"),
+    ).filter(ActivityDailyAggregate.user_id == user_id, _live_user(ActivityDailyAggregate))
+    if start is not None:
+        query = query.filter(PhysicalActivity.timestamp >= start)
+        compacted = compacted.filter(ActivityDailyAggregate.day >= start.date())
+    if end is not None:
+        query = query.filter(PhysicalActivity.timestamp < end)
+        compacted = compacted.filter(ActivityDailyAggregate.day < end.date())
+
+    summary = {}
+    for rows in (query.group_by(PhysicalActivity.activity_type),
+                 compacted.group_by(ActivityDailyAggregate.activity_type)):
+        for row in rows:
+            entry = summary.setdefault(row.activity_type, {
+                "activity_type": row.activity_type, "count": 0, "total_duration": 0.0, "last_timestamp": None,
+            })
+            entry["count"] += row.count
+            entry["total_duration"] += row.total_duration
+            if entry["last_timestamp"] is None or row.last_timestamp > entry["last_timestamp"]:
+                entry["last_timestamp"] = row.last_timestamp
+    for entry in summary.values():
+        entry["mean_duration"] = entry["total_duration"] / entry["count"]
+    return [summary[activity_type] for activity_type in sorted(summary)]
+
+def patch_physical_activities(db: Session, patches: list[PhysicalActivityBulkPatch]) -> list[dict]:
+    """Partially update many activities in one transaction; one
+    {id, updated} result per patch, in order."""
+    patches = [patch.model_dump(exclude_unset=True) for patch in patches]
+    updated = _patch_rows(db, PhysicalActivity, patches)
+    record_changes(db, "physical_activity", UPDATE, [(row.id, row.user_id) for row in updated])
+    db.commit()
+    return _patch_results(patches, updated)
 
 def update_physical_activity(db: Session, activity_id: int, updates: dict):
-    activity = db.query(PhysicalActivity).filter(PhysicalActivity.id == activity_id).first()
+    activity = db.query(PhysicalActivity).filter(PhysicalActivity.id == activity_id, _live_user(PhysicalActivity)).first()
     if not activity:
         return None
     for key, value in updates.items():
         setattr(activity, key, value)
+    record_change(db, "physical_activity", UPDATE, activity.id, activity.user_id)
     db.commit()
     db.refresh(activity)
     return activity
 
 def delete_physical_activity(db: Session, activity_id: int):
-    activity = db.query(PhysicalActivity).filter(PhysicalActivity.id == activity_id).first()
+    activity = db.query(PhysicalActivity).filter(PhysicalActivity.id == activity_id, _live_user(PhysicalActivity)).first()
     if not activity:
         return None
     db.delete(activity)
+    record_change(db, "physical_activity", DELETE, activity.id, activity.user_id)
     db.commit()
     return activity
 
+def _sleep_activity_row(user_id: int, sleep: SleepActivityCreate) -> dict:
+    return {
+        "user_id": user_id,
+        "start_time": sleep.start_time,
+        "end_time": sleep.end_time,
+        "quality": sleep.quality,
+        "duration": int((sleep.end_time - sleep.start_time).total_seconds() / 60),
+        "external_id": sleep.external_id,
+    }
+
 def create_sleep_activity(db: Session, user_id: int, sleep: SleepActivityCreate):
+    if sleep.external_id:
+        return db.get(SleepActivity, upsert_sleep_activities(db, user_id, [sleep])[0]["id"])
     duration = int((sleep.end_time - sleep.start_time).total_seconds() / 60)
     db_sleep = SleepActivity(
         user_id=user_id,
@@ -76,20 +364,41 @@ def create_sleep_activity(db: Session, user_id: int, sleep: SleepActivityCreate)
         duration=duration
     )
     db.add(db_sleep)
+    db.flush()
+    refresh_nights(db, user_id, [db_sleep.start_time])
+    record_change(db, "sleep_activity", INSERT, db_sleep.id, user_id)
     db.commit()
     db.refresh(db_sleep)
     return db_sleep
 
-def get_sleep_activity(db: Session, sleep_id: int):
-    return db.query(SleepActivity).filter(SleepActivity.id == sleep_id).first()
+def upsert_sleep_activities(db: Session, user_id: int, sleeps: list[SleepActivityCreate]):
+    rows = [_sleep_activity_row(user_id, sleep) for sleep in sleeps]
+    # Upserted rows may move, so their previous nights need refreshing too
+    external_ids = [row["external_id"] for row in rows if row["external_id"]]
+    previous_starts = [start for (start,) in db.query(SleepActivity.start_time).filter(
+        SleepActivity.user_id == user_id, SleepActivity.external_id.in_(external_ids))] if external_ids else []
+    results = _upsert_rows(db, SleepActivity, rows, ["start_time", "end_time", "quality", "duration"])
+    refresh_nights(db, user_id, previous_starts + [row["start_time"] for row in rows])
+    _record_upserts(db, "sleep_activity", rows, results)
+    db.commit()
+    return results
+
+def get_sleep_activity(db: Session, sleep_id: int, fields: list[str] | None = None):
+    return _only(db.query(SleepActivity), SleepActivity, fields).filter(
+        SleepActivity.id == sleep_id, _live_user(SleepActivity)).first()
+
+def get_user_sleep_activities(db: Session, user_id: int, fields: list[str] | None = None):
+    return _only(db.query(SleepActivity), SleepActivity, fields).filter(
+        SleepActivity.user_id == user_id, _live_user(SleepActivity)).all()
 
-def get_user_sleep_activities(db: Session, user_id: int):
-    return db.query(SleepActivity).filter(SleepActivity.user_id == user_id).all()
+def stream_user_sleep_activities(db: Session, user_id: int, fields: list[str]):
+    return _stream_rows(db, SleepActivity, fields, SleepActivity.user_id == user_id, _live_user(SleepActivity))
 
 def update_sleep_activity(db: Session, sleep_id: int, updates: dict):
-    sleep = db.query(SleepActivity).filter(SleepActivity.id == sleep_id).first()
+    sleep = db.query(SleepActivity).filter(SleepActivity.id == sleep_id, _live_user(SleepActivity)).first()
     if not sleep:
         return None
+    previous_start = sleep.start_time
 
     if "start_time" in updates and isinstance(updates["start_time"], str):
         updates["start_time"] = datetime.fromisoformat(updates["start_time"])
@@ -101,21 +410,78 @@ def update_sleep_activity(db: Session, sleep_id: int, updates: dict):
 
     if "start_time" in updates or "end_time" in updates:
         sleep.duration = int((sleep.end_time - sleep.start_time).total_seconds() / 60)
+        db.flush()
+        refresh_nights(db, sleep.user_id, [previous_start, sleep.start_time])
 
+    record_change(db, "sleep_activity", UPDATE, sleep.id, sleep.user_id)
     db.commit()
     db.refresh(sleep)
     return sleep
 
+def _minutes_between(db: Session, start, end):
+    # Whole minutes, truncated like the before_insert hook in healthDB
+    if db.get_bind().dialect.name == "sqlite":
+        seconds = cast(func.round((func.julianday(end) - func.julianday(start)) * 86400), Integer)
+    else:
+        seconds = cast(extract("epoch", end - start), Integer)
+    return seconds // 60
+
+def patch_sleep_activities(db: Session, patches: list[SleepActivityBulkPatch]) -> list[dict]:
+    """Partially update many sleep segments in one transaction, recomputing
+    duration in SQL and refreshing the affected nights. One {id, updated}
+    result per patch, in order."""
+    patches = [patch.model_dump(exclude_unset=True) for patch in patches]
+    moved_ids = [patch["id"] for patch in patches if "start_time" in patch or "end_time" in patch]
+    previous_starts = db.execute(
+        select(SleepActivity.user_id, SleepActivity.start_time).where(SleepActivity.id.in_(moved_ids))
+    ).all() if moved_ids else []
+
+    def duration(new):
+        if "start_time" not in new and "end_time" not in new:
+            return {}
+        start = new.get("start_time", SleepActivity.start_time)
+        end = new.get("end_time", SleepActivity.end_time)
+        return {"duration": _minutes_between(db, start, end)}
+
+    updated = _patch_rows(db, SleepActivity, patches, computed=duration, returning=(SleepActivity.start_time,))
+    starts_by_user = {}
+    for user_id, start_time in previous_starts:
+        starts_by_user.setdefault(user_id, []).append(start_time)
+    moved = set(moved_ids)
+    for row in updated:
+        if row.id in moved:
+            starts_by_user.setdefault(row.user_id, []).append(row.start_time)
+    for user_id, starts in starts_by_user.items():
+        refresh_nights(db, user_id, starts)
+    record_changes(db, "sleep_activity", UPDATE, [(row.id, row.user_id) for row in updated])
+    db.commit()
+    return _patch_results(patches, updated)
+
 def delete_sleep_activity(db: Session, sleep_id: int):
-    sleep = db.query(SleepActivity).filter(SleepActivity.id == sleep_id).first()
+    sleep = db.query(SleepActivity).filter(SleepActivity.id == sleep_id, _live_user(SleepActivity)).first()
     if not sleep:
         return None
     db.delete(sleep)
+    db.flush()
+    refresh_nights(db, sleep.user_id, [sleep.start_time])
+    record_change(db, "sleep_activity", DELETE, sleep.id, sleep.user_id)
     db.commit()
     return sleep
 
 
+def _blood_test_row(user_id: int, test: BloodTestCreate) -> dict:
+    return {
+        "user_id": user_id,
+        "test_name": test.test_name,
+        "result": test.result,
+        "unit": test.unit,
+        "timestamp": utcnow(),
+        "external_id": test.external_id,
+    }
+
 def create_blood_test(db: Session, user_id: int, test: BloodTestCreate):
+    if test.external_id:
+        return db.get(BloodTest, upsert_blood_tests(db, user_id, [test])[0]["id"])
     db_test = BloodTest(
         user_id=user_id,
         test_name=test.test_name,
@@ -123,30 +489,86 @@ def create_blood_test(db: Session, user_id: int, test: BloodTestCreate):
         unit=test.unit
     )
     db.add(db_test)
+    db.flush()
+    record_change(db, "blood_test", INSERT, db_test.id, user_id)
     db.commit()
     db.refresh(db_test)
     return db_test
 
-def get_blood_test(db: Session, test_id: int):
-    return db.query(BloodTest).filter(BloodTest.id == test_id).first()
+def upsert_blood_tests(db: Session, user_id: int, tests: list[BloodTestCreate]):
+    rows = [_blood_test_row(user_id, test) for test in tests]
+    results = _upsert_rows(db, BloodTest, rows, ["test_name", "result", "unit"])
+    _record_upserts(db, "blood_test", rows, results)
+    db.commit()
+    return results
+
+def get_blood_test(db: Session, test_id: int, fields: list[str] | None = None):
+    return _only(db.query(BloodTest), BloodTest, fields).filter(
+        BloodTest.id == test_id, _live_user(BloodTest)).first()
+
+def get_user_blood_tests(db: Session, user_id: int, fields: list[str] | None = None):
+    return _only(db.query(BloodTest), BloodTest, fields).filter(
+        BloodTest.user_id == user_id, _live_user(BloodTest)).all()
+
+def stream_user_blood_tests(db: Session, user_id: int, fields: list[str]):
+    return _stream_rows(db, BloodTest, fields, BloodTest.user_id == user_id, _live_user(BloodTest))
 
-def get_user_blood_tests(db: Session, user_id: int):
-    return db.query(BloodTest).filter(BloodTest.user_id == user_id).all()
+def get_blood_test_summary(db: Session, user_id: int, start: datetime | None = None, end: datetime | None = None):
+    """Latest, min, max and mean result per test_name and unit over
+    [start, end) in a single query; the latest row is picked with a window
+    function. Results in different units are never averaged together."""
+    ranked = select(
+        BloodTest.test_name, BloodTest.result, BloodTest.unit, BloodTest.timestamp,
+        func.row_number().over(
+            partition_by=(BloodTest.test_name, BloodTest.unit),
+            order_by=(BloodTest.timestamp.desc(), BloodTest.id.desc()),
+        ).label("rank"),
+    ).where(BloodTest.user_id == user_id, _live_user(BloodTest))
+    if start is not None:
+        ranked = ranked.where(BloodTest.timestamp >= start)
+    if end is not None:
+        ranked = ranked.where(BloodTest.timestamp < end)
+    ranked = ranked.subquery()
+
+    is_latest = ranked.c.rank == 1
+    summary = select(
+        ranked.c.test_name,
+        ranked.c.unit,
+        func.count().label("count"),
+        func.max(case((is_latest, ranked.c.result))).label("latest_result"),
+        ranked.c.unit.label("latest_unit"),
+        func.max(ranked.c.timestamp).label("latest_timestamp"),
+        func.min(ranked.c.result).label("min_result"),
+        func.max(ranked.c.result).label("max_result"),
+        func.avg(ranked.c.result).label("mean_result"),
+    ).group_by(ranked.c.test_name, ranked.c.unit).order_by(ranked.c.test_name, ranked.c.unit)
+    return [row._asdict() for row in db.execute(summary)]
 
 def update_blood_test(db: Session, test_id: int, updates: dict):
-    test = db.query(BloodTest).filter(BloodTest.id == test_id).first()
+    test = db.query(BloodTest).filter(BloodTest.id == test_id, _live_user(BloodTest)).first()
     if not test:
         return None
     for key, value in updates.items():
         setattr(test, key, value)
+    record_change(db, "blood_test", UPDATE, test.id, test.user_id)
     db.commit()
     db.refresh(test)
     return test
 
+def patch_blood_tests(db: Session, patches: list[BloodTestBulkPatch]) -> list[dict]:
+    """Partially update many blood tests in one transaction; one
+    {id, updated} result per patch, in order."""
+    patches = [patch.model_dump(exclude_unset=True) for patch in patches]
+    updated = _patch_rows(db, BloodTest, patches)
+    record_changes(db, "blood_test", UPDATE, [(row.id, row.user_id) for row in updated])
+    db.commit()
+    return _patch_results(patches, updated)
+
 def delete_blood_test(db: Session, test_id: int):
-    test = db.query(BloodTest).filter(BloodTest.id == test_id).first()
+    test = db.query(BloodTest).filter(BloodTest.id == test_id, _live_user(BloodTest)).first()
     if not test:
         return None
     db.delete(test)
+    record_change(db, "blood_test", DELETE, test.id, test.user_id)
     db.commit()
     return test
@@ -0,0 +1,85 @@
+"""One-off job that removes duplicate rows left behind by client retries.
+
+Rows stored before external ids existed have no external_id; they count as
+duplicates when they belong to the same user and share their natural key
+(type or test name, timestamp and values). Rows with an external_id can
+only repeat on a database that predates the (user_id, external_id)
+constraint; they count as duplicates when external_id and content match.
+The oldest row of each group is kept. Runs as a dry run unless --apply is
+given:
+
+    python dedup.py            # report duplicate counts
+    python dedup.py --apply    # delete them in batches
+"""
+import argparse
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from changefeed import DELETE, record_changes
+from healthDB import PhysicalActivity, SleepActivity, BloodTest
+
+DEDUP_KEYS = {
+    PhysicalActivity: ["user_id", "external_id", "activity_type", "duration", "timestamp"],
+    SleepActivity: ["user_id", "external_id", "start_time", "end_time", "quality"],
+    BloodTest: ["user_id", "external_id", "test_name", "result", "unit", "timestamp"],
+}
+CHANGE_ENTITIES = {
+    PhysicalActivity: "physical_activity",
+    SleepActivity: "sleep_activity",
+    BloodTest: "blood_test",
+}
+DELETE_BATCH_SIZE = 1000
+
+
+def duplicate_ids(db: Session, model) -> list[tuple[int, int]]:
+    """(id, user_id) of every row that has an older duplicate."""
+    ranked = select(
+        model.id,
+        model.user_id,
+        func.row_number().over(
+            # Window partitions group NULLs together, so rows without an
+            # external_id are compared on the rest of the key
+            partition_by=[getattr(model, column) for column in DEDUP_KEYS[model]],
+            order_by=model.id,
+        ).label("rank"),
+    ).subquery()
+    return [tuple(row) for row in db.execute(
+        select(ranked.c.id, ranked.c.user_id).where(ranked.c.rank > 1).order_by(ranked.c.id)
+    )]
+
+
+def deduplicate(db: Session, apply: bool = False) -> dict:
+    """Returns the number of duplicates found per table, deleting them in
+    batches of DELETE_BATCH_SIZE (one transaction each) when apply is set."""
+    report = {}
+    for model in DEDUP_KEYS:
+        ids = duplicate_ids(db, model)
+        report[model.__tablename__] = len(ids)
+        if not apply:
+            continue
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            batch = ids[start:start + DELETE_BATCH_SIZE]
+            db.execute(delete(model).where(model.id.in_([row_id for row_id, _ in batch])))
+            record_changes(db, CHANGE_ENTITIES[model], DELETE, batch)
+            db.commit()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove duplicate activity, sleep and blood test rows.")
+    parser.add_argument("--apply", action="store_true", help="delete duplicates instead of only reporting them")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        report = deduplicate(db, apply=args.apply)
+    finally:
+        db.close()
+    for table, count in report.items():
+        print(f"{table}: {count} duplicate rows {'deleted' if args.apply else 'found'}")
+
+
+if __name__ == "__main__":
+    main()
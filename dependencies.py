@@ -0,0 +1,9 @@
+from fastapi import Depends, HTTPException
+from sqlalchemy.orm import Session
+import crud
+from database import get_db
+
+def require_live_user(user_id: int, db: Session = Depends(get_db)):
+    """404 for per-user routes when the user is unknown or soft-deleted."""
+    if not crud.user_is_live(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
@@ -1,28 +1,61 @@
 # fastapi_activity.py
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 import crud, schemas
 from database import get_db
+from dependencies import require_live_user
+from fieldsets import parse_fields, projected_response
+from streaming import StreamFormat, get_session_factory, streamed_response
+from write_behind import BufferFull, WriteBehindBuffer, get_activity_buffer
 
 router = APIRouter(
     prefix="/activities",
     tags=["physical_activities"]
 )
 
-@router.post("/", response_model=schemas.PhysicalActivityResponse)
+@router.post("/", response_model=schemas.PhysicalActivityResponse, dependencies=[Depends(require_live_user)])
 def create_activity(user_id: int, activity: schemas.PhysicalActivityCreate, db: Session = Depends(get_db)):
     return crud.create_physical_activity(db, user_id, activity)
 
+@router.post("/batch", response_model=list[schemas.UpsertResult], dependencies=[Depends(require_live_user)])
+def create_activities(user_id: int, activities: list[schemas.PhysicalActivityCreate], db: Session = Depends(get_db)):
+    return crud.upsert_physical_activities(db, user_id, activities)
+
+@router.post("/buffered", response_model=schemas.IngestReceipt, status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(require_live_user)])
+def create_activity_buffered(user_id: int, activity: schemas.PhysicalActivityCreate,
+                             buffer: WriteBehindBuffer = Depends(get_activity_buffer)):
+    try:
+        return buffer.submit(user_id, activity)
+    except BufferFull:
+        raise HTTPException(status_code=503, detail="Ingestion queue is full", headers={"Retry-After": "1"})
+
 @router.get("/{activity_id}", response_model=schemas.PhysicalActivityResponse)
-def read_activity(activity_id: int, db: Session = Depends(get_db)):
-    db_activity = crud.get_physical_activity(db, activity_id)
+def read_activity(activity_id: int, fields: str | None = None, db: Session = Depends(get_db)):
+    columns = parse_fields(schemas.PhysicalActivityResponse, fields)
+    db_activity = crud.get_physical_activity(db, activity_id, fields=columns)
     if not db_activity:
         raise HTTPException(status_code=404, detail="Activity not found")
+    if columns:
+        return projected_response(db_activity, columns)
     return db_activity
 
-@router.get("/user/{user_id}", response_model=list[schemas.PhysicalActivityResponse])
-def read_user_activities(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_user_activities(db, user_id)
+@router.get("/user/{user_id}", response_model=list[schemas.PhysicalActivityResponse], dependencies=[Depends(require_live_user)])
+def read_user_activities(user_id: int, fields: str | None = None, stream: StreamFormat | None = None,
+                         db: Session = Depends(get_db), session_factory=Depends(get_session_factory)):
+    columns = parse_fields(schemas.PhysicalActivityResponse, fields)
+    if stream:
+        columns = columns or list(schemas.PhysicalActivityResponse.model_fields)
+        return streamed_response(session_factory, lambda db: crud.stream_user_activities(db, user_id, columns), stream)
+    rows = crud.get_user_activities(db, user_id, fields=columns)
+    if columns:
+        return projected_response(rows, columns)
+    return rows
+
+@router.get("/user/{user_id}/summary", response_model=list[schemas.ActivityTypeSummary], dependencies=[Depends(require_live_user)])
+def read_user_activity_summary(user_id: int, start: datetime | None = None, end: datetime | None = None, db: Session = Depends(get_db)):
+    return crud.get_activity_summary(db, user_id, start=start, end=end)
 
 @router.put("/{activity_id}", response_model=schemas.PhysicalActivityResponse)
 def update_activity(activity_id: int, updates: dict, db: Session = Depends(get_db)):
@@ -31,6 +64,18 @@ def update_activity(activity_id: int, updates: dict, db: Session = Depends(get_d
         raise HTTPException(status_code=404, detail="Activity not found")
     return updated
 
+@router.patch("/batch", response_model=list[schemas.PatchResult])
+def patch_activities(patches: list[schemas.PhysicalActivityBulkPatch], db: Session = Depends(get_db)):
+    return crud.patch_physical_activities(db, patches)
+
+@router.patch("/{activity_id}", response_model=schemas.PhysicalActivityResponse)
+def patch_activity(activity_id: int, changes: schemas.PhysicalActivityPatch, db: Session = Depends(get_db)):
+    crud.patch_physical_activities(db, [schemas.PhysicalActivityBulkPatch(id=activity_id, **changes.model_dump(exclude_unset=True))])
+    patched = crud.get_physical_activity(db, activity_id)
+    if not patched:
+        raise HTTPException(status_code=404, detail="Activity not found")
+    return patched
+
 @router.delete("/{activity_id}", response_model=schemas.PhysicalActivityResponse)
 def delete_activity(activity_id: int, db: Session = Depends(get_db)):
     deleted = crud.delete_physical_activity(db, activity_id)
@@ -1,27 +1,50 @@
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 import crud, schemas
 from database import get_db
+from dependencies import require_live_user
+from fieldsets import parse_fields, projected_response
+from streaming import StreamFormat, get_session_factory, streamed_response
 
 router = APIRouter(
     prefix="/blood",
     tags=["blood_tests"]
 )
 
-@router.post("/", response_model=schemas.BloodTestResponse)
+@router.post("/", response_model=schemas.BloodTestResponse, dependencies=[Depends(require_live_user)])
 def create_blood(user_id: int, test: schemas.BloodTestCreate, db: Session = Depends(get_db)):
     return crud.create_blood_test(db, user_id, test)
 
+@router.post("/batch", response_model=list[schemas.UpsertResult], dependencies=[Depends(require_live_user)])
+def create_blood_batch(user_id: int, tests: list[schemas.BloodTestCreate], db: Session = Depends(get_db)):
+    return crud.upsert_blood_tests(db, user_id, tests)
+
 @router.get("/{test_id}", response_model=schemas.BloodTestResponse)
-def read_blood(test_id: int, db: Session = Depends(get_db)):
-    db_test = crud.get_blood_test(db, test_id)
+def read_blood(test_id: int, fields: str | None = None, db: Session = Depends(get_db)):
+    columns = parse_fields(schemas.BloodTestResponse, fields)
+    db_test = crud.get_blood_test(db, test_id, fields=columns)
     if not db_test:
         raise HTTPException(status_code=404, detail="Blood test not found")
+    if columns:
+        return projected_response(db_test, columns)
     return db_test
 
-@router.get("/user/{user_id}", response_model=list[schemas.BloodTestResponse])
-def read_user_blood(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_user_blood_tests(db, user_id)
+@router.get("/user/{user_id}", response_model=list[schemas.BloodTestResponse], dependencies=[Depends(require_live_user)])
+def read_user_blood(user_id: int, fields: str | None = None, stream: StreamFormat | None = None,
+                    db: Session = Depends(get_db), session_factory=Depends(get_session_factory)):
+    columns = parse_fields(schemas.BloodTestResponse, fields)
+    if stream:
+        columns = columns or list(schemas.BloodTestResponse.model_fields)
+        return streamed_response(session_factory, lambda db: crud.stream_user_blood_tests(db, user_id, columns), stream)
+    rows = crud.get_user_blood_tests(db, user_id, fields=columns)
+    if columns:
+        return projected_response(rows, columns)
+    return rows
+
+@router.get("/user/{user_id}/summary", response_model=list[schemas.BloodTestSummary], dependencies=[Depends(require_live_user)])
+def read_user_blood_summary(user_id: int, start: datetime | None = None, end: datetime | None = None, db: Session = Depends(get_db)):
+    return crud.get_blood_test_summary(db, user_id, start=start, end=end)
 
 @router.put("/{test_id}", response_model=schemas.BloodTestResponse)
 def update_blood(test_id: int, updates: dict, db: Session = Depends(get_db)):
@@ -30,6 +53,18 @@ def update_blood(test_id: int, updates: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Blood test not found")
     return updated
 
+@router.patch("/batch", response_model=list[schemas.PatchResult])
+def patch_blood_batch(patches: list[schemas.BloodTestBulkPatch], db: Session = Depends(get_db)):
+    return crud.patch_blood_tests(db, patches)
+
+@router.patch("/{test_id}", response_model=schemas.BloodTestResponse)
+def patch_blood(test_id: int, changes: schemas.BloodTestPatch, db: Session = Depends(get_db)):
+    crud.patch_blood_tests(db, [schemas.BloodTestBulkPatch(id=test_id, **changes.model_dump(exclude_unset=True))])
+    patched = crud.get_blood_test(db, test_id)
+    if not patched:
+        raise HTTPException(status_code=404, detail="Blood test not found")
+    return patched
+
 @router.delete("/{test_id}", response_model=schemas.BloodTestResponse)
 def delete_blood(test_id: int, db: Session = Depends(get_db)):
     deleted = crud.delete_blood_test(db, test_id)
@@ -0,0 +1,14 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+import changefeed, schemas
+from database import get_db
+
+router = APIRouter(
+    prefix="/changes",
+    tags=["changes"]
+)
+
+@router.get("/", response_model=schemas.ChangePage)
+def read_changes(after: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    changes = changefeed.get_changes(db, after=after, limit=limit)
+    return {"changes": changes, "next_cursor": changes[-1].seq if changes else after}
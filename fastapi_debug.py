@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse
+import profiling
+
+def require_profiling_token(x_profiling_token: str | None = Header(None)):
+    if not profiling.token_matches(x_profiling_token):
+        raise HTTPException(status_code=401, detail="Invalid profiling token")
+
+router = APIRouter(
+    prefix="/debug/profiles",
+    tags=["debug"],
+    dependencies=[Depends(require_profiling_token)],
+)
+
+def _get_profile(profile_id: str) -> profiling.Profile:
+    profile = profiling.profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@router.get("/")
+def list_profiles():
+    return profiling.profile_store.list()
+
+@router.get("/{profile_id}")
+def read_profile(profile_id: str):
+    return _get_profile(profile_id).detail()
+
+@router.get("/{profile_id}/speedscope")
+def read_profile_speedscope(profile_id: str):
+    """Open the file at https://www.speedscope.app."""
+    return JSONResponse(
+        _get_profile(profile_id).speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'},
+    )
@@ -2,26 +2,44 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 import crud, schemas
 from database import get_db
+from dependencies import require_live_user
+from fieldsets import parse_fields, projected_response
+from streaming import StreamFormat, get_session_factory, streamed_response
 
 router = APIRouter(
     prefix="/sleep",
     tags=["sleep_activities"]
 )
 
-@router.post("/", response_model=schemas.SleepActivityResponse)
+@router.post("/", response_model=schemas.SleepActivityResponse, dependencies=[Depends(require_live_user)])
 def create_sleep(user_id: int, sleep: schemas.SleepActivityCreate, db: Session = Depends(get_db)):
     return crud.create_sleep_activity(db, user_id, sleep)
 
+@router.post("/batch", response_model=list[schemas.UpsertResult], dependencies=[Depends(require_live_user)])
+def create_sleep_batch(user_id: int, sleeps: list[schemas.SleepActivityCreate], db: Session = Depends(get_db)):
+    return crud.upsert_sleep_activities(db, user_id, sleeps)
+
 @router.get("/{sleep_id}", response_model=schemas.SleepActivityResponse)
-def read_sleep(sleep_id: int, db: Session = Depends(get_db)):
-    db_sleep = crud.get_sleep_activity(db, sleep_id)
+def read_sleep(sleep_id: int, fields: str | None = None, db: Session = Depends(get_db)):
+    columns = parse_fields(schemas.SleepActivityResponse, fields)
+    db_sleep = crud.get_sleep_activity(db, sleep_id, fields=columns)
     if not db_sleep:
         raise HTTPException(status_code=404, detail="Sleep activity not found")
+    if columns:
+        return projected_response(db_sleep, columns)
     return db_sleep
 
-@router.get("/user/{user_id}", response_model=list[schemas.SleepActivityResponse])
-def read_user_sleep(user_id: int, db: Session = Depends(get_db)):
-    return crud.get_user_sleep_activities(db, user_id)
+@router.get("/user/{user_id}", response_model=list[schemas.SleepActivityResponse], dependencies=[Depends(require_live_user)])
+def read_user_sleep(user_id: int, fields: str | None = None, stream: StreamFormat | None = None,
+                    db: Session = Depends(get_db), session_factory=Depends(get_session_factory)):
+    columns = parse_fields(schemas.SleepActivityResponse, fields)
+    if stream:
+        columns = columns or list(schemas.SleepActivityResponse.model_fields)
+        return streamed_response(session_factory, lambda db: crud.stream_user_sleep_activities(db, user_id, columns), stream)
+    rows = crud.get_user_sleep_activities(db, user_id, fields=columns)
+    if columns:
+        return projected_response(rows, columns)
+    return rows
 
 @router.put("/{sleep_id}", response_model=schemas.SleepActivityResponse)
 def update_sleep(sleep_id: int, updates: dict, db: Session = Depends(get_db)):
@@ -30,6 +48,18 @@ def update_sleep(sleep_id: int, updates: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Sleep activity not found")
     return updated
 
+@router.patch("/batch", response_model=list[schemas.PatchResult])
+def patch_sleep_batch(patches: list[schemas.SleepActivityBulkPatch], db: Session = Depends(get_db)):
+    return crud.patch_sleep_activities(db, patches)
+
+@router.patch("/{sleep_id}", response_model=schemas.SleepActivityResponse)
+def patch_sleep(sleep_id: int, changes: schemas.SleepActivityPatch, db: Session = Depends(get_db)):
+    crud.patch_sleep_activities(db, [schemas.SleepActivityBulkPatch(id=sleep_id, **changes.model_dump(exclude_unset=True))])
+    patched = crud.get_sleep_activity(db, sleep_id)
+    if not patched:
+        raise HTTPException(status_code=404, detail="Sleep activity not found")
+    return patched
+
 @router.delete("/{sleep_id}", response_model=schemas.SleepActivityResponse)
 def delete_sleep(sleep_id: int, db: Session = Depends(get_db)):
     deleted = crud.delete_sleep_activity(db, sleep_id)
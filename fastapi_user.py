@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import Literal
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from crud import get_user, get_users, create_user, update_user, delete_user
-from schemas import UserCreate, UserResponse, UserUpdate
+from crud import get_user, get_users, stream_users, get_user_profile, create_user, update_user, delete_user, soft_delete_user
+from user_purge import purge_user_in_background
+from schemas import UserCreate, UserResponse, UserUpdate, UserWithActivities
+from fieldsets import parse_fields, projected_response
+from streaming import StreamFormat, get_session_factory, streamed_response
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -21,13 +25,32 @@ def create_user_endpoint(user: UserCreate, db: Session = Depends(get_db)):
 
 # Get all users
 @router.get("/", response_model=list[UserResponse])
-def get_users_endpoint(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return get_users(db, skip=skip, limit=limit)
+def get_users_endpoint(skip: int = 0, limit: int = 100, fields: str | None = None, stream: StreamFormat | None = None,
+                       db: Session = Depends(get_db), session_factory=Depends(get_session_factory)):
+    columns = parse_fields(UserResponse, fields)
+    if stream:
+        columns = columns or list(UserResponse.model_fields)
+        return streamed_response(session_factory, lambda db: stream_users(db, columns, skip=skip, limit=limit), stream)
+    users = get_users(db, skip=skip, limit=limit, fields=columns)
+    if columns:
+        return projected_response(users, columns)
+    return users
 
 # Get user by ID
 @router.get("/{user_id}", response_model=UserResponse)
-def get_user_endpoint(user_id: int, db: Session = Depends(get_db)):
-    db_user = get_user(db, user_id)
+def get_user_endpoint(user_id: int, fields: str | None = None, db: Session = Depends(get_db)):
+    columns = parse_fields(UserResponse, fields)
+    db_user = get_user(db, user_id, fields=columns)
+    if not db_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if columns:
+        return projected_response(db_user, columns)
+    return db_user
+
+# Get user with their most recent activities, sleep and blood tests in one call
+@router.get("/{user_id}/full", response_model=UserWithActivities)
+def get_user_profile_endpoint(user_id: int, limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db)):
+    db_user = get_user_profile(db, user_id, limit=limit)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -40,10 +63,22 @@ def update_user_endpoint(user_id: int, updates: UserUpdate, db: Session = Depend
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
-# Delete user
+# Delete user; purge=async hides the user now and removes their data in the background
 @router.delete("/{user_id}", response_model=UserResponse)
-def delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
-    db_user = delete_user(db, user_id)
+def delete_user_endpoint(
+    user_id: int,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    purge: Literal["sync", "async"] = "sync",
+    db: Session = Depends(get_db),
+):
+    if purge == "async":
+        db_user = soft_delete_user(db, user_id)
+    else:
+        db_user = delete_user(db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
+    if purge == "async":
+        background_tasks.add_task(purge_user_in_background, db.get_bind(), user_id)
+        response.status_code = status.HTTP_202_ACCEPTED
     return db_user
@@ -0,0 +1,38 @@
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+
+def parse_fields(schema, fields: str | None) -> list[str] | None:
+    """Parse a comma-separated ``fields=`` value against a response schema.
+
+    Returns None when no projection was requested, otherwise the requested
+    field names in order. Unknown names are rejected with 400 before any
+    query runs.
+    """
+    if fields is None:
+        return None
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    if not requested:
+        raise HTTPException(status_code=400, detail="fields must name at least one field")
+    unknown = [name for name in requested if name not in schema.model_fields]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(schema.model_fields)}",
+        )
+    return list(dict.fromkeys(requested))
+
+
+def project(obj, fields: list[str]) -> dict:
+    return {name: getattr(obj, name) for name in fields}
+
+
+def projected_response(data, fields: list[str]) -> JSONResponse:
+    """Serialize one object or a list of objects restricted to fields,
+    bypassing the route's full response_model."""
+    if isinstance(data, list):
+        content = [project(obj, fields) for obj in data]
+    else:
+        content = project(data, fields)
+    return JSONResponse(jsonable_encoder(content))
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, event
+from sqlalchemy import BigInteger, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index, UniqueConstraint, event
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime, timezone
 
 Base = declarative_base()
 
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
 # ------------------- User -------------------
 class User(Base):
     __tablename__ = "users"
@@ -11,33 +15,51 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False, index=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    created_at = Column(DateTime, default=utcnow)
+    # Set when the user is queued for asynchronous purge; hidden from reads from then on
+    deleted_at = Column(DateTime, nullable=True)
 
+    # passive_deletes: rows are removed by set-based deletes / ON DELETE CASCADE,
+    # never loaded into the session just to delete them
     physical_activities = relationship(
-        "PhysicalActivity", back_populates="user", cascade="all, delete-orphan"
+        "PhysicalActivity", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
     )
     sleep_activities = relationship(
-        "SleepActivity", back_populates="user", cascade="all, delete-orphan"
+        "SleepActivity", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
     )
     blood_tests = relationship(
-        "BloodTest", back_populates="user", cascade="all, delete-orphan"
+        "BloodTest", back_populates="user", cascade="all, delete-orphan", passive_deletes=True
     )
 
 # ------------------- PhysicalActivity -------------------
 class PhysicalActivity(Base):
     __tablename__ = "physical_activities"
+    __table_args__ = (
+        UniqueConstraint("user_id", "external_id", name="uq_physical_activities_user_external_id"),
+        # Serves the per-type summary; INCLUDE lets Postgres answer it from the index alone
+        Index("ix_physical_activities_user_type_timestamp", "user_id", "activity_type", "timestamp",
+              postgresql_include=["duration"]),
+        # Per-user listings page through rows in id order
+        Index("ix_physical_activities_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     activity_type = Column(String, nullable=False)
     duration = Column(Float, nullable=False)
-    timestamp = Column(DateTime, default=datetime.now(timezone.utc))
+    timestamp = Column(DateTime, default=utcnow)
+    external_id = Column(String, nullable=True)
 
     user = relationship("User", back_populates="physical_activities")
 
 # ------------------- SleepActivity -------------------
 class SleepActivity(Base):
     __tablename__ = "sleep_activities"
+    __table_args__ = (
+        UniqueConstraint("user_id", "external_id", name="uq_sleep_activities_user_external_id"),
+        Index("ix_sleep_activities_user_start_time", "user_id", "start_time"),
+        Index("ix_sleep_activities_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -45,6 +67,7 @@ class SleepActivity(Base):
     end_time = Column(DateTime, nullable=False)
     duration = Column(Integer)
     quality = Column(String)
+    external_id = Column(String, nullable=True)
 
     user = relationship("User", back_populates="sleep_activities")
 
@@ -54,15 +77,91 @@ def calculate_sleep_duration(mapper, connection, target):
     if target.start_time and target.end_time:
         target.duration = int((target.end_time - target.start_time).total_seconds() / 60)
 
+# ------------------- SleepNight -------------------
+# Nightly sleep totals with overlapping segments merged; maintained by sleep_nights.py
+class SleepNight(Base):
+    __tablename__ = "sleep_nights"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    night = Column(Date, primary_key=True)
+    total_minutes = Column(Integer, nullable=False)
+    segment_count = Column(Integer, nullable=False)
+
+# ------------------- SleepSession -------------------
+# Merged sessions kept in place of compacted sleep segments, so segments arriving
+# late for a compacted night can still be merged with it (see compaction.py)
+class SleepSession(Base):
+    __tablename__ = "sleep_sessions"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    start_time = Column(DateTime, primary_key=True)
+    end_time = Column(DateTime, nullable=False)
+
+# ------------------- ActivityDailyAggregate -------------------
+# Per-day activity totals replacing raw rows older than the retention window (see compaction.py)
+class ActivityDailyAggregate(Base):
+    __tablename__ = "activity_daily_aggregates"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    activity_type = Column(String, primary_key=True)
+    session_count = Column(Integer, nullable=False)
+    total_duration = Column(Float, nullable=False)
+    last_timestamp = Column(DateTime, nullable=False)
+
+# ------------------- CompactionWatermark -------------------
+# Raw rows of `entity` before compacted_before have been folded into aggregates
+class CompactionWatermark(Base):
+    __tablename__ = "compaction_watermarks"
+
+    entity = Column(String, primary_key=True)
+    compacted_before = Column(DateTime, nullable=False)
+
 # ------------------- BloodTest -------------------
 class BloodTest(Base):
     __tablename__ = "blood_tests"
+    __table_args__ = (
+        UniqueConstraint("user_id", "external_id", name="uq_blood_tests_user_external_id"),
+        Index("ix_blood_tests_user_test_timestamp", "user_id", "test_name", "timestamp",
+              postgresql_include=["result", "unit"]),
+        Index("ix_blood_tests_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     test_name = Column(String, nullable=False)
     result = Column(Float, nullable=False)
     unit = Column(String, nullable=False)
-    timestamp = Column(DateTime, default=datetime.now(timezone.utc))
+    timestamp = Column(DateTime, default=utcnow)
+    external_id = Column(String, nullable=True)
 
     user = relationship("User", back_populates="blood_tests")
+
+# ------------------- UserScore -------------------
+# Latest computed health score per user; feeds the population sketches in population.py
+class UserScore(Base):
+    __tablename__ = "user_scores"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    overall = Column(Float, nullable=False)
+    physical = Column(Float, nullable=False)
+    sleep = Column(Float, nullable=False)
+    blood = Column(Float, nullable=False)
+    computed_at = Column(DateTime, default=utcnow, nullable=False)
+
+# ------------------- ChangeLog -------------------
+# Outbox of every write, appended in the writing transaction (see changefeed.py).
+# No foreign key on user_id: entries must outlive the users they describe.
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = (
+        # Compaction probes for a newer entry of the same entity
+        Index("ix_change_log_entity_seq", "entity", "entity_id", "seq"),
+    )
+
+    seq = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=True)
+    operation = Column(String, nullable=False)
+    changed_at = Column(DateTime, default=utcnow, nullable=False, index=True)
@@ -1,40 +1,23 @@
 from datetime import datetime
-from healthDB import PhysicalActivity, SleepActivity, BloodTest
+from sqlalchemy import func
+from healthDB import ActivityDailyAggregate, PhysicalActivity, SleepNight, BloodTest
+from reference_ranges import reference_ranges
 
 
 TARGET_WEEKLY_ACTIVITY = 150  
 RECOMMENDED_SLEEP_MIN = 420    
 RECOMMENDED_SLEEP_MAX = 540    
-BLOOD_TEST_NORMAL_RANGES = {
-    "glucose": (70, 100),
-    "cholesterol": (125, 200),
-    "vitamin D": (20, 50),
-}
-
-def single_blood_test_score(value: float, min_val: float, max_val: float) -> float:
-    if min_val <= value <= max_val:
-        return 100.0
-    mid = (min_val + max_val) / 2
-    score = max(0.0, 100 - abs(value - mid) / ((max_val - min_val)/2) * 100)
-    return score
 
 def blood_test_score(db, user) -> float:
-    blood_tests = db.query(BloodTest).filter(BloodTest.user_id == user.id).all()
-    if not blood_tests:
-        return 0.0
-    scores = []
-    for test in blood_tests:
-        if test.test_name in BLOOD_TEST_NORMAL_RANGES:
-            min_val, max_val = BLOOD_TEST_NORMAL_RANGES[test.test_name]
-            scores.append(single_blood_test_score(test.result, min_val, max_val))
-        else:
-            scores.append(100.0) 
-    return sum(scores) / len(scores)
+    # Ranges, units and panel scoring live in reference_ranges.py
+    tests = db.query(BloodTest.test_name, BloodTest.result, BloodTest.unit).filter(BloodTest.user_id == user.id).all()
+    return reference_ranges.score_panel(tests)
 
 def sleep_score_calculation(db, user):
-    sleeps = db.query(SleepActivity).filter(SleepActivity.user_id == user.id).all()
-    if sleeps:
-        avg_sleep = sum(s.duration for s in sleeps) / len(sleeps)
+    # Average over nights, with overlapping segments already merged (see sleep_nights.py)
+    avg_sleep = db.query(func.avg(SleepNight.total_minutes)).filter(SleepNight.user_id == user.id).scalar()
+    if avg_sleep is not None:
+        avg_sleep = float(avg_sleep)
         if avg_sleep < RECOMMENDED_SLEEP_MIN:
             sleep_score = avg_sleep / RECOMMENDED_SLEEP_MIN * 50
         elif avg_sleep > RECOMMENDED_SLEEP_MAX:
@@ -47,12 +30,20 @@ def sleep_score_calculation(db, user):
     return sleep_score
 
 def physical_activity_score(db, user):
-    activities = db.query(PhysicalActivity).filter(PhysicalActivity.user_id == user.id).all()
-    total_activity = sum(a.duration for a in activities)
-    physical_score = min(total_activity / TARGET_WEEKLY_ACTIVITY * 100, 100) if activities else 0 
+    # Raw rows plus the daily aggregates that replaced compacted ones (see compaction.py)
+    raw_total = db.query(func.sum(PhysicalActivity.duration)).filter(PhysicalActivity.user_id == user.id).scalar()
+    compacted_total = (
+        db.query(func.sum(ActivityDailyAggregate.total_duration))
+        .filter(ActivityDailyAggregate.user_id == user.id)
+        .scalar()
+    )
+    if raw_total is None and compacted_total is None:
+        return 0
+    total_activity = (raw_total or 0) + (compacted_total or 0)
+    physical_score = min(total_activity / TARGET_WEEKLY_ACTIVITY * 100, 100)
     return physical_score  
 
-def calculate_health_score(user, db) -> float:
+def calculate_health_score_components(user, db) -> dict:
     physical_score = physical_activity_score(db, user)
 
     sleep_score = sleep_score_calculation(db, user)
@@ -60,7 +51,15 @@ def calculate_health_score(user, db) -> float:
     blood_score = blood_test_score(db,user)
 
     overall_score = (physical_score + sleep_score + blood_score) / 3
-    return round(overall_score, 2)
+    return {
+        "overall": round(overall_score, 2),
+        "physical": round(physical_score, 2),
+        "sleep": round(sleep_score, 2),
+        "blood": round(blood_score, 2),
+    }
+
+def calculate_health_score(user, db) -> float:
+    return calculate_health_score_components(user, db)["overall"]
 
 def health_score_to_fhir(user_id: int, score: float) -> dict:
     """Return a FHIR-compliant Observation for the health score."""
@@ -0,0 +1,99 @@
+"""Load generator for checking graceful degradation under overload.
+
+Seeds a few users with data, then drives a mix of health-score, list and
+write requests at a fixed concurrency for a fixed duration and reports the
+status-code mix and latency percentiles. Run it against a local stack
+(``docker-compose up``) at normal concurrency first, then at 5x:
+
+    python loadgen.py --concurrency 20 --duration 30
+    python loadgen.py --concurrency 100 --duration 30
+
+Under overload the expected outcome is a growing share of fast 503/429
+responses while 200 latencies stay bounded and the worker stays up.
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+async def seed_users(client: httpx.AsyncClient, count: int) -> list:
+    user_ids = []
+    for _ in range(count):
+        name = f"load_{uuid.uuid4().hex[:8]}"
+        resp = await client.post("/users/", json={"username": name, "email": f"{name}@load.test"})
+        resp.raise_for_status()
+        user_id = resp.json()["id"]
+        user_ids.append(user_id)
+        for _ in range(20):
+            await client.post(f"/activities/?user_id={user_id}",
+                              json={"activity_type": random.choice(["running", "cycling"]),
+                                    "duration": random.randint(10, 90)})
+    return user_ids
+
+
+def pick_request(user_ids: list):
+    user_id = random.choice(user_ids)
+    roll = random.random()
+    if roll < 0.5:
+        return "GET", f"/get_health_score?user_id={user_id}", None
+    if roll < 0.8:
+        return "GET", f"/activities/user/{user_id}", None
+    return "POST", f"/activities/?user_id={user_id}", {"activity_type": "walking", "duration": 15}
+
+
+async def worker(client: httpx.AsyncClient, user_ids: list, deadline: float, statuses: Counter, latencies: list):
+    while time.monotonic() < deadline:
+        method, url, body = pick_request(user_ids)
+        start = time.monotonic()
+        try:
+            resp = await client.request(method, url, json=body)
+            statuses[resp.status_code] += 1
+            if resp.status_code == 200:
+                latencies.append(time.monotonic() - start)
+        except httpx.HTTPError as exc:
+            statuses[type(exc).__name__] += 1
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        user_ids = await seed_users(client, args.users)
+        statuses, latencies = Counter(), []
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*(worker(client, user_ids, deadline, statuses, latencies)
+                               for _ in range(args.concurrency)))
+        metrics = (await client.get("/metrics")).json()
+
+    total = sum(statuses.values())
+    print(f"requests: {total} ({total / args.duration:.1f}/s)")
+    for status, count in sorted(statuses.items(), key=lambda item: str(item[0])):
+        print(f"  {status}: {count} ({count / total:.1%})")
+    print(f"200 latency p50={percentile(latencies, 50) * 1000:.1f}ms "
+          f"p99={percentile(latencies, 99) * 1000:.1f}ms")
+    print(f"admission: {metrics['admission']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
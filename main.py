@@ -1,28 +1,206 @@
+import os
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from fastapi_user import router as users_router
 from fastapi_activity import router as physical_router
 from fastapi_blood import router as blood_router
 from fastapi_sleep import router as sleep_router
-from database import get_db
+from fastapi_changes import router as changes_router
+from database import SessionLocal, get_db
 from healthDB import User
-from healthscore import calculate_health_score
+from healthscore import calculate_health_score_components
 from healthscore import health_score_to_fhir
+from reference_ranges import reference_ranges
+import admission
+from write_behind import activity_buffer
+from singleflight import SingleFlight
+import population
+import compaction
+import shm_cache
+import changefeed
+import profiling
+from score_stream import ScoreBroker, sse_events
 
-app = FastAPI(title="Health Tracker API")
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli is optional; fall back to gzip only
+    BrotliMiddleware = None
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1000))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    activity_buffer.start()
+    stop_rebuild = threading.Event()
+    threading.Thread(
+        target=population.run_periodic_rebuild, args=(SessionLocal, stop_rebuild),
+        name="population-rebuild", daemon=True,
+    ).start()
+    if compaction.INTERVAL_SECONDS > 0:
+        threading.Thread(
+            target=compaction.run_periodic_compaction, args=(SessionLocal, stop_rebuild),
+            name="compaction", daemon=True,
+        ).start()
+    yield
+    stop_rebuild.set()
+    await score_broker.close()
+    # Flush buffered writes before the worker exits
+    activity_buffer.stop()
+
+
+# Concurrent score requests for the same user share one computation
+health_score_flight = SingleFlight()
+
+class UncompressedStreams:
+    """Sends event streams around the compression middleware, which would
+    buffer events and keep a compressor alive per idle connection."""
+
+    def __init__(self, app, compressor, **options):
+        self.app = app
+        self.compressed = compressor(app, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith("/stream"):
+            await self.app(scope, receive, send)
+        else:
+            await self.compressed(scope, receive, send)
+
+
+app = FastAPI(title="Health Tracker API", lifespan=lifespan)
+app.add_middleware(admission.AdmissionControlMiddleware)
+if BrotliMiddleware is not None:
+    app.add_middleware(UncompressedStreams, compressor=BrotliMiddleware,
+                       minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(UncompressedStreams, compressor=GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
 
 # Include the routers
 app.include_router(users_router)
 app.include_router(physical_router)
 app.include_router(blood_router)
 app.include_router(sleep_router)
+app.include_router(changes_router)
+
+
+def _get_active_user(db: Session, user_id: int) -> User:
+    user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+def _compute_score(user: User, db: Session) -> dict:
+    """Score the user and feed the result into the population statistics.
+    Served from the shared cache while the user's data is unchanged."""
+    user_id = user.id
+    cache = shm_cache.get_cache()
+    version = ranges = None
+    if cache is not None:
+        # Read the versions before the data, so a change in between invalidates the result
+        version, ranges = cache.data_version(user_id), reference_ranges.version
+        cached = cache.get_score(user_id, version, ranges)
+        if cached is not None:
+            return cached
+
+    def compute():
+        components = calculate_health_score_components(user, db)
+        population.record_score(db, user_id, components)
+        if cache is not None:
+            cache.put_score(user_id, version, components, ranges)
+        return components
+
+    return health_score_flight.do(user_id, compute)
+
+
+def _stream_score(user_id: int) -> dict | None:
+    """Current FHIR score for a stream, with a session of its own since
+    streams outlive requests. None once the user is gone."""
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.id == user_id, User.deleted_at.is_(None)).first()
+        if user is None:
+            return None
+        return health_score_to_fhir(user_id, _compute_score(user, db)["overall"])
+
+
+score_broker = ScoreBroker(_stream_score, versions=shm_cache.get_cache)
+changefeed.commit_listeners.append(score_broker.notify)
+
+
+def _rescore_population():
+    # Every stored score was computed against the old ranges
+    threading.Thread(target=population.rescore, args=(SessionLocal,), name="population-rescore", daemon=True).start()
+
+
+reference_ranges.reload_listeners.append(_rescore_population)
 
 
 @app.get("/get_health_score")
 def get_health_score_endpoint(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    user = _get_active_user(db, user_id)
+    score = _compute_score(user, db)["overall"]
+    return health_score_to_fhir(user_id, score)
+
+
+@app.get("/health_score/percentile")
+def health_score_percentile_endpoint(user_id: int, db: Session = Depends(get_db)):
+    user = _get_active_user(db, user_id)
+    # Current score; user_scores only feeds the population sketches
+    scores = _compute_score(user, db)
+    components = {
+        component: {"score": scores[component],
+                    "percentile": population.population_stats.percentile(component, scores[component])}
+        for component in population.COMPONENTS
+    }
+    return {
+        "user_id": user_id,
+        "score": scores["overall"],
+        "percentile": components["overall"]["percentile"],
+        "components": components,
+        "population": population.population_stats.population(),
+        # Exact rank may differ only by users scoring within this many points
+        "error_bound_points": population.BIN_WIDTH,
+    }
+
+
+@app.get("/users/{user_id}/health_score/stream")
+async def health_score_stream_endpoint(user_id: int):
+    """Server-Sent Events: the current score, then a new Observation each
+    time a write changes it."""
+    payload = await run_in_threadpool(_stream_score, user_id)
+    if payload is None:
         raise HTTPException(status_code=404, detail="User not found")
+    return StreamingResponse(
+        sse_events(score_broker, user_id, payload),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/health_score/distribution")
+def health_score_distribution_endpoint():
+    return population.population_stats.distribution()
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    cache = shm_cache.get_cache()
+    return {
+        "admission": admission.stats(),
+        "write_behind": activity_buffer.stats(),
+        "health_score_coalescing": health_score_flight.stats(),
+        "population_verification": population.population_stats.last_verification,
+        "score_cache": cache.stats() if cache is not None else None,
+        "score_streams": score_broker.stats(),
+    }
+
 
-    score = calculate_health_score(user, db)
-    return health_score_to_fhir(user.id, score)
\ No newline at end of file
+# Installed last so every route is wrapped; absent unless PROFILING_TOKEN is set
+if profiling.PROFILING_TOKEN:
+    profiling.install(app)
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""Population statistics for health scores.
+
+Scores are bounded to [0, 100], so each component (overall, physical,
+sleep, blood) is summarised by a fixed-width histogram sketch with
+BIN_WIDTH-point bins. Unlike t-digest or KLL it supports removing a value,
+which is what happens when a user's score is recomputed, and two sketches
+merge by adding their counts. Query cost depends only on the number of
+bins, never on the number of users. Each worker also remembers the values
+it counted per user, so a rescore removes exactly what that worker added.
+
+Error bound: a quantile is reported as the midpoint of its bin, so it is
+within BIN_WIDTH / 2 points of the exact value. A percentile counts every
+user in lower bins plus half of the user's own bin, so it differs from the
+exact rank only by users whose score is within BIN_WIDTH of the queried
+score.
+
+The latest score per user is persisted in user_scores. Each worker keeps
+its own sketches: updated in place whenever it computes a score, and
+rebuilt from user_scores at startup and every POPULATION_REBUILD_SECONDS so
+workers converge. rebuild(db, recompute=True) rescores every user exactly
+and reports the sketch's worst percentile error against exact ranks:
+
+    python population.py --recompute
+
+A reference range reload only changes blood scores: rescore() rescores the
+stored blood components in bulk, in one worker per database.
+"""
+import argparse
+import bisect
+import logging
+import os
+import threading
+
+from sqlalchemy import select, text, update
+from sqlalchemy.orm import Session
+
+from crud import dialect_insert
+from healthDB import BloodTest, User, UserScore, utcnow
+from healthscore import calculate_health_score_components
+from reference_ranges import reference_ranges
+
+BIN_WIDTH = 0.1
+MAX_SCORE = 100.0
+COMPONENTS = ("overall", "physical", "sleep", "blood")
+REBUILD_SECONDS = int(os.getenv("POPULATION_REBUILD_SECONDS", 3600))
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+RESCORE_CHUNK_SIZE = int(os.getenv("POPULATION_RESCORE_CHUNK_SIZE", 1000))
+# pg_advisory_lock key held by the worker rescoring after a reload
+RESCORE_LOCK_KEY = 4_113_001
+
+logger = logging.getLogger(__name__)
+
+
+class ScoreHistogram:
+    def __init__(self, bin_width: float = BIN_WIDTH):
+        self.bin_width = bin_width
+        self.counts = [0] * (int(round(MAX_SCORE / bin_width)) + 1)
+        self.total = 0
+
+    def _bin(self, value: float) -> int:
+        # Epsilon keeps values on a bin edge (e.g. 0.3 / 0.1 = 2.999...) in their own bin
+        return min(max(int(value / self.bin_width + 1e-9), 0), len(self.counts) - 1)
+
+    def add(self, value: float):
+        self.counts[self._bin(value)] += 1
+        self.total += 1
+
+    def remove(self, value: float):
+        index = self._bin(value)
+        if self.counts[index]:
+            self.counts[index] -= 1
+            self.total -= 1
+
+    def merge(self, other: "ScoreHistogram"):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def percentile(self, value: float) -> float | None:
+        """Share of the population (0-100) scoring below value."""
+        if not self.total:
+            return None
+        index = self._bin(value)
+        below = sum(self.counts[:index]) + self.counts[index] / 2
+        return 100.0 * below / self.total
+
+    def quantile(self, q: float) -> float | None:
+        if not self.total:
+            return None
+        target = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min((index + 0.5) * self.bin_width, MAX_SCORE)
+        return MAX_SCORE
+
+
+class PopulationStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sketches = {component: ScoreHistogram() for component in COMPONENTS}
+        # user_id -> components counted in these sketches
+        self.counted = {}
+        self.rebuilt_at = None
+        self.last_verification = None
+
+    def update(self, user_id: int, current: dict):
+        """Count current for user_id, removing the values counted for it before, if any."""
+        with self._lock:
+            previous = self.counted.get(user_id)
+            for component, sketch in self.sketches.items():
+                if previous is not None:
+                    sketch.remove(previous[component])
+                sketch.add(current[component])
+            self.counted[user_id] = current
+
+    def population(self) -> int:
+        return self.sketches["overall"].total
+
+    def percentile(self, component: str, value: float) -> float | None:
+        with self._lock:
+            return self.sketches[component].percentile(value)
+
+    def distribution(self) -> dict:
+        with self._lock:
+            return {
+                "population": self.sketches["overall"].total,
+                "bin_width": BIN_WIDTH,
+                "quantiles": {
+                    component: {f"p{int(q * 100)}": sketch.quantile(q) for q in QUANTILES}
+                    for component, sketch in self.sketches.items()
+                },
+                "rebuilt_at": self.rebuilt_at,
+            }
+
+    def replace(self, sketches: dict, counted: dict):
+        with self._lock:
+            self.sketches = sketches
+            self.counted = counted
+            self.rebuilt_at = utcnow()
+
+
+population_stats = PopulationStats()
+
+
+def _score_dict(row) -> dict:
+    return {component: getattr(row, component) for component in COMPONENTS}
+
+
+def record_score(db: Session, user_id: int, components: dict, stats: PopulationStats = population_stats):
+    """Persist a freshly computed score and move the user within the sketches.
+    One upsert, so concurrent requests scoring a new user don't collide."""
+    values = {component: components[component] for component in COMPONENTS}
+    stmt = dialect_insert(db, UserScore).values(user_id=user_id, computed_at=utcnow(), **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserScore.user_id],
+        set_={**values, "computed_at": stmt.excluded.computed_at},
+    ).returning(*(getattr(UserScore, component) for component in COMPONENTS))
+    stored = db.execute(stmt).one()
+    db.commit()
+    stats.update(user_id, _score_dict(stored))
+
+
+def _exact_percentile(sorted_values: list, value: float) -> float:
+    below = bisect.bisect_left(sorted_values, value)
+    ties = bisect.bisect_right(sorted_values, value) - below
+    return 100.0 * (below + ties / 2) / len(sorted_values)
+
+
+def rebuild(db: Session, recompute: bool = False, stats: PopulationStats = population_stats) -> dict:
+    """Rebuild the sketches from user_scores, optionally rescoring every
+    active user first. Reports the worst percentile error of the fresh
+    sketch against exact ranks."""
+    if recompute:
+        for user in db.scalars(select(User).where(User.deleted_at.is_(None))).all():
+            components = calculate_health_score_components(user, db)
+            record_score(db, user.id, components, stats=PopulationStats())
+
+    scores = {component: [] for component in COMPONENTS}
+    sketches = {component: ScoreHistogram() for component in COMPONENTS}
+    counted = {}
+    rows = db.execute(
+        select(UserScore).join(User, User.id == UserScore.user_id).where(User.deleted_at.is_(None))
+    ).scalars()
+    for row in rows:
+        counted[row.user_id] = _score_dict(row)
+        for component in COMPONENTS:
+            value = getattr(row, component)
+            scores[component].append(value)
+            sketches[component].add(value)
+
+    max_error = 0.0
+    for component, values in scores.items():
+        values.sort()
+        for value in set(values):
+            error = abs(sketches[component].percentile(value) - _exact_percentile(values, value))
+            max_error = max(max_error, error)
+
+    stats.replace(sketches, counted)
+    stats.last_verification = {
+        "population": len(scores["overall"]),
+        "max_percentile_error": round(max_error, 4),
+        "verified_at": stats.rebuilt_at,
+    }
+    return stats.last_verification
+
+
+def rescore_blood(db: Session, ranges=reference_ranges, chunk_size: int = RESCORE_CHUNK_SIZE) -> int:
+    """Recompute the blood component, and the overall score from the stored
+    physical and sleep components, of every active user with a stored
+    score. Blood tests are loaded and scored a chunk of users at a time and
+    each chunk is written in one statement. Returns the users rescored."""
+    rescored, after = 0, 0
+    while True:
+        stored = db.execute(
+            select(UserScore.user_id, UserScore.physical, UserScore.sleep)
+            .join(User, User.id == UserScore.user_id)
+            .where(User.deleted_at.is_(None), UserScore.user_id > after)
+            .order_by(UserScore.user_id)
+            .limit(chunk_size)
+        ).all()
+        if not stored:
+            return rescored
+        user_ids = [row.user_id for row in stored]
+        tests = db.execute(
+            select(BloodTest.user_id, BloodTest.test_name, BloodTest.result, BloodTest.unit)
+            .where(BloodTest.user_id.in_(user_ids))
+        ).all()
+        panels = ranges.score_panels(*zip(*tests)) if tests else {}
+        computed_at = utcnow()
+        rows = []
+        for row in stored:
+            blood = panels.get(row.user_id, 0.0)
+            rows.append({
+                "user_id": row.user_id,
+                "blood": round(blood, 2),
+                "overall": round((row.physical + row.sleep + blood) / 3, 2),
+                "computed_at": computed_at,
+            })
+        db.execute(update(UserScore), rows)
+        db.commit()
+        rescored += len(rows)
+        after = user_ids[-1]
+
+
+_rescore_lock = threading.Lock()
+
+
+def rescore(session_factory, stats: PopulationStats = population_stats):
+    """Thread target once the reference ranges changed: rescore the stored
+    blood components, then rebuild the sketches. On Postgres the worker
+    that takes the advisory lock rescores; the others wait for it and only
+    rebuild. SQLite runs a single worker."""
+    with _rescore_lock:
+        db = session_factory()
+        try:
+            engine = db.get_bind()
+            if engine.dialect.name != "postgresql":
+                rescore_blood(db)
+            else:
+                with engine.connect() as lock:
+                    if lock.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": RESCORE_LOCK_KEY}):
+                        try:
+                            rescore_blood(db)
+                        finally:
+                            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RESCORE_LOCK_KEY})
+                    else:
+                        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": RESCORE_LOCK_KEY})
+                        lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RESCORE_LOCK_KEY})
+            rebuild(db, stats=stats)
+        except Exception:
+            logger.exception("Rescore after a reference range reload failed")
+        finally:
+            db.close()
+
+
+def run_periodic_rebuild(session_factory, stop: threading.Event, interval: int = REBUILD_SECONDS):
+    """Thread target: rebuild once now, then every interval seconds until stop is set."""
+    while True:
+        db = session_factory()
+        try:
+            rebuild(db)
+        except Exception:
+            logger.exception("Population rebuild failed; retrying in %s seconds", interval)
+        finally:
+            db.close()
+        if stop.wait(interval):
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild and verify population score sketches.")
+    parser.add_argument("--recompute", action="store_true", help="rescore every user before rebuilding")
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(rebuild(db, recompute=args.recompute))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""Opt-in per-request profiling for staging.
+
+Profiling exists only when PROFILING_TOKEN is set. install() then adds the
+middleware, the SQL timing hooks and the /debug/profiles endpoints. Without
+the token none of them are installed, so requests pay nothing.
+
+A request is profiled when it sends the token in the X-Profiling-Token
+header, or at random with probability PROFILING_SAMPLE_RATE. While it runs,
+a sampler thread reads the stacks of the threads working for it through
+sys._current_frames() every PROFILING_INTERVAL_SECONDS. Those threads are
+the event loop (routing, request validation, middleware) and the worker
+thread of a sync endpoint. The loop is shared, so concurrent requests show
+up in its samples; profile one request at a time for a clean picture. Every
+SQL statement run in the request's context is timed through engine events.
+
+Sampling stops once the response body is complete, or as soon as the
+headers of a Server-Sent Events stream go out, since such a stream only
+ends when the client leaves. Any other response is sampled for at most
+PROFILING_MAX_SECONDS and keeps at most PROFILING_MAX_STATEMENTS statements;
+a profile that hit either cap is marked truncated.
+
+The finished profile is kept in memory; the newest PROFILING_MAX_PROFILES
+per worker process are retained. Its id is returned in the X-Profile-Id
+response header. /debug/profiles/{id}/speedscope downloads it in the
+format read by https://www.speedscope.app.
+"""
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+INTERVAL_SECONDS = float(os.getenv("PROFILING_INTERVAL_SECONDS", 0.005))
+MAX_PROFILES = int(os.getenv("PROFILING_MAX_PROFILES", 50))
+MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", 30))
+MAX_STATEMENTS = int(os.getenv("PROFILING_MAX_STATEMENTS", 10_000))
+TOKEN_HEADER = b"x-profiling-token"
+# Longer statements are cut in the SQL breakdown
+MAX_STATEMENT_CHARS = 2000
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def token_matches(token: bytes | str | None) -> bool:
+    """token is the raw header value, or its text as Starlette decodes it (latin-1)."""
+    if not PROFILING_TOKEN or token is None:
+        return False
+    if isinstance(token, str):
+        token = token.encode("latin-1")
+    # compare_digest only takes ASCII str, so compare bytes
+    return hmac.compare_digest(token, PROFILING_TOKEN.encode())
+
+
+class Profile:
+    def __init__(self, method: str, path: str, trigger: str, interval: float = INTERVAL_SECONDS,
+                 max_seconds: float = MAX_SECONDS, max_statements: int = MAX_STATEMENTS):
+        self.id = uuid.uuid4().hex
+        self.method, self.path, self.trigger = method, path, trigger
+        self.interval = interval
+        self.max_seconds, self.max_statements = max_seconds, max_statements
+        self.truncated = False
+        self.started_at = time.time()
+        self.duration = None
+        self.status_code = None
+        self.statements = []
+        self.threads = set()
+        self.thread_names = {}
+        self.frames = {}  # (name, file, line) -> index
+        self.samples = {}  # ident -> [(stack, weight)]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.id[:8]}", daemon=True)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self, status_code: int | None) -> bool:
+        """End the profile; False if it had already ended."""
+        if self._stop.is_set():
+            return False
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._start
+        self.status_code = status_code
+        return True
+
+    def add_thread(self, ident: int, name: str):
+        with self._lock:
+            self.threads.add(ident)
+            self.thread_names[ident] = name
+
+    def remove_thread(self, ident: int):
+        with self._lock:
+            self.threads.discard(ident)
+
+    def _sample(self):
+        last = time.perf_counter()
+        deadline = last + self.max_seconds
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now >= deadline:
+                self.truncated = True
+                return
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self.threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None and not _idle(frame):
+                    self.samples.setdefault(ident, []).append((self._stack(frame), now - last))
+            last = now
+
+    def _stack(self, frame) -> list[int]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_qualname, code.co_filename, frame.f_lineno)
+            index = self.frames.get(key)
+            if index is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def record_statement(self, statement: str, duration: float, rows: int, executemany: bool):
+        if self._stop.is_set():
+            return
+        if len(self.statements) >= self.max_statements:
+            self.truncated = True
+            return
+        self.statements.append({
+            "statement": statement[:MAX_STATEMENT_CHARS],
+            "duration_ms": round(duration * 1000, 3),
+            "rows": rows,
+            "executemany": executemany,
+        })
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "trigger": self.trigger,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "samples": sum(len(samples) for samples in self.samples.values()),
+            "sql_statements": len(self.statements),
+            "sql_ms": round(sum(s["duration_ms"] for s in self.statements), 3),
+            "truncated": self.truncated,
+        }
+
+    def detail(self) -> dict:
+        """Summary plus SQL statements, slowest first."""
+        return {**self.summary(), "sql": sorted(self.statements, key=lambda s: s["duration_ms"], reverse=True)}
+
+    def speedscope(self) -> dict:
+        frames = [{"name": name, "file": file, "line": line} for name, file, line in self.frames]
+        profiles = []
+        for ident, samples in self.samples.items():
+            weights = [weight for _, weight in samples]
+            profiles.append({
+                "type": "sampled",
+                "name": f"{self.thread_names[ident]} ({ident})",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": [stack for stack, _ in samples],
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path}",
+            "exporter": "healthtracker-profiling",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def _is_event_stream(headers) -> bool:
+    return any(name.lower() == b"content-type" and value.startswith(b"text/event-stream") for name, value in headers)
+
+
+def _idle(frame) -> bool:
+    # An event loop blocked waiting for I/O is not doing the request's work
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+
+class ProfileStore:
+    def __init__(self, max_profiles: int = MAX_PROFILES):
+        self._profiles = OrderedDict()
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Profile | None:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profile.summary() for profile in reversed(profiles)]
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Runs selected requests under the sampler and stores their profile."""
+
+    def __init__(self, app, store: ProfileStore | None = None, sample_rate: float | None = None):
+        self.app = app
+        self.store = store or profile_store
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/debug/"):
+            return await self.app(scope, receive, send)
+        trigger = self._trigger(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope["method"], scope["path"], trigger)
+        status_code = None
+        loop_thread = threading.get_ident()
+
+        def finish():
+            if profile.stop(status_code):
+                profile.remove_thread(loop_thread)
+                self.store.add(profile)
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile.id.encode())]
+                if _is_event_stream(message["headers"]):
+                    finish()
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        token = current_profile.set(profile)
+        profile.add_thread(loop_thread, "event loop")
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            finish()
+            current_profile.reset(token)
+
+    def _trigger(self, scope) -> str | None:
+        for name, value in scope["headers"]:
+            if name == TOKEN_HEADER:
+                return "header" if token_matches(value) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+
+def _profiled_endpoint(call):
+    """Registers the worker thread running a sync endpoint with the
+    request's profile; the profile context is copied into the thread."""
+
+    @functools.wraps(call)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.add_thread(ident, f"endpoint {call.__name__}")
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.remove_thread(ident)
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, so a statement that fails leaves nothing behind
+    if current_profile.get() is not None:
+        context._profiling_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    started = getattr(context, "_profiling_started", None)
+    if profile is not None and started is not None:
+        profile.record_statement(statement, time.perf_counter() - started, cursor.rowcount, executemany)
+
+
+def install(app) -> None:
+    """Enable profiling on app; call after all routers are included."""
+    from fastapi_debug import router as debug_router
+
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        call = route.dependant.call
+        if not (inspect.iscoroutinefunction(call) or inspect.isgeneratorfunction(call)):
+            route.dependant.call = _profiled_endpoint(call)
+    app.include_router(debug_router)
+    app.add_middleware(ProfilingMiddleware)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,211 @@
+"""Blood test reference ranges loaded from data files.
+
+reference_ranges.csv lists a normal range per analyte and unit, optionally
+restricted to a sex (M/F) and an age band in years. The most specific
+matching row wins. unit_conversions.csv maps other units onto a unit
+that has ranges, as value * scale + offset. Analyte "*" applies to every
+analyte. Names and units are matched case-insensitively, with "µ" read as
+"u".
+
+Each distinct (test_name, unit, sex, age) seen is resolved once to a
+(scale, offset, low, high) row. A panel is then scored as numpy arrays in
+one pass. Tests whose analyte or unit has no range are left out of the
+score instead of counting as normal.
+
+Both files are re-read when their modification time changes, checked at
+most every RELOAD_CHECK_SECONDS. A file that fails to parse keeps the
+previous ranges in use. The registry's version is a hash of both files'
+contents, so every worker that loaded the same files reports the same
+version; score caches are keyed on it. After a reload every function in
+reload_listeners is called.
+"""
+import csv
+import logging
+import os
+import threading
+import time
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RANGES_PATH = os.getenv("REFERENCE_RANGES_PATH", os.path.join(HERE, "reference_ranges.csv"))
+CONVERSIONS_PATH = os.getenv("UNIT_CONVERSIONS_PATH", os.path.join(HERE, "unit_conversions.csv"))
+RELOAD_CHECK_SECONDS = float(os.getenv("REFERENCE_RANGES_RELOAD_SECONDS", 5))
+ANY_ANALYTE = "*"
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.replace("µ", "u").replace("μ", "u").lower().split())
+
+
+def _optional_float(text: str) -> float | None:
+    return float(text) if text.strip() else None
+
+
+class _Ranges:
+    """Immutable snapshot of both files plus the keys resolved against it."""
+
+    def __init__(self, ranges_path: str, conversions_path: str):
+        self.version = 0
+        for path in (ranges_path, conversions_path):
+            with open(path, "rb") as f:
+                self.version = zlib.crc32(f.read(), self.version)
+        self.ranges = {}
+        with open(ranges_path, newline="") as f:
+            for row in csv.DictReader(f):
+                key = (_normalize(row["analyte"]), _normalize(row["unit"]))
+                sex = row["sex"].strip().upper() or None
+                self.ranges.setdefault(key, []).append((
+                    sex, _optional_float(row["age_min"]), _optional_float(row["age_max"]),
+                    float(row["low"]), float(row["high"]),
+                ))
+        for candidates in self.ranges.values():
+            # Most specific first: sex and age band both set, then either, then neither
+            candidates.sort(key=lambda c: (c[0] is None) + (c[1] is None and c[2] is None))
+
+        self.conversions = {}
+        with open(conversions_path, newline="") as f:
+            for row in csv.DictReader(f):
+                key = (_normalize(row["analyte"]), _normalize(row["from_unit"]))
+                self.conversions.setdefault(key, []).append(
+                    (_normalize(row["to_unit"]), float(row["scale"]), float(row["offset"])))
+
+        self._lock = threading.Lock()
+        self._codes = {}
+        # Parameter rows by code; refreshed as arrays whenever a key is added
+        self._rows = []
+        self.params = np.empty((0, 4))
+
+    def _band(self, analyte: str, unit: str, sex: str | None, age: float | None):
+        for band_sex, age_min, age_max, low, high in self.ranges.get((analyte, unit), ()):
+            if band_sex is not None and band_sex != sex:
+                continue
+            if (age_min is not None or age_max is not None) and age is None:
+                continue
+            if age_min is not None and age < age_min or age_max is not None and age > age_max:
+                continue
+            return low, high
+        return None
+
+    def resolve(self, test_name: str, unit: str, sex: str | None = None, age: float | None = None):
+        """(scale, offset, low, high) in the test's own unit terms, or None."""
+        analyte, unit = _normalize(test_name), _normalize(unit)
+        sex = sex.upper() if sex else None
+        band = self._band(analyte, unit, sex, age)
+        if band is not None:
+            return (1.0, 0.0, *band)
+        for source in (analyte, ANY_ANALYTE):
+            for to_unit, scale, offset in self.conversions.get((source, unit), ()):
+                band = self._band(analyte, to_unit, sex, age)
+                if band is not None:
+                    return (scale, offset, *band)
+        return None
+
+    def code(self, key: tuple) -> int:
+        """Row index into params for (test_name, unit, sex, age); -1 if unknown."""
+        code = self._codes.get(key)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(key)
+                if code is None:
+                    resolved = self.resolve(*key)
+                    code = -1
+                    if resolved is not None:
+                        self._rows.append(resolved)
+                        self.params = np.array(self._rows)
+                        code = len(self._rows) - 1
+                    self._codes[key] = code
+        return code
+
+
+class ReferenceRangeRegistry:
+    def __init__(self, ranges_path: str = RANGES_PATH, conversions_path: str = CONVERSIONS_PATH,
+                 check_interval: float = RELOAD_CHECK_SECONDS):
+        self.paths = (ranges_path, conversions_path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._mtimes = self._current_mtimes()
+        self._snapshot = _Ranges(*self.paths)
+        self._checked_at = time.monotonic()
+        # Called without arguments after the ranges in use changed
+        self.reload_listeners = []
+
+    def _current_mtimes(self) -> tuple:
+        return tuple(os.stat(path).st_mtime_ns for path in self.paths)
+
+    def snapshot(self) -> _Ranges:
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload_if_changed()
+        return self._snapshot
+
+    @property
+    def version(self) -> int:
+        """Hash of the files in use, checked for changes like snapshot()."""
+        return self.snapshot().version
+
+    def reload_if_changed(self) -> bool:
+        with self._lock:
+            self._checked_at = time.monotonic()
+            mtimes = self._current_mtimes()
+            if mtimes == self._mtimes:
+                return False
+            try:
+                snapshot = _Ranges(*self.paths)
+            except (OSError, ValueError, KeyError):
+                logger.exception("Reference ranges not reloaded; keeping the previous ones")
+                return False
+            changed = snapshot.version != self._snapshot.version
+            self._snapshot, self._mtimes = snapshot, mtimes
+        if not changed:
+            return False
+        logger.info("Reference ranges reloaded")
+        for listener in self.reload_listeners:
+            listener()
+        return True
+
+    def score_tests(self, test_names, results, units, sexes=None, ages=None) -> np.ndarray:
+        """Score per test (0-100), NaN where no range applies."""
+        snapshot = self.snapshot()
+        count = len(test_names)
+        sexes = sexes if sexes is not None else [None] * count
+        ages = ages if ages is not None else [None] * count
+        codes = np.fromiter(
+            (snapshot.code(key) for key in zip(test_names, units, sexes, ages)), dtype=np.int64, count=count
+        )
+        scores = np.full(count, np.nan)
+        known = codes >= 0
+        if not known.any():
+            return scores
+        scale, offset, low, high = snapshot.params[codes[known]].T
+        values = np.asarray(results, dtype=float)[known] * scale + offset
+        mid, half_width = (low + high) / 2, (high - low) / 2
+        outside = np.maximum(0.0, 100 - np.abs(values - mid) / half_width * 100)
+        scores[known] = np.where((values >= low) & (values <= high), 100.0, outside)
+        return scores
+
+    def score_panel(self, tests, sex: str | None = None, age: float | None = None) -> float:
+        """Mean score of (test_name, result, unit) rows; 0 when none can be scored."""
+        if not tests:
+            return 0.0
+        test_names, results, units = zip(*tests)
+        count = len(test_names)
+        scores = self.score_tests(test_names, results, units, [sex] * count, [age] * count)
+        known = scores[~np.isnan(scores)]
+        return float(known.mean()) if known.size else 0.0
+
+    def score_panels(self, user_ids, test_names, results, units) -> dict:
+        """Mean score per user over many users' tests at once."""
+        scores = self.score_tests(test_names, results, units)
+        known = ~np.isnan(scores)
+        users, index = np.unique(np.asarray(user_ids)[known], return_inverse=True)
+        totals = np.bincount(index, weights=scores[known], minlength=len(users))
+        counts = np.bincount(index, minlength=len(users))
+        panels = {int(user_id): 0.0 for user_id in set(user_ids)}
+        panels.update({int(user_id): float(total / n) for user_id, total, n in zip(users, totals, counts)})
+        return panels
+
+
+reference_ranges = ReferenceRangeRegistry()
@@ -1,5 +1,5 @@
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from pydantic.config import ConfigDict
 from typing import List, Optional
 from datetime import datetime
@@ -29,6 +29,7 @@ class UserUpdate(BaseModel):
 class PhysicalActivityBase(BaseModel):
     activity_type: str
     duration: float
+    external_id: Optional[str] = None
 
 class PhysicalActivityCreate(PhysicalActivityBase):
     pass
@@ -39,10 +40,28 @@ class PhysicalActivityResponse(PhysicalActivityBase):
     timestamp: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class PhysicalActivityPatch(BaseModel):
+    activity_type: Optional[str] = None
+    duration: Optional[float] = None
+    timestamp: Optional[datetime] = None
+    model_config = ConfigDict(extra="forbid")
+
+    @field_validator("activity_type", "duration", "timestamp")
+    @classmethod
+    def _not_null(cls, value):
+        # Leave a field out to keep it; every patchable field is required in the responses
+        if value is None:
+            raise ValueError("cannot be null")
+        return value
+
+class PhysicalActivityBulkPatch(PhysicalActivityPatch):
+    id: int
+
 class SleepActivityBase(BaseModel):
     start_time: datetime
     end_time: datetime
     quality: Optional[str] = None
+    external_id: Optional[str] = None
 
 class SleepActivityCreate(SleepActivityBase):
     pass
@@ -57,10 +76,27 @@ class SleepActivityResponse(SleepActivityBase):
     
     model_config = ConfigDict(from_attributes=True)
 
+class SleepActivityPatch(BaseModel):
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    quality: Optional[str] = None
+    model_config = ConfigDict(extra="forbid")
+
+    @field_validator("start_time", "end_time", "quality")
+    @classmethod
+    def _not_null(cls, value):
+        if value is None:
+            raise ValueError("cannot be null")
+        return value
+
+class SleepActivityBulkPatch(SleepActivityPatch):
+    id: int
+
 class BloodTestBase(BaseModel):
     test_name: str
     result: float
     unit: str
+    external_id: Optional[str] = None
 
 class BloodTestCreate(BloodTestBase):
     pass
@@ -71,6 +107,67 @@ class BloodTestResponse(BloodTestBase):
     timestamp: datetime
     model_config = ConfigDict(from_attributes=True)
 
+class BloodTestPatch(BaseModel):
+    test_name: Optional[str] = None
+    result: Optional[float] = None
+    unit: Optional[str] = None
+    timestamp: Optional[datetime] = None
+    model_config = ConfigDict(extra="forbid")
+
+    @field_validator("test_name", "result", "unit", "timestamp")
+    @classmethod
+    def _not_null(cls, value):
+        if value is None:
+            raise ValueError("cannot be null")
+        return value
+
+class BloodTestBulkPatch(BloodTestPatch):
+    id: int
+
+class IngestReceipt(BaseModel):
+    receipt_id: str
+    accepted_at: datetime
+
+class ActivityTypeSummary(BaseModel):
+    activity_type: str
+    count: int
+    total_duration: float
+    mean_duration: float
+    last_timestamp: datetime
+
+class BloodTestSummary(BaseModel):
+    test_name: str
+    unit: str
+    count: int
+    latest_result: float
+    latest_unit: str
+    latest_timestamp: datetime
+    min_result: float
+    max_result: float
+    mean_result: float
+
+class UpsertResult(BaseModel):
+    id: int
+    external_id: Optional[str] = None
+    created: bool
+
+class PatchResult(BaseModel):
+    id: int
+    updated: bool
+
+class ChangeResponse(BaseModel):
+    seq: int
+    entity: str
+    entity_id: int
+    user_id: Optional[int] = None
+    operation: str
+    changed_at: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+class ChangePage(BaseModel):
+    changes: List[ChangeResponse]
+    next_cursor: int
+
 class UserWithActivities(UserRead):
     physical_activities: List[PhysicalActivityResponse] = Field(default_factory=list)
     sleep_activities: List[SleepActivityResponse] = Field(default_factory=list)
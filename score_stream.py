@@ -0,0 +1,142 @@
+"""Live health-score updates over Server-Sent Events.
+
+ScoreBroker keeps one small queue per connected client and recomputes a
+user's score only while someone is watching. It learns about writes in two
+ways:
+
+- Commits in this process call notify() (registered in
+  changefeed.commit_listeners).
+- Every POLL_SECONDS it compares the watched users' data versions in the
+  shared score cache, which catches writes made by other workers on the host.
+
+Notifications for a user within DEBOUNCE_SECONDS collapse into one
+recompute, and a new event is pushed only when the result differs from the
+last one sent. A slow client only ever holds the latest event. Idle
+connections cost a queue and a suspended generator, with a comment line
+every HEARTBEAT_SECONDS to keep proxies from closing them.
+"""
+import asyncio
+import json
+import os
+import threading
+
+DEBOUNCE_SECONDS = float(os.getenv("SCORE_STREAM_DEBOUNCE_SECONDS", 0.5))
+HEARTBEAT_SECONDS = float(os.getenv("SCORE_STREAM_HEARTBEAT_SECONDS", 15))
+POLL_SECONDS = float(os.getenv("SCORE_STREAM_POLL_SECONDS", 2))
+
+
+class ScoreBroker:
+    def __init__(self, compute, versions=None, debounce: float = DEBOUNCE_SECONDS, poll: float = POLL_SECONDS):
+        """compute(user_id) returns the payload to push (or None) and runs
+        in a worker thread; versions() returns the shared cache or None."""
+        self.compute = compute
+        self.versions = versions
+        self.debounce = debounce
+        self.poll = poll
+        self.loop = None
+        self.subscribers = {}
+        self.last_sent = {}
+        self.seen_versions = {}
+        self.pending = {}
+        self._watcher = None
+        self._counter_lock = threading.Lock()
+        self.counters = {"notifications": 0, "recomputes": 0, "pushes": 0}
+
+    def subscribe(self, user_id: int, payload: dict) -> asyncio.Queue:
+        """Register a client that has just been sent payload. Call on the event loop."""
+        self.loop = asyncio.get_running_loop()
+        if self._watcher is None and self.versions is not None:
+            self._watcher = self.loop.create_task(self._watch_versions())
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        self.last_sent[user_id] = payload
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+            self.last_sent.pop(user_id, None)
+            self.seen_versions.pop(user_id, None)
+
+    def notify(self, user_ids) -> None:
+        """Thread-safe; called after commits that changed these users' data."""
+        loop = self.loop
+        watched = [user_id for user_id in user_ids if user_id in self.subscribers]
+        if not watched or loop is None or loop.is_closed():
+            return
+        with self._counter_lock:
+            self.counters["notifications"] += len(watched)
+        loop.call_soon_threadsafe(self._schedule, watched)
+
+    def _schedule(self, user_ids):
+        for user_id in user_ids:
+            if user_id in self.subscribers and user_id not in self.pending:
+                self.pending[user_id] = self.loop.call_later(
+                    self.debounce, lambda user_id=user_id: self.loop.create_task(self._recompute(user_id))
+                )
+
+    async def _recompute(self, user_id: int):
+        self.pending.pop(user_id, None)
+        if user_id not in self.subscribers:
+            return
+        self.counters["recomputes"] += 1
+        payload = await self.loop.run_in_executor(None, self.compute, user_id)
+        if payload is None or payload == self.last_sent.get(user_id) or user_id not in self.subscribers:
+            return
+        self.last_sent[user_id] = payload
+        self.counters["pushes"] += 1
+        for queue in self.subscribers[user_id]:
+            if queue.full():  # the client only needs the newest score
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    async def _watch_versions(self):
+        while True:
+            await asyncio.sleep(self.poll)
+            cache = self.versions()
+            if cache is None:
+                continue
+            changed = []
+            for user_id in list(self.subscribers):
+                version = cache.data_version(user_id)
+                if self.seen_versions.get(user_id, version) != version:
+                    changed.append(user_id)
+                self.seen_versions[user_id] = version
+            if changed:
+                self._schedule(changed)
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        for handle in self.pending.values():
+            handle.cancel()
+        self.pending.clear()
+
+    def stats(self) -> dict:
+        return {**self.counters, "streams": sum(len(queues) for queues in self.subscribers.values()),
+                "users": len(self.subscribers)}
+
+
+def _event(payload: dict) -> str:
+    return f"event: score\ndata: {json.dumps(payload)}\n\n"
+
+
+async def sse_events(broker: ScoreBroker, user_id: int, payload: dict, heartbeat: float = HEARTBEAT_SECONDS):
+    """Event stream for one client: the current score, then changes."""
+    queue = broker.subscribe(user_id, payload)
+    try:
+        yield _event(payload)
+        while True:
+            try:
+                payload = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield _event(payload)
+    finally:
+        broker.unsubscribe(user_id, queue)
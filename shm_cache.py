@@ -0,0 +1,215 @@
+"""Host-local health score cache shared by all worker processes.
+
+Two fixed-size hash tables live in one mmap'd file (SHM_CACHE_PATH, in
+/dev/shm by default): per-user data versions and computed scores tagged
+with the data version and reference ranges version they were computed
+from. A cached score is served only while its tags still equal the user's
+current version and the ranges in use, so a write anywhere on the host
+invalidates it as soon as the writer commits (see
+changefeed.commit_listeners), and so does editing the reference ranges.
+
+Versions come from a clock in the file header, so every bump produces a
+value never used before. If a version slot is evicted and recreated, old
+scores simply stop matching. Entries older than SCORE_CACHE_TTL_SECONDS are
+ignored, which bounds staleness should a process die between committing
+and bumping.
+
+Tables are set-associative: a key hashes to a set of WAYS adjacent slots,
+and a full set evicts its least recently written slot. Each slot carries a
+seqlock counter. Readers take no locks; they retry when the counter is odd
+or changes under them. Writers serialise per stripe of sets with a thread
+lock plus an fcntl byte-range lock. The kernel drops that lock when a
+process dies, and the next writer repairs a slot left mid-write. Each
+database (DATABASE_URL) and layout (slot counts and formats) gets its own
+file, suffixed with their hashes, so workers of different databases on one
+host never see each other's versions.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+DEFAULT_PATH = "/dev/shm/healthtracker-cache" if os.path.isdir("/dev/shm") else "/tmp/healthtracker-cache"
+# Empty disables the cache
+SHM_CACHE_PATH = os.getenv("SHM_CACHE_PATH", DEFAULT_PATH)
+SCORE_SLOTS = int(os.getenv("SCORE_CACHE_SLOTS", 65536))
+VERSION_SLOTS = int(os.getenv("SCORE_CACHE_VERSION_SLOTS", 65536))
+TTL_SECONDS = float(os.getenv("SCORE_CACHE_TTL_SECONDS", 300))
+# Only hashed into the file name; workers left on database.py's default share it
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HSCACHE1"
+WAYS = 8
+STRIPES = 64
+READ_RETRIES = 16
+COMPONENTS = ("overall", "physical", "sleep", "blood")
+
+HEADER = struct.Struct("<8sQQ")  # magic, layout, version clock
+SEQ = struct.Struct("<I")
+# seq, padding, key (user_id, 0 = empty), written_at, version
+VERSION_SLOT = struct.Struct("<IIQdQ")
+# ... followed by the reference ranges version and the four score components
+SCORE_SLOT = struct.Struct("<IIQdQQ4d")
+
+
+class _SlotTable:
+    def __init__(self, cache, offset: int, slots: int, layout: struct.Struct, stripe_base: int):
+        self.cache = cache
+        self.offset = offset
+        self.sets = max(slots // WAYS, 1)
+        self.layout = layout
+        self.stripe_base = stripe_base
+        self.size = self.sets * WAYS * layout.size
+
+    def _slots(self, key: int) -> range:
+        index = (key * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) % self.sets
+        start = self.offset + index * WAYS * self.layout.size
+        return range(start, start + WAYS * self.layout.size, self.layout.size)
+
+    def _stripe(self, key: int) -> int:
+        return self.stripe_base + (key * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF) % self.sets % STRIPES
+
+    def _read(self, position: int):
+        mm = self.cache.mm
+        for _ in range(READ_RETRIES):
+            record = self.layout.unpack_from(mm, position)
+            if record[0] & 1 == 0 and SEQ.unpack_from(mm, position)[0] == record[0]:
+                return record
+        return None
+
+    def get(self, key: int):
+        """Lock-free lookup; None when absent (or a writer kept the slot busy)."""
+        for position in self._slots(key):
+            record = self._read(position)
+            if record is not None and record[2] == key:
+                return record
+        return None
+
+    def put(self, key: int, *values) -> bool:
+        """Write key's slot under its stripe lock. Returns True if another
+        key was evicted to make room."""
+        mm = self.cache.mm
+        with self.cache.lock(self._stripe(key)):
+            slots = [(position, *self.layout.unpack_from(mm, position)[2:4]) for position in self._slots(key)]
+            target = next((position for position, slot_key, _ in slots if slot_key == key), None)
+            if target is None:
+                target = next((position for position, slot_key, _ in slots if slot_key == 0), None)
+            evicted = target is None
+            if evicted:
+                target = min(slots, key=lambda slot: slot[2])[0]
+            seq = SEQ.unpack_from(mm, target)[0]
+            if seq & 1 == 0:  # odd means a writer died mid-write; reuse its count
+                seq += 1
+            SEQ.pack_into(mm, target, seq)
+            self.layout.pack_into(mm, target, seq, 0, key, time.time(), *values)
+            SEQ.pack_into(mm, target, seq + 1)
+        return evicted
+
+
+class SharedScoreCache:
+    def __init__(self, path: str, score_slots: int = SCORE_SLOTS, version_slots: int = VERSION_SLOTS,
+                 ttl: float = TTL_SECONDS, database: str = DATABASE_URL):
+        self.ttl = ttl
+        self.versions = _SlotTable(self, HEADER.size, version_slots, VERSION_SLOT, stripe_base=1)
+        self.scores = _SlotTable(self, HEADER.size + self.versions.size, score_slots, SCORE_SLOT,
+                                 stripe_base=1 + STRIPES)
+        self.size = HEADER.size + self.versions.size + self.scores.size
+        layout = f"{self.versions.sets}/{self.scores.sets}/{WAYS}/{VERSION_SLOT.format}/{SCORE_SLOT.format}"
+        self.layout = zlib.crc32(layout.encode())
+        # One file per database and layout, so a worker started with other sizes never remaps a live table
+        self.path = f"{path}.{zlib.crc32(database.encode()):08x}.{self.layout:08x}"
+        self._thread_locks = [threading.Lock() for _ in range(1 + 2 * STRIPES)]
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.lock(0):
+            if os.pread(self.fd, len(MAGIC), 0) != MAGIC or os.fstat(self.fd).st_size != self.size:
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, bytes(self.size), 0)
+                os.pwrite(self.fd, HEADER.pack(MAGIC, self.layout, 0), 0)
+            self.mm = mmap.mmap(self.fd, self.size)
+
+    @contextmanager
+    def lock(self, index: int):
+        # fcntl locks are per process, so threads also need a lock of their own
+        with self._thread_locks[index]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, index)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, index)
+
+    def _next_version(self) -> int:
+        with self.lock(0):
+            magic, layout, clock = HEADER.unpack_from(self.mm, 0)
+            HEADER.pack_into(self.mm, 0, magic, layout, clock + 1)
+        return clock + 1
+
+    def bump(self, user_ids) -> None:
+        """Give each user a fresh data version, invalidating cached scores."""
+        for user_id in user_ids:
+            self._put(self.versions, user_id, self._next_version())
+
+    def data_version(self, user_id: int) -> int:
+        record = self.versions.get(user_id)
+        if record is not None:
+            return record[4]
+        version = self._next_version()
+        self._put(self.versions, user_id, version)
+        return version
+
+    def get_score(self, user_id: int, version: int, ranges: int = 0) -> dict | None:
+        record = self.scores.get(user_id)
+        if record is None or record[4:6] != (version, ranges) or time.time() - record[3] > self.ttl:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return dict(zip(COMPONENTS, record[6:]))
+
+    def put_score(self, user_id: int, version: int, components: dict, ranges: int = 0) -> None:
+        self._put(self.scores, user_id, version, ranges, *(components[name] for name in COMPONENTS))
+
+    def _put(self, table: _SlotTable, key: int, *values) -> None:
+        if table.put(key, *values):
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        """Counters are per worker process."""
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters, "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None}
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+
+_cache = None
+_disabled = not SHM_CACHE_PATH
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> SharedScoreCache | None:
+    """The process-wide cache, opened on first use; None when disabled."""
+    global _cache, _disabled
+    if _cache is None and not _disabled:
+        with _cache_lock:
+            if _cache is None and not _disabled:
+                try:
+                    _cache = SharedScoreCache(SHM_CACHE_PATH)
+                except OSError:
+                    logger.exception("Shared score cache unavailable at %s; running without it", SHM_CACHE_PATH)
+                    _disabled = True
+    return _cache
+
+
+def bump_data_versions(user_ids) -> None:
+    cache = get_cache()
+    if cache is not None:
+        cache.bump(user_ids)
@@ -0,0 +1,86 @@
+"""Request coalescing: concurrent calls for the same key share one execution.
+
+The first caller for a key (the leader) runs the function; callers that
+arrive while it is in flight wait for it and receive the same result or
+exception. Nothing is cached once the call completes, so a later request
+always sees fresh data.
+
+SingleFlight.do serves threads (sync endpoints run in the threadpool) and
+SingleFlight.do_async serves coroutines on the event loop.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def _join(self, calls: dict, key, new_call):
+        """Return (call, is_leader) for key, registering new_call() if none is in flight."""
+        with self._lock:
+            self.requests += 1
+            call = calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = calls[key] = new_call()
+            self.executions += 1
+            return call, True
+
+    def _leave(self, calls: dict, key):
+        with self._lock:
+            del calls[key]
+
+    def do(self, key, fn):
+        call, leader = self._join(self._calls, key, _Call)
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            self._leave(self._calls, key)
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        """fn is a coroutine function; it runs once per key at a time on each
+        event loop, as a task of its own, so a cancelled caller (the first one
+        included) leaves the others waiting."""
+        loop = asyncio.get_running_loop()
+        task, leader = self._join(self._async_calls, (loop, key), lambda: loop.create_task(fn()))
+        if leader:
+            task.add_done_callback(lambda done: self._finish_async((loop, key), done))
+        return await asyncio.shield(task)
+
+    def _finish_async(self, key, task):
+        self._leave(self._async_calls, key)
+        if not task.cancelled():
+            # Mark retrieved so a failure whose callers all left doesn't log a warning
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._async_calls),
+        }
@@ -0,0 +1,171 @@
+"""Nightly sleep totals built from possibly overlapping sleep segments.
+
+Trackers often split one night into several overlapping or adjacent
+segments. Segments of a user are merged with a single sort-and-sweep pass
+over rows ordered by start_time, and each merged session is credited to
+the night it started in (nights run noon to noon). Results live in the
+sleep_nights table, which crud keeps current on every sleep write so the
+sleep score reads one row per night instead of re-merging segments.
+
+Once compaction.py has replaced the raw segments of old nights with their
+merged sessions, those nights are frozen: refreshes and rebuilds leave
+every night before the compaction watermark untouched.
+
+Backfill or repair the table with:
+
+    python sleep_nights.py --rebuild
+"""
+import argparse
+from datetime import date, datetime, time, timedelta
+from itertools import groupby
+
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+
+from changefeed import mark_changed
+from healthDB import CompactionWatermark, SleepActivity, SleepNight, User
+
+# Sleep that starts before noon counts towards the previous night
+NIGHT_START = timedelta(hours=12)
+# CompactionWatermark entity for raw sleep segments
+SLEEP_WATERMARK = "sleep_activity"
+
+
+def night_of(moment: datetime) -> date:
+    return (moment - NIGHT_START).date()
+
+def night_start(night: date) -> datetime:
+    return datetime.combine(night, time()) + NIGHT_START
+
+def frozen_before(db: Session) -> date | None:
+    """First night whose segments have not been compacted away, if any were."""
+    watermark = db.get(CompactionWatermark, SLEEP_WATERMARK)
+    return night_of(watermark.compacted_before) if watermark is not None else None
+
+
+def merge_sessions(segments):
+    """Merge (start_time, end_time) pairs sorted by start_time into
+    (start_time, end_time, segment_count) sessions in one pass."""
+    session_start = session_end = None
+    count = 0
+    for start, end in segments:
+        if session_end is not None and start <= session_end:
+            session_end = max(session_end, end)
+            count += 1
+            continue
+        if session_start is not None:
+            yield session_start, session_end, count
+        session_start, session_end, count = start, end, 1
+    if session_start is not None:
+        yield session_start, session_end, count
+
+
+def session_minutes(start: datetime, end: datetime) -> int:
+    return int((end - start).total_seconds() / 60)
+
+
+def merge_segments(segments) -> dict:
+    """Merge (start_time, end_time) pairs sorted by start_time into
+    {night: [total_minutes, segment_count]} in one pass."""
+    nights = {}
+    for start, end, count in merge_sessions(segments):
+        totals = nights.setdefault(night_of(start), [0, 0])
+        totals[0] += session_minutes(start, end)
+        totals[1] += count
+    return nights
+
+
+def _night_rows(user_id: int, nights: dict) -> list[dict]:
+    return [
+        {"user_id": user_id, "night": night, "total_minutes": minutes, "segment_count": count}
+        for night, (minutes, count) in nights.items()
+    ]
+
+
+def refresh_nights(db: Session, user_id: int, times) -> None:
+    """Recompute the nights around the given segment start times for one
+    user. Call after flushing a sleep write, before committing, so the
+    totals change in the same transaction.
+
+    Merged sessions are assumed to be shorter than a day, so only the
+    touched nights and their neighbours can change.
+    """
+    touched = [night_of(moment) for moment in times if moment is not None]
+    if not touched:
+        return
+    first, last = min(touched) - timedelta(days=1), max(touched) + timedelta(days=1)
+
+    # Serialize refreshes per user so concurrent writers don't interleave. FOR NO KEY
+    # UPDATE still lets other transactions insert rows referencing the user
+    db.query(User.id).filter(User.id == user_id).with_for_update(key_share=True).first()
+
+    frozen = frozen_before(db)
+    if frozen is not None:
+        first = max(first, frozen)
+        if first > last:
+            return
+
+    # Start one night early so a session already running at `first` is
+    # merged whole rather than credited from its middle.
+    segments = (
+        db.query(SleepActivity.start_time, SleepActivity.end_time)
+        .filter(SleepActivity.user_id == user_id,
+                SleepActivity.start_time >= night_start(first - timedelta(days=1)),
+                SleepActivity.start_time < night_start(last + timedelta(days=1)))
+        .order_by(SleepActivity.start_time)
+    )
+    nights = {night: totals for night, totals in merge_segments(segments).items() if first <= night <= last}
+
+    db.execute(delete(SleepNight).where(SleepNight.user_id == user_id,
+                                        SleepNight.night >= first,
+                                        SleepNight.night <= last))
+    if nights:
+        db.execute(insert(SleepNight), _night_rows(user_id, nights))
+
+
+def rebuild_sleep_nights(db: Session, user_id: int | None = None, chunk_size: int = 10_000) -> int:
+    """Rebuild sleep_nights from scratch for one user or everyone, streaming
+    segments in (user_id, start_time) order. Nights frozen by compaction are
+    kept. Returns the number of nights written. Commits."""
+    clear = delete(SleepNight)
+    segments = db.query(SleepActivity.user_id, SleepActivity.start_time, SleepActivity.end_time)
+    frozen = frozen_before(db)
+    if frozen is not None:
+        clear = clear.where(SleepNight.night >= frozen)
+        segments = segments.filter(SleepActivity.start_time >= night_start(frozen))
+    if user_id is not None:
+        clear = clear.where(SleepNight.user_id == user_id)
+        segments = segments.filter(SleepActivity.user_id == user_id)
+    db.execute(clear)
+
+    written = 0
+    rows = segments.order_by(SleepActivity.user_id, SleepActivity.start_time).yield_per(chunk_size)
+    for segment_user_id, user_segments in groupby(rows, key=lambda row: row.user_id):
+        nights = merge_segments((row.start_time, row.end_time) for row in user_segments)
+        db.execute(insert(SleepNight), _night_rows(segment_user_id, nights))
+        mark_changed(db, [segment_user_id])
+        written += len(nights)
+    if user_id is not None:
+        mark_changed(db, [user_id])
+    db.commit()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the sleep_nights table.")
+    parser.add_argument("--rebuild", action="store_true", help="recompute all nights from sleep segments")
+    parser.add_argument("--user-id", type=int, help="limit the rebuild to one user")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do; pass --rebuild")
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"{rebuild_sleep_nights(db, args.user_id)} nights written")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Streamed list responses for reads too large to build in memory.
+
+``?stream=ndjson`` sends one JSON object per line; ``?stream=json`` sends
+the same rows as a single JSON array. Rows are read in chunks through a
+server-side cursor and each chunk is written out before the next is
+fetched. Memory then depends on the chunk size, not the result size, and
+the first bytes go out as soon as the first chunk is read.
+
+The body is produced after the endpoint has returned. By then the
+request's session from get_db has been closed, so the stream opens its own
+session from get_session_factory.
+"""
+import json
+from typing import Literal
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+from database import SessionLocal
+
+StreamFormat = Literal["json", "ndjson"]
+
+MEDIA_TYPES = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+
+def get_session_factory():
+    return SessionLocal
+
+
+def streamed_response(session_factory, read_chunks, format: StreamFormat) -> StreamingResponse:
+    """Stream the rows of read_chunks(db), an iterator of lists of dicts."""
+
+    def body():
+        with session_factory() as db:
+            if format == "json":
+                opening = "["
+                for chunk in read_chunks(db):
+                    if chunk:
+                        yield opening + ",".join(json.dumps(row) for row in jsonable_encoder(chunk))
+                        opening = ","
+                yield "[]" if opening == "[" else "]"
+            else:
+                for chunk in read_chunks(db):
+                    yield "".join(json.dumps(row) + "\n" for row in jsonable_encoder(chunk))
+
+    return StreamingResponse(body(), media_type=MEDIA_TYPES[format])
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import shm_cache
+from healthDB import Base
+
+
+@pytest.fixture(autouse=True)
+def no_shared_cache(monkeypatch):
+    """Tests use throwaway databases; keep their scores out of the host's cache file."""
+    monkeypatch.setattr(shm_cache, "_cache", None)
+    monkeypatch.setattr(shm_cache, "_disabled", True)
+
+
+@pytest.fixture
+def session_factory():
+    """A fresh in-memory database per test, shared by every thread."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(session_factory):
+    session = session_factory()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(session_factory, monkeypatch):
+    """TestClient for the app with every session dependency on the test database."""
+    from fastapi.testclient import TestClient
+
+    import admission
+    import database
+    import fastapi_user
+    import streaming
+    from main import app
+
+    def override_get_db():
+        session = session_factory()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    app.dependency_overrides[database.get_db] = override_get_db
+    app.dependency_overrides[fastapi_user.get_db] = override_get_db
+    app.dependency_overrides[streaming.get_session_factory] = lambda: session_factory
+    # Every test client has the same address, so start each test with a full write bucket
+    monkeypatch.setattr(admission.WRITE_LIMITER, "_buckets", OrderedDict())
+    yield TestClient(app)
+    app.dependency_overrides.clear()
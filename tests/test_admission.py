@@ -0,0 +1,103 @@
+import asyncio
+import re
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from admission import AdmissionControlMiddleware, ConcurrencyLimiter, TokenBucketLimiter
+
+
+def test_concurrency_limiter_queues_then_sheds():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queue=1, queue_timeout=1.0)
+        assert await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        # Queue is full, so the third request is shed immediately
+        assert not await limiter.acquire()
+        limiter.release()
+        assert await queued
+        limiter.release()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["admitted"] == 2
+    assert stats["queued"] == 1
+    assert stats["shed"] == 1
+    assert stats["in_flight"] == 0
+
+def test_concurrency_limiter_queue_timeout():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queue=5, queue_timeout=0.01)
+        assert await limiter.acquire()
+        assert not await limiter.acquire()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 1
+    assert stats["waiting"] == 0
+
+def test_cancelled_waiters_do_not_leak_slots():
+    async def scenario():
+        limiter = ConcurrencyLimiter("test", max_concurrent=1, max_queue=5, queue_timeout=1.0)
+        assert await limiter.acquire()
+        # Cancelled while still queued
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert limiter.stats()["waiting"] == 0
+
+        # Cancelled after the slot was already handed to it: either the
+        # request still gets the slot, or the slot is passed on
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release()
+        queued.cancel()
+        (admitted,) = await asyncio.gather(queued, return_exceptions=True)
+        if admitted is True:
+            limiter.release()
+        assert limiter.in_flight == 0
+        assert await limiter.acquire()
+        limiter.release()
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["in_flight"], stats["waiting"]) == (0, 0)
+
+def test_token_bucket_limits_per_key():
+    limiter = TokenBucketLimiter(rate=1.0, burst=2)
+    assert limiter.take("user:1") == 0
+    assert limiter.take("user:1") == 0
+    assert limiter.take("user:1") > 0
+    # Other users have their own bucket
+    assert limiter.take("user:2") == 0
+
+def test_middleware_sheds_with_retry_after():
+    app = FastAPI()
+
+    @app.get("/get_health_score")
+    def score():
+        return {"ok": True}
+
+    @app.post("/activities/")
+    def create(user_id: int):
+        return {"ok": True}
+
+    shed_all = ConcurrencyLimiter("health_score", max_concurrent=0, max_queue=0, queue_timeout=0)
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        route_limits=[("GET", re.compile(r"^/get_health_score$"), shed_all)],
+        write_limiter=TokenBucketLimiter(rate=0.5, burst=1),
+    )
+    client = TestClient(app)
+
+    response = client.get("/get_health_score")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    assert client.post("/activities/?user_id=1").status_code == 200
+    # A new user id per request does not get a new bucket
+    response = client.post("/activities/?user_id=2", headers={"X-User-Id": "2"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
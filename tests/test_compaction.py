@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import crud
+from compaction import compact
+from healthDB import ActivityDailyAggregate, PhysicalActivity, SleepActivity, SleepNight, SleepSession
+from healthscore import calculate_health_score_components
+from schemas import PhysicalActivityCreate, SleepActivityCreate, UserCreate
+
+
+def _add_activity(db, user_id, activity_type, duration, timestamp):
+    crud.ingest_physical_activities(db, [(user_id, PhysicalActivityCreate(activity_type=activity_type, duration=duration), timestamp)])
+
+def _add_sleep(db, user_id, start, end):
+    return crud.create_sleep_activity(db, user_id, SleepActivityCreate(start_time=start, end_time=end, quality="ok"))
+
+
+def test_compaction_preserves_score_and_summary(db):
+    user = crud.create_user(db, UserCreate(username="old", email="old@test.com"))
+    _add_activity(db, user.id, "running", 30, datetime(2020, 1, 1, 8))
+    _add_activity(db, user.id, "running", 20, datetime(2020, 1, 1, 18))
+    _add_activity(db, user.id, "cycling", 40, datetime(2020, 1, 2, 8))
+    _add_activity(db, user.id, "running", 10, datetime.now())
+    _add_sleep(db, user.id, datetime(2020, 1, 1, 23), datetime(2020, 1, 2, 6))
+    _add_sleep(db, user.id, datetime(2020, 1, 2, 5), datetime(2020, 1, 2, 7))
+    score = calculate_health_score_components(user, db)
+    summary = crud.get_activity_summary(db, user.id)
+
+    assert compact(db, retention_days=365, dry_run=True) | {"cutoff": None} == {
+        "cutoff": None, "dry_run": True, "physical_activities": 3, "sleep_activities": 2,
+    }
+    report = compact(db, retention_days=365, batch_size=2, verify=True)
+
+    assert (report["physical_activities"], report["sleep_activities"]) == (3, 2)
+    assert report["mismatched_users"] == []
+    assert db.query(PhysicalActivity).count() == 1
+    assert db.query(SleepActivity).count() == 0
+    assert db.query(ActivityDailyAggregate).count() == 2
+    assert calculate_health_score_components(user, db) == score
+    assert crud.get_activity_summary(db, user.id) == summary
+    assert compact(db, retention_days=365)["physical_activities"] == 0
+
+def test_compacted_nights_are_frozen_and_late_segments_folded(db):
+    user = crud.create_user(db, UserCreate(username="sleeper", email="sleeper@test.com"))
+    _add_sleep(db, user.id, datetime(2020, 1, 1, 23), datetime(2020, 1, 2, 6))
+    compact(db, retention_days=365)
+    night = db.query(SleepNight).filter(SleepNight.user_id == user.id).one()
+    assert (night.total_minutes, night.segment_count) == (420, 1)
+
+    # A late segment for the frozen night leaves it alone until the next run
+    _add_sleep(db, user.id, datetime(2020, 1, 2, 6), datetime(2020, 1, 2, 7))
+    db.refresh(night)
+    assert night.total_minutes == 420
+
+    assert compact(db, retention_days=365)["sleep_activities"] == 1
+    db.refresh(night)
+    assert (night.total_minutes, night.segment_count) == (480, 2)
+
+def test_late_segments_are_merged_with_compacted_sessions(db):
+    user = crud.create_user(db, UserCreate(username="overlap", email="overlap@test.com"))
+    _add_sleep(db, user.id, datetime(2020, 1, 1, 23), datetime(2020, 1, 2, 3))
+    _add_sleep(db, user.id, datetime(2020, 1, 2, 2), datetime(2020, 1, 2, 6))
+    _add_sleep(db, user.id, datetime(2020, 1, 3, 23), datetime(2020, 1, 4, 6))
+    compact(db, retention_days=365, batch_size=1)
+    assert db.query(SleepSession).count() == 2
+
+    # Overlaps the end of the first night's session and is sent twice by a retrying client
+    _add_sleep(db, user.id, datetime(2020, 1, 2, 5), datetime(2020, 1, 2, 7, 30))
+    _add_sleep(db, user.id, datetime(2020, 1, 2, 5), datetime(2020, 1, 2, 7, 30))
+    assert compact(db, retention_days=365, batch_size=1)["sleep_activities"] == 2
+
+    nights = {night.night.day: (night.total_minutes, night.segment_count)
+              for night in db.query(SleepNight).filter(SleepNight.user_id == user.id)}
+    assert nights == {1: (510, 4), 3: (420, 1)}
+    assert db.query(SleepSession).count() == 2
+    assert db.query(SleepActivity).count() == 0
+
+def test_periodic_compaction_survives_a_failed_run(session_factory, monkeypatch):
+    import threading
+    import compaction
+    runs = []
+    stop = threading.Event()
+
+    def flaky_compact(db):
+        runs.append(db)
+        if len(runs) == 1:
+            raise RuntimeError("database went away")
+        stop.set()
+
+    monkeypatch.setattr(compaction, "compact", flaky_compact)
+    compaction.run_periodic_compaction(session_factory, stop, interval=0)
+    assert len(runs) == 2
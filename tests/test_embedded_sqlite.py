@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+import crud
+from database import RoutingSession, create_sqlite_engines
+from healthDB import Base, SleepNight
+from healthscore import calculate_health_score_components
+from schemas import PhysicalActivityCreate, SleepActivityCreate, UserCreate
+
+
+def _embedded(tmp_path):
+    writer, reader = create_sqlite_engines(f"sqlite:///{tmp_path / 'health.db'}", readers=2)
+    Base.metadata.create_all(bind=writer)
+    return writer, reader, sessionmaker(class_=RoutingSession, writer=writer, reader=reader,
+                                        autoflush=False, autocommit=False)
+
+
+def test_engines_apply_pragmas(tmp_path):
+    writer, reader, _ = _embedded(tmp_path)
+    with writer.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+    with reader.connect() as conn:
+        assert conn.execute(text("PRAGMA query_only")).scalar() == 1
+
+def test_reads_and_writes_are_routed(tmp_path):
+    writer, reader, SessionLocal = _embedded(tmp_path)
+    db = SessionLocal()
+    try:
+        user = crud.create_user(db, UserCreate(username="edge", email="edge@test.com"))
+        # Sleep writes read their own uncommitted segments back when refreshing nights
+        crud.create_sleep_activity(db, user.id, SleepActivityCreate(
+            start_time=datetime(2025, 9, 1, 23), end_time=datetime(2025, 9, 2, 6), quality="ok"))
+        crud.create_physical_activity(db, user.id, PhysicalActivityCreate(activity_type="walk", duration=150))
+        assert db.query(SleepNight).filter(SleepNight.user_id == user.id).one().total_minutes == 420
+
+        assert db.get_bind(clause=text("SELECT 1")) is reader
+        assert calculate_health_score_components(user, db)["physical"] == 100
+        assert db.get_bind() is writer
+    finally:
+        db.close()
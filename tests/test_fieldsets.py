@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import crud
+from healthDB import BloodTest
+from schemas import BloodTestCreate
+
+@pytest.fixture
+def user_id(client):
+    response = client.post("/users/", json={"username": "fields", "email": "fields@test.com"})
+    user_id = response.json()["id"]
+    yield user_id
+    client.delete(f"/users/{user_id}")
+
+def test_list_returns_only_requested_fields(client, user_id):
+    client.post(f"/activities/?user_id={user_id}", json={"activity_type": "running", "duration": 30})
+    response = client.get(f"/activities/user/{user_id}?fields=timestamp,duration")
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 1
+    assert set(data[0]) == {"timestamp", "duration"}
+    assert data[0]["duration"] == 30
+
+def test_detail_returns_only_requested_fields(client, user_id):
+    response = client.get(f"/users/{user_id}?fields=username")
+    assert response.status_code == 200
+    assert response.json() == {"username": "fields"}
+
+def test_unknown_field_rejected(client, user_id):
+    response = client.get(f"/sleep/user/{user_id}?fields=duration,password")
+    assert response.status_code == 400
+    assert "password" in response.json()["detail"]
+
+def test_large_responses_are_compressed(client, user_id):
+    for _ in range(15):
+        client.post(f"/blood/?user_id={user_id}", json={"test_name": "glucose", "result": 90, "unit": "mg/dL"})
+    response = client.get(f"/blood/user/{user_id}", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] in ("gzip", "br")
+    assert len(response.json()) == 15
+
+    small = client.get(f"/users/{user_id}", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
+
+def test_streamed_ndjson_matches_list(client, user_id):
+    for duration in (10, 20, 30):
+        client.post(f"/activities/?user_id={user_id}", json={"activity_type": "running", "duration": duration})
+    listed = client.get(f"/activities/user/{user_id}").json()
+    response = client.get(f"/activities/user/{user_id}?stream=ndjson")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    streamed = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(streamed, key=lambda row: row["id"]) == sorted(listed, key=lambda row: row["id"])
+
+def test_streamed_json_array_respects_fields(client, user_id):
+    assert client.get(f"/sleep/user/{user_id}?stream=json").json() == []
+    client.post(f"/blood/?user_id={user_id}", json={"test_name": "glucose", "result": 90, "unit": "mg/dL"})
+    response = client.get(f"/blood/user/{user_id}?stream=json&fields=test_name,result")
+    assert response.json() == [{"test_name": "glucose", "result": 90}]
+
+def test_stream_reads_in_bounded_chunks(db, user_id):
+    for _ in range(5):
+        crud.create_blood_test(db, user_id, BloodTestCreate(test_name="ldl", result=100, unit="mg/dL"))
+    chunks = list(crud._stream_rows(db, BloodTest, ["id", "result"], BloodTest.user_id == user_id, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+def test_soft_deleted_users_data_is_unreachable(client, db, user_id):
+    client.post(f"/blood/?user_id={user_id}", json={"test_name": "glucose", "result": 90, "unit": "mg/dL"})
+    test_id = client.get(f"/blood/user/{user_id}").json()[0]["id"]
+    crud.soft_delete_user(db, user_id)  # before the purge has run
+
+    assert client.get(f"/blood/user/{user_id}").status_code == 404
+    assert client.get(f"/blood/user/{user_id}?stream=ndjson").status_code == 404
+    assert client.get(f"/blood/user/{user_id}/summary").status_code == 404
+    assert client.get(f"/blood/{test_id}").status_code == 404
+    assert client.post(f"/activities/?user_id={user_id}", json={"activity_type": "run", "duration": 5}).status_code == 404
@@ -129,3 +129,285 @@ def test_delete_blood_test(db_session):
     deleted = crud.delete_blood_test(db_session, test.id)
     assert deleted.id == test.id
     assert crud.get_blood_test(db_session, test.id) is None
+
+def test_upsert_physical_activities_is_idempotent(db_session):
+    user = crud.create_user(db_session, UserCreate(username="upsertuser", email="upsert@test.com"))
+    batch = [
+        PhysicalActivityCreate(activity_type="running", duration=30, external_id="a1"),
+        PhysicalActivityCreate(activity_type="cycling", duration=45, external_id="a2"),
+        PhysicalActivityCreate(activity_type="walking", duration=10),
+    ]
+    first = crud.upsert_physical_activities(db_session, user.id, batch)
+    assert [r["created"] for r in first] == [True, True, True]
+
+    # A retry with a corrected duration updates instead of inserting
+    batch[0] = PhysicalActivityCreate(activity_type="running", duration=35, external_id="a1")
+    retry = crud.upsert_physical_activities(db_session, user.id, batch[:2])
+    assert [r["created"] for r in retry] == [False, False]
+    assert [r["id"] for r in retry] == [r["id"] for r in first[:2]]
+
+    activities = crud.get_user_activities(db_session, user.id)
+    assert len(activities) == 3
+    assert crud.get_physical_activity(db_session, first[0]["id"]).duration == 35
+
+def test_create_with_external_id_does_not_duplicate(db_session):
+    user = crud.create_user(db_session, UserCreate(username="retryuser", email="retry@test.com"))
+    test_in = BloodTestCreate(test_name="glucose", result=95, unit="mg/dL", external_id="lab-1")
+    first = crud.create_blood_test(db_session, user.id, test_in)
+    second = crud.create_blood_test(db_session, user.id, test_in)
+    assert first.id == second.id
+    assert len(crud.get_user_blood_tests(db_session, user.id)) == 1
+
+def test_dedup_removes_retried_and_legacy_duplicates():
+    from sqlalchemy import MetaData, UniqueConstraint
+    from dedup import deduplicate
+    from healthDB import BloodTest, PhysicalActivity, SleepActivity
+    # Schema as deployed before the (user_id, external_id) constraint existed
+    metadata = MetaData()
+    for table in Base.metadata.sorted_tables:
+        legacy = table.to_metadata(metadata)
+        legacy.constraints = {c for c in legacy.constraints if not isinstance(c, UniqueConstraint)}
+    legacy_engine = create_engine("sqlite://")
+    metadata.create_all(bind=legacy_engine)
+    db = sessionmaker(bind=legacy_engine, autoflush=False)()
+    user = crud.create_user(db, UserCreate(username="dupuser", email="dup@test.com"))
+    night = dict(user_id=user.id, start_time=datetime(2025, 8, 24, 22), end_time=datetime(2025, 8, 25, 6), quality="good")
+    taken = datetime(2025, 8, 1, 9)
+    db.add_all([
+        SleepActivity(**night, external_id="watch-1"),
+        SleepActivity(**night, external_id="watch-1"),  # client retry
+        # Legacy rows without external_id: a retried upload and a different result
+        BloodTest(user_id=user.id, test_name="glucose", result=95, unit="mg/dL", timestamp=taken),
+        BloodTest(user_id=user.id, test_name="glucose", result=95, unit="mg/dL", timestamp=taken),
+        BloodTest(user_id=user.id, test_name="glucose", result=97, unit="mg/dL", timestamp=taken),
+        PhysicalActivity(user_id=user.id, activity_type="running", duration=30, timestamp=taken),
+        PhysicalActivity(user_id=user.id, activity_type="running", duration=30, timestamp=taken),
+        PhysicalActivity(user_id=user.id, activity_type="running", duration=30, timestamp=datetime(2025, 8, 2, 9)),
+    ])
+    db.commit()
+    kept = min(s.id for s in db.query(SleepActivity))
+
+    assert deduplicate(db) == {"physical_activities": 1, "sleep_activities": 1, "blood_tests": 1}
+    deduplicate(db, apply=True)
+    assert [s.id for s in db.query(SleepActivity)] == [kept]
+    assert sorted(b.result for b in db.query(BloodTest)) == [95, 97]
+    assert db.query(PhysicalActivity).count() == 2
+    db.close()
+
+def test_overlapping_sleep_segments_merge_into_one_night(db_session):
+    from healthDB import SleepNight
+    from healthscore import sleep_score_calculation
+    user = crud.create_user(db_session, UserCreate(username="nightuser", email="night@test.com"))
+    segments = [
+        (datetime(2025, 8, 24, 22, 0), datetime(2025, 8, 25, 2, 0)),
+        (datetime(2025, 8, 25, 1, 0), datetime(2025, 8, 25, 4, 0)),   # overlaps the first
+        (datetime(2025, 8, 25, 4, 0), datetime(2025, 8, 25, 6, 0)),   # adjacent
+        (datetime(2025, 8, 25, 23, 0), datetime(2025, 8, 26, 6, 0)),  # next night
+    ]
+    created = [crud.create_sleep_activity(db_session, user.id, SleepActivityCreate(start_time=start, end_time=end, quality="ok"))
+               for start, end in segments]
+
+    nights = db_session.query(SleepNight).filter(SleepNight.user_id == user.id).order_by(SleepNight.night).all()
+    assert [(n.total_minutes, n.segment_count) for n in nights] == [(480, 3), (420, 1)]
+    assert sleep_score_calculation(db_session, user) == 100
+
+    crud.delete_sleep_activity(db_session, created[2].id)
+    crud.update_sleep_activity(db_session, created[3].id, {"end_time": "2025-08-26T05:00:00"})
+    nights = db_session.query(SleepNight).filter(SleepNight.user_id == user.id).order_by(SleepNight.night).all()
+    assert [(n.total_minutes, n.segment_count) for n in nights] == [(360, 2), (360, 1)]
+
+def test_rebuild_sleep_nights_matches_incremental(db_session):
+    from healthDB import SleepNight
+    from sleep_nights import rebuild_sleep_nights
+    user = crud.create_user(db_session, UserCreate(username="rebuilduser", email="rebuild@test.com"))
+    for day in range(3):
+        start = datetime(2025, 8, 20 + day, 23, 0)
+        crud.create_sleep_activity(db_session, user.id, SleepActivityCreate(start_time=start, end_time=start.replace(hour=23, minute=30), quality="ok"))
+    query = db_session.query(SleepNight.night, SleepNight.total_minutes).filter(SleepNight.user_id == user.id).order_by(SleepNight.night)
+    incremental = query.all()
+    assert rebuild_sleep_nights(db_session, user.id) == 3
+    assert query.all() == incremental
+
+def test_delete_user_removes_related_rows(db_session):
+    from healthDB import PhysicalActivity, SleepNight
+    user = crud.create_user(db_session, UserCreate(username="cascadeuser", email="cascade@test.com"))
+    crud.create_physical_activity(db_session, user.id, PhysicalActivityCreate(activity_type="running", duration=30))
+    crud.create_sleep_activity(db_session, user.id, SleepActivityCreate(
+        start_time=datetime(2025, 8, 24, 22, 0), end_time=datetime(2025, 8, 25, 6, 0), quality="ok"))
+    crud.delete_user(db_session, user.id)
+    assert db_session.query(PhysicalActivity).filter(PhysicalActivity.user_id == user.id).count() == 0
+    assert db_session.query(SleepNight).filter(SleepNight.user_id == user.id).count() == 0
+    assert crud.get_user_sleep_activities(db_session, user.id) == []
+
+def test_async_purge_hides_user_then_removes_data(db_session):
+    from healthDB import User
+    from user_purge import purge_user
+    user_id = crud.create_user(db_session, UserCreate(username="purgeuser", email="purge@test.com")).id
+    for minutes in range(5):
+        crud.create_blood_test(db_session, user_id, BloodTestCreate(test_name="glucose", result=90 + minutes, unit="mg/dL"))
+
+    test_id = crud.get_user_blood_tests(db_session, user_id)[0].id
+
+    crud.soft_delete_user(db_session, user_id)
+    assert crud.get_user(db_session, user_id) is None
+    assert crud.get_user_blood_tests(db_session, user_id) == []
+    assert crud.get_blood_test_summary(db_session, user_id) == []
+    assert crud.get_blood_test(db_session, test_id) is None
+    assert crud.update_blood_test(db_session, test_id, {"result": 1}) is None
+    from schemas import BloodTestBulkPatch
+    assert crud.patch_blood_tests(db_session, [BloodTestBulkPatch(id=test_id, result=1)]) == [
+        {"id": test_id, "updated": False}]
+
+    assert purge_user(db_session, user_id, batch_size=2) == 5
+    assert crud.get_user_blood_tests(db_session, user_id) == []
+    assert db_session.get(User, user_id) is None
+
+def test_get_user_profile_loads_recent_slices(db_session):
+    from sqlalchemy import event
+    from schemas import UserWithActivities
+    user = crud.create_user(db_session, UserCreate(username="profileuser", email="profile@test.com"))
+    for minutes in range(5):
+        crud.create_physical_activity(db_session, user.id, PhysicalActivityCreate(activity_type="running", duration=10 + minutes))
+    crud.create_blood_test(db_session, user.id, BloodTestCreate(test_name="glucose", result=90, unit="mg/dL"))
+    user_id = user.id
+    db_session.expire_all()
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        profile = UserWithActivities.model_validate(crud.get_user_profile(db_session, user_id, limit=3))
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert len(statements) == 4
+    assert [a.duration for a in profile.physical_activities] == [14, 13, 12]
+    assert len(profile.blood_tests) == 1
+    assert profile.sleep_activities == []
+
+def test_activity_summary_groups_by_type(db_session):
+    user = crud.create_user(db_session, UserCreate(username="summaryuser", email="summary@test.com"))
+    for activity_type, duration in [("running", 30), ("running", 50), ("cycling", 60)]:
+        crud.create_physical_activity(db_session, user.id, PhysicalActivityCreate(activity_type=activity_type, duration=duration))
+    summary = crud.get_activity_summary(db_session, user.id)
+    assert [(s["activity_type"], s["count"], s["total_duration"], s["mean_duration"]) for s in summary] == [
+        ("cycling", 1, 60, 60),
+        ("running", 2, 80, 40),
+    ]
+    assert crud.get_activity_summary(db_session, user.id, start=datetime(2100, 1, 1)) == []
+
+def test_blood_test_summary_reports_latest(db_session):
+    user = crud.create_user(db_session, UserCreate(username="bloodsummary", email="bloodsummary@test.com"))
+    for result in (80, 120, 95):
+        crud.create_blood_test(db_session, user.id, BloodTestCreate(test_name="glucose", result=result, unit="mg/dL"))
+    crud.create_blood_test(db_session, user.id, BloodTestCreate(test_name="glucose", result=5.5, unit="mmol/L"))
+    crud.create_blood_test(db_session, user.id, BloodTestCreate(test_name="vitamin D", result=30, unit="ng/mL"))
+    glucose, glucose_mmol, vitamin_d = crud.get_blood_test_summary(db_session, user.id)
+    assert (glucose["unit"], glucose_mmol["unit"]) == ("mg/dL", "mmol/L")
+    assert glucose_mmol["count"] == 1 and glucose_mmol["mean_result"] == 5.5
+    assert glucose["count"] == 3
+    assert glucose["latest_result"] == 95
+    assert (glucose["min_result"], glucose["max_result"]) == (80, 120)
+    assert vitamin_d["latest_unit"] == "ng/mL"
+
+def test_writes_append_to_change_log_in_order(db_session):
+    from changefeed import get_changes
+    after = max([c.seq for c in get_changes(db_session, limit=10_000)], default=0)
+    user = crud.create_user(db_session, UserCreate(username="feeduser", email="feed@test.com"))
+    activity = crud.create_physical_activity(db_session, user.id, PhysicalActivityCreate(activity_type="running", duration=30))
+    crud.update_physical_activity(db_session, activity.id, {"duration": 40})
+    crud.upsert_blood_tests(db_session, user.id, [BloodTestCreate(test_name="glucose", result=90, unit="mg/dL", external_id="g1")])
+    crud.upsert_blood_tests(db_session, user.id, [BloodTestCreate(test_name="glucose", result=91, unit="mg/dL", external_id="g1")])
+    crud.delete_physical_activity(db_session, activity.id)
+
+    changes = get_changes(db_session, after=after)
+    assert [(c.entity, c.operation) for c in changes] == [
+        ("user", "insert"),
+        ("physical_activity", "insert"),
+        ("physical_activity", "update"),
+        ("blood_test", "insert"),
+        ("blood_test", "update"),
+        ("physical_activity", "delete"),
+    ]
+    assert all(c.user_id == user.id for c in changes)
+    assert get_changes(db_session, after=changes[2].seq, limit=2) == changes[3:5]
+
+def test_high_water_never_waits_for_writers_in_flight(monkeypatch):
+    import changefeed
+    monkeypatch.setattr(changefeed, "_checkpoints", changefeed.deque(maxlen=changefeed.MAX_CHECKPOINTS))
+    monkeypatch.setattr(changefeed, "_final_seq", 0)
+
+    class Snapshots:
+        # (sequence last value, snapshot xmax, snapshot xmin) per call
+        def __init__(self, *reads):
+            self.values = [value for read in reads for value in read]
+        def scalar(self, statement):
+            return self.values.pop(0)
+
+    # A writer that took txid 100 is still running: seq 5 may not be final yet
+    assert changefeed._high_water(Snapshots((5, 101, 100))) == 0
+    assert changefeed._high_water(Snapshots((7, 103, 100))) == 0
+    # Once it finished, the first checkpoint is final; later writers still run
+    assert changefeed._high_water(Snapshots((9, 105, 102))) == 5
+    assert changefeed._high_water(Snapshots((9, 105, 105))) == 9
+
+def test_compact_changes_keeps_latest_per_entity(db_session):
+    from changefeed import compact_changes, get_changes
+    user = crud.create_user(db_session, UserCreate(username="compactfeed", email="compactfeed@test.com"))
+    test = crud.create_blood_test(db_session, user.id, BloodTestCreate(test_name="glucose", result=90, unit="mg/dL"))
+    for result in (91, 92, 93):
+        crud.update_blood_test(db_session, test.id, {"result": result})
+    head = max(c.seq for c in get_changes(db_session, limit=10_000))
+
+    compact_changes(db_session, before_seq=head + 1)
+    remaining = [c for c in get_changes(db_session, limit=10_000) if c.entity == "blood_test" and c.entity_id == test.id]
+    assert [(c.operation, c.seq) for c in remaining] == [("update", head)]
+
+def test_patch_activities_groups_changes_and_reports_per_row(db_session):
+    from schemas import PhysicalActivityBulkPatch
+    user = crud.create_user(db_session, UserCreate(username="patchuser", email="patch@test.com"))
+    first, second = (crud.create_physical_activity(db_session, user.id, PhysicalActivityCreate(activity_type="run", duration=d))
+                     for d in (10, 20))
+    results = crud.patch_physical_activities(db_session, [
+        PhysicalActivityBulkPatch(id=first.id, activity_type="running"),
+        PhysicalActivityBulkPatch(id=second.id, activity_type="running", duration=25),
+        PhysicalActivityBulkPatch(id=999_999, duration=1),
+    ])
+    assert results == [{"id": first.id, "updated": True}, {"id": second.id, "updated": True},
+                       {"id": 999_999, "updated": False}]
+    db_session.expire_all()
+    assert [(a.activity_type, a.duration) for a in (db_session.get(type(first), first.id), db_session.get(type(first), second.id))] == [
+        ("running", 10), ("running", 25)]
+
+def test_patch_sleep_recomputes_duration_and_nights(db_session):
+    from healthDB import SleepNight
+    from schemas import SleepActivityBulkPatch
+    user = crud.create_user(db_session, UserCreate(username="patchsleep", email="patchsleep@test.com"))
+    sleep = crud.create_sleep_activity(db_session, user.id, SleepActivityCreate(
+        start_time=datetime(2025, 9, 1, 23, 0), end_time=datetime(2025, 9, 2, 6, 0), quality="ok"))
+    crud.patch_sleep_activities(db_session, [SleepActivityBulkPatch(id=sleep.id, end_time=datetime(2025, 9, 2, 7, 30))])
+    db_session.expire_all()
+    assert crud.get_sleep_activity(db_session, sleep.id).duration == 510
+    night = db_session.query(SleepNight).filter(SleepNight.user_id == user.id).one()
+    assert night.total_minutes == 510
+
+@pytest.mark.parametrize("path, body, field", [
+    ("/activities/", {"activity_type": "run", "duration": 10}, "activity_type"),
+    ("/activities/", {"activity_type": "run", "duration": 10}, "duration"),
+    ("/activities/", {"activity_type": "run", "duration": 10}, "timestamp"),
+    ("/sleep/", {"start_time": "2025-09-01T23:00:00", "end_time": "2025-09-02T06:00:00", "quality": "ok"}, "start_time"),
+    ("/sleep/", {"start_time": "2025-09-01T23:00:00", "end_time": "2025-09-02T06:00:00", "quality": "ok"}, "end_time"),
+    ("/sleep/", {"start_time": "2025-09-01T23:00:00", "end_time": "2025-09-02T06:00:00", "quality": "ok"}, "quality"),
+    ("/blood/", {"test_name": "glucose", "result": 90, "unit": "mg/dL"}, "test_name"),
+    ("/blood/", {"test_name": "glucose", "result": 90, "unit": "mg/dL"}, "result"),
+    ("/blood/", {"test_name": "glucose", "result": 90, "unit": "mg/dL"}, "unit"),
+    ("/blood/", {"test_name": "glucose", "result": 90, "unit": "mg/dL"}, "timestamp"),
+])
+def test_patch_rejects_null_and_keeps_the_row_readable(client, path, body, field):
+    user_id = client.post("/users/", json={"username": "patchnull", "email": "patchnull@test.com"}).json()["id"]
+    row_id = client.post(f"{path}?user_id={user_id}", json=body).json()["id"]
+
+    assert client.patch(f"{path}{row_id}", json={field: None}).status_code == 422
+    assert client.patch(f"{path}batch", json=[{"id": row_id, field: None}]).status_code == 422
+    assert client.get(f"{path}{row_id}").status_code == 200
+    assert client.get(f"{path}user/{user_id}").status_code == 200
@@ -0,0 +1,101 @@
+import random
+
+import crud
+from healthDB import UserScore
+from healthscore import calculate_health_score_components
+from population import PopulationStats, ScoreHistogram, rebuild, record_score, rescore, rescore_blood
+from reference_ranges import CONVERSIONS_PATH, RANGES_PATH, ReferenceRangeRegistry
+from schemas import BloodTestCreate, PhysicalActivityCreate, UserCreate
+
+
+def test_histogram_percentile_and_quantile():
+    sketch = ScoreHistogram()
+    for value in range(100):
+        sketch.add(value)
+    assert sketch.percentile(50) == 50.5
+    assert abs(sketch.quantile(0.5) - 49) <= sketch.bin_width / 2 + 1e-9
+    sketch.remove(99)
+    assert sketch.total == 99
+
+def test_histogram_merge_matches_single_sketch():
+    values = [random.uniform(0, 100) for _ in range(1000)]
+    whole, left, right = ScoreHistogram(), ScoreHistogram(), ScoreHistogram()
+    for value in values:
+        whole.add(value)
+    for value in values[:500]:
+        left.add(value)
+    for value in values[500:]:
+        right.add(value)
+    left.merge(right)
+    assert left.counts == whole.counts
+    assert left.percentile(42.0) == whole.percentile(42.0)
+
+def test_record_score_moves_user_and_rebuild_verifies(db):
+    stats = PopulationStats()
+    users = [crud.create_user(db, UserCreate(username=f"pop{i}", email=f"pop{i}@test.com")) for i in range(4)]
+    for i, user in enumerate(users):
+        record_score(db, user.id, {"overall": 20.0 * i, "physical": 0, "sleep": 0, "blood": 0}, stats=stats)
+    assert stats.percentile("overall", 60.0) == 87.5
+
+    # Rescoring replaces the user's old value instead of adding a second one
+    record_score(db, users[0].id, {"overall": 90.0, "physical": 0, "sleep": 0, "blood": 0}, stats=stats)
+    assert stats.population() == 4
+    assert stats.percentile("overall", 90.0) == 87.5
+
+    crud.create_physical_activity(db, users[1].id, PhysicalActivityCreate(activity_type="running", duration=150))
+    report = rebuild(db, recompute=True, stats=stats)
+    assert report["population"] == 4
+    assert report["max_percentile_error"] == 0
+    assert stats.distribution()["quantiles"]["physical"]["p90"] > 99
+
+def test_rescore_only_removes_values_this_worker_counted(db):
+    user = crud.create_user(db, UserCreate(username="other", email="other@test.com"))
+    scores = {"overall": 40.0, "physical": 0, "sleep": 0, "blood": 0}
+    other_worker, this_worker = PopulationStats(), PopulationStats()
+    record_score(db, user.id, scores, stats=other_worker)
+    this_worker.update(-1, scores)
+
+    # The stored 40 was never counted here, so the 40 from user -1 stays
+    record_score(db, user.id, {**scores, "overall": 80.0}, stats=this_worker)
+    assert this_worker.population() == 2
+    assert this_worker.percentile("overall", 80.0) == 75.0
+
+    # After a rebuild the stored value is the one removed
+    rebuild(db, stats=this_worker)
+    record_score(db, user.id, {**scores, "overall": 10.0}, stats=this_worker)
+    assert this_worker.population() == 1
+    assert this_worker.percentile("overall", 10.0) == 50.0
+
+def test_rescore_blood_applies_new_ranges_in_bulk(tmp_path, db):
+    ranges, conversions = tmp_path / "ranges.csv", tmp_path / "conversions.csv"
+    ranges.write_text(open(RANGES_PATH).read().replace("glucose,mg/dL,,,,70,100", "glucose,mg/dL,,,,70,120"))
+    conversions.write_text(open(CONVERSIONS_PATH).read())
+    registry = ReferenceRangeRegistry(str(ranges), str(conversions))
+
+    users = [crud.create_user(db, UserCreate(username=f"rescored{i}", email=f"rescored{i}@test.com")) for i in range(3)]
+    for user in users[:2]:
+        crud.create_blood_test(db, user.id, BloodTestCreate(test_name="glucose", result=110, unit="mg/dL"))
+    crud.create_physical_activity(db, users[0].id, PhysicalActivityCreate(activity_type="running", duration=150))
+    for user in users:
+        record_score(db, user.id, calculate_health_score_components(user, db), stats=PopulationStats())
+
+    assert rescore_blood(db, ranges=registry, chunk_size=2) == 3
+    stored = {row.user_id: row for row in db.query(UserScore).populate_existing()}
+    assert stored[users[0].id].blood == 100.0 and stored[users[0].id].overall == round(200 / 3, 2)
+    assert stored[users[1].id].blood == 100.0 and stored[users[1].id].overall == round(100 / 3, 2)
+    assert stored[users[2].id].blood == 0.0 and stored[users[2].id].overall == 0.0
+
+def test_rescore_rebuilds_the_sketches(session_factory, db):
+    stats = PopulationStats()
+    user = crud.create_user(db, UserCreate(username="rebuilt", email="rebuilt@test.com"))
+    record_score(db, user.id, {"overall": 40.0, "physical": 60.0, "sleep": 60.0, "blood": 0.0}, stats=PopulationStats())
+    rescore(session_factory, stats=stats)
+    assert stats.population() == 1
+    assert stats.counted[user.id]["overall"] == 40.0
+
+def test_percentile_endpoint_reflects_new_data(client):
+    user_id = client.post("/users/", json={"username": "current", "email": "current@test.com"}).json()["id"]
+    before = client.get(f"/health_score/percentile?user_id={user_id}").json()["score"]
+    client.post(f"/activities/?user_id={user_id}", json={"activity_type": "running", "duration": 150})
+    after = client.get(f"/health_score/percentile?user_id={user_id}").json()["score"]
+    assert after > before
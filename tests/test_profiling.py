@@ -0,0 +1,96 @@
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+import profiling
+
+TOKEN = "staging-secret"
+
+
+def busy_score_calculation():
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "profile_store", profiling.ProfileStore())
+    engine = create_engine("sqlite://")
+    app = FastAPI()
+
+    @app.get("/score")
+    def score():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1")).all()
+        busy_score_calculation()
+        return {"score": 1}
+
+    @app.get("/events")
+    async def events():
+        async def stream():
+            for _ in range(3):
+                with engine.connect() as conn:
+                    conn.execute(text("SELECT 2")).all()
+                yield "data: 1\n\n"
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    profiling.install(app)
+    return TestClient(app)
+
+
+def test_requests_without_token_are_not_profiled(client):
+    response = client.get("/score", headers={"X-Profiling-Token": "wrong"})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert client.get("/debug/profiles/", headers={"X-Profiling-Token": "wrong"}).status_code == 401
+
+def test_non_ascii_tokens_are_compared_as_bytes(client, monkeypatch):
+    response = client.get("/score", headers={"X-Profiling-Token": "geheim-\u00fc".encode()})
+    assert response.status_code == 200
+    assert "x-profile-id" not in response.headers
+    assert client.get("/debug/profiles/", headers={"X-Profiling-Token": "\u00fc".encode()}).status_code == 401
+
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", "geheim-\u00fc")
+    headers = {"X-Profiling-Token": "geheim-\u00fc".encode()}
+    assert "x-profile-id" in client.get("/score", headers=headers).headers
+    assert client.get("/debug/profiles/", headers=headers).status_code == 200
+
+def test_profiled_request_records_samples_and_sql(client):
+    response = client.get("/score", headers={"X-Profiling-Token": TOKEN})
+    profile_id = response.headers["x-profile-id"]
+    headers = {"X-Profiling-Token": TOKEN}
+
+    assert [p["id"] for p in client.get("/debug/profiles/", headers=headers).json()] == [profile_id]
+    detail = client.get(f"/debug/profiles/{profile_id}", headers=headers).json()
+    assert detail["status_code"] == 200
+    assert [s["statement"] for s in detail["sql"]] == ["SELECT 1"]
+
+    speedscope = client.get(f"/debug/profiles/{profile_id}/speedscope", headers=headers).json()
+    names = [frame["name"] for frame in speedscope["shared"]["frames"]]
+    endpoint = next(p for p in speedscope["profiles"] if p["name"].startswith("endpoint score"))
+    assert any(names[index] == "busy_score_calculation" for stack in endpoint["samples"] for index in stack)
+
+def test_event_streams_are_profiled_until_their_headers_go_out(client):
+    headers = {"X-Profiling-Token": TOKEN}
+    response = client.get("/events", headers=headers)
+    assert response.text.count("data: 1") == 3
+    detail = client.get(f"/debug/profiles/{response.headers['x-profile-id']}", headers=headers).json()
+    assert detail["status_code"] == 200
+    assert detail["sql"] == []
+
+def test_profiles_are_capped():
+    profile = profiling.Profile("GET", "/slow", "header", interval=0.001, max_seconds=0.02, max_statements=2)
+    profile.start()
+    for _ in range(3):
+        profile.record_statement("SELECT 1", 0.001, 1, False)
+    time.sleep(0.1)
+    assert profile.truncated
+    assert not profile._sampler.is_alive()
+    assert profile.stop(200) and not profile.stop(200)
+    assert len(profile.statements) == 2
@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from reference_ranges import CONVERSIONS_PATH, RANGES_PATH, ReferenceRangeRegistry
+
+
+@pytest.fixture
+def registry():
+    return ReferenceRangeRegistry()
+
+
+def test_units_are_converted_before_scoring(registry):
+    scores = registry.score_tests(["glucose", "Glucose", "GLUCOSE"], [90, 5.0, 200], ["mg/dL", "mmol/L", "mg/dl"])
+    assert scores[:2].tolist() == [100.0, 100.0]  # 5.0 mmol/L is about 90 mg/dL
+    assert scores[2] == 0.0
+
+def test_unknown_analytes_are_left_out(registry):
+    assert np.isnan(registry.score_tests(["unobtainium"], [1.0], ["mg/dL"])[0])
+    assert np.isnan(registry.score_tests(["glucose"], [1.0], ["furlongs"])[0])
+    assert registry.score_panel([("glucose", 90, "mg/dL"), ("unobtainium", 1, "mg/dL")]) == 100.0
+    assert registry.score_panel([("unobtainium", 1, "mg/dL")]) == 0.0
+
+def test_sex_specific_band_wins(registry):
+    snapshot = registry.snapshot()
+    assert snapshot.resolve("hemoglobin", "g/dL", sex="F")[2:] == (12.0, 15.5)
+    assert snapshot.resolve("hemoglobin", "g/dL", age=10)[2:] == (11.0, 16.0)
+    assert snapshot.resolve("hemoglobin", "g/L")[:2] == (0.1, 0.0)
+
+def test_panels_for_many_users_match_single_panels(registry):
+    tests = [(1, "glucose", 90, "mg/dL"), (1, "cholesterol", 300, "mg/dL"), (2, "vitamin D", 30, "ng/mL"), (3, "mystery", 1, "U")]
+    user_ids, names, results, units = zip(*tests)
+    panels = registry.score_panels(user_ids, names, results, units)
+    assert panels == {
+        1: registry.score_panel([("glucose", 90, "mg/dL"), ("cholesterol", 300, "mg/dL")]),
+        2: 100.0,
+        3: 0.0,
+    }
+
+def test_registry_reloads_changed_files(tmp_path):
+    ranges, conversions = tmp_path / "ranges.csv", tmp_path / "conversions.csv"
+    ranges.write_text(open(RANGES_PATH).read())
+    conversions.write_text(open(CONVERSIONS_PATH).read())
+    registry = ReferenceRangeRegistry(str(ranges), str(conversions), check_interval=0)
+    reloads = []
+    registry.reload_listeners.append(lambda: reloads.append(registry.version))
+    original = registry.version
+    assert registry.score_tests(["glucose"], [110], ["mg/dL"])[0] < 100
+
+    ranges.write_text(ranges.read_text().replace("glucose,mg/dL,,,,70,100", "glucose,mg/dL,,,,70,120"))
+    os.utime(ranges, ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    assert registry.score_tests(["glucose"], [110], ["mg/dL"])[0] == 100.0
+    assert len(reloads) == 1 and reloads[0] != original
+
+    ranges.write_text("not,a,valid\nfile")
+    os.utime(ranges, ns=(time.time_ns(), time.time_ns() + 2_000_000_000))
+    assert registry.score_tests(["glucose"], [110], ["mg/dL"])[0] == 100.0
+    assert registry.version == reloads[0]
+    assert len(reloads) == 1
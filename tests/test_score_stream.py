@@ -0,0 +1,49 @@
+import asyncio
+import json
+import threading
+
+from score_stream import ScoreBroker, sse_events
+
+
+def _broker(scores: dict, calls: list):
+    def compute(user_id):
+        calls.append(user_id)
+        return {"user": user_id, "score": scores[user_id]}
+    return ScoreBroker(compute, debounce=0.01)
+
+
+def test_burst_of_writes_pushes_one_update():
+    scores, calls = {1: 50}, []
+    broker = _broker(scores, calls)
+
+    async def scenario():
+        events = sse_events(broker, 1, {"user": 1, "score": 50}, heartbeat=5)
+        first = await events.__anext__()
+        scores[1] = 60
+        for _ in range(3):
+            threading.Thread(target=broker.notify, args=([1],)).start()
+        second = await asyncio.wait_for(events.__anext__(), 1)
+        await events.aclose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert json.loads(first.split("data: ")[1]) == {"user": 1, "score": 50}
+    assert json.loads(second.split("data: ")[1]) == {"user": 1, "score": 60}
+    assert calls == [1]
+    assert broker.stats()["streams"] == 0
+
+def test_unchanged_score_is_not_pushed_and_heartbeats_flow():
+    scores, calls = {2: 70}, []
+    broker = _broker(scores, calls)
+
+    async def scenario():
+        events = sse_events(broker, 2, {"user": 2, "score": 70}, heartbeat=0.05)
+        await events.__anext__()
+        broker.notify([2, 3])  # 3 has no subscribers
+        event = await asyncio.wait_for(events.__anext__(), 1)
+        await events.aclose()
+        return event
+
+    assert asyncio.run(scenario()) == ": keepalive\n\n"
+    assert calls == [2]
+    assert broker.stats()["pushes"] == 0
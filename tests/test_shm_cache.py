@@ -0,0 +1,103 @@
+import multiprocessing
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import crud
+import shm_cache
+from healthDB import Base
+from schemas import PhysicalActivityCreate, UserCreate
+from shm_cache import SEQ, WAYS, SharedScoreCache
+
+SCORE = {"overall": 70.0, "physical": 80.0, "sleep": 60.0, "blood": 70.0}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = SharedScoreCache(str(tmp_path / "cache"), score_slots=64, version_slots=64)
+    yield cache
+    cache.close()
+
+
+def test_scores_are_served_until_the_version_changes(cache):
+    version = cache.data_version(42)
+    assert cache.get_score(42, version) is None
+    cache.put_score(42, version, SCORE)
+    assert cache.get_score(42, cache.data_version(42)) == SCORE
+
+    # Scores computed against other reference ranges are not served
+    assert cache.get_score(42, version, ranges=1) is None
+
+    cache.bump([42])
+    assert cache.data_version(42) != version
+    assert cache.get_score(42, cache.data_version(42)) is None
+
+def test_full_set_evicts_least_recently_written(tmp_path):
+    cache = SharedScoreCache(str(tmp_path / "cache"), score_slots=WAYS, version_slots=WAYS)
+    for user_id in range(1, WAYS + 2):
+        cache.put_score(user_id, 1, SCORE)
+    assert cache.counters["evictions"] == 1
+    assert cache.get_score(1, 1) is None
+    assert cache.get_score(WAYS + 1, 1) == SCORE
+    cache.close()
+
+def test_slot_left_mid_write_is_repaired(cache):
+    cache.put_score(7, 1, SCORE)
+    position = next(p for p in cache.scores._slots(7) if cache.scores.layout.unpack_from(cache.mm, p)[2] == 7)
+    SEQ.pack_into(cache.mm, position, SEQ.unpack_from(cache.mm, position)[0] + 1)  # writer died here
+    assert cache.get_score(7, 1) is None
+    cache.put_score(7, 1, SCORE)
+    assert cache.get_score(7, 1) == SCORE
+
+def _bump_in_other_process(path):
+    other = SharedScoreCache(path, score_slots=64, version_slots=64)
+    other.bump([5])
+    other.close()
+
+def test_processes_share_versions(tmp_path, cache):
+    version = cache.data_version(5)
+    cache.put_score(5, version, SCORE)
+    process = multiprocessing.get_context("fork").Process(target=_bump_in_other_process, args=(str(tmp_path / "cache"),))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+    assert cache.get_score(5, cache.data_version(5)) is None
+
+def test_commits_bump_changed_users(cache, monkeypatch):
+    monkeypatch.setattr(shm_cache, "_cache", cache)
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    user = crud.create_user(db, UserCreate(username="cached", email="cached@test.com"))
+    version = cache.data_version(user.id)
+    crud.create_physical_activity(db, user.id, PhysicalActivityCreate(activity_type="run", duration=30))
+    assert cache.data_version(user.id) != version
+    db.close()
+
+def test_each_database_gets_its_own_file(tmp_path):
+    first = SharedScoreCache(str(tmp_path / "cache"), score_slots=64, version_slots=64, database="sqlite:///a.db")
+    second = SharedScoreCache(str(tmp_path / "cache"), score_slots=64, version_slots=64, database="sqlite:///b.db")
+    assert first.path != second.path
+    first.put_score(3, first.data_version(3), SCORE)
+    assert second.get_score(3, second.data_version(3)) is None
+    first.close()
+    second.close()
+
+def test_compaction_and_purge_bump_versions(cache, monkeypatch, db):
+    from compaction import compact
+    from user_purge import purge_user
+    monkeypatch.setattr(shm_cache, "_cache", cache)
+    user = crud.create_user(db, UserCreate(username="old", email="old@test.com"))
+    crud.ingest_physical_activities(db, [(user.id, PhysicalActivityCreate(activity_type="run", duration=30),
+                                          datetime(2020, 1, 1))])
+    version = cache.data_version(user.id)
+    compact(db, retention_days=365)
+    assert cache.data_version(user.id) != version
+
+    user_id = user.id
+    crud.soft_delete_user(db, user_id)
+    version = cache.data_version(user_id)
+    purge_user(db, user_id)
+    assert cache.data_version(user_id) != version
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_threads_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+    release = threading.Event()
+
+    def compute():
+        executions.append(1)
+        release.wait(1)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do(7, compute))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.stats()["requests"] < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [42] * 5
+    assert len(executions) == 1
+    assert flight.stats() == {"requests": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: "ok") == "ok"
+
+def test_async_callers_share_one_execution():
+    flight = SingleFlight()
+    executions = []
+
+    async def compute():
+        executions.append(1)
+        await asyncio.sleep(0.01)
+        return "score"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do_async(1, compute) for _ in range(10)))
+
+    assert asyncio.run(scenario()) == ["score"] * 10
+    assert len(executions) == 1
+    assert flight.stats() == {"requests": 10, "executions": 1, "coalesced": 9, "in_flight": 0}
+
+def test_cancelled_async_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return "score"
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do_async(1, compute))
+        follower = asyncio.create_task(flight.do_async(1, compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == "score"
+    assert flight.stats()["executions"] == 1
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+import crud
+from healthDB import PhysicalActivity
+from schemas import PhysicalActivityCreate, UserCreate
+from write_behind import BufferFull, WriteBehindBuffer
+
+@pytest.fixture
+def user_id(db):
+    return crud.create_user(db, UserCreate(username="buffered", email="buffered@test.com")).id
+
+def count_activities(db, user_id):
+    return db.query(PhysicalActivity).filter(PhysicalActivity.user_id == user_id).count()
+
+def test_flush_batches_queued_samples(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory, max_queue=100, flush_rows=4)
+    for i in range(10):
+        receipt = buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=i))
+        assert receipt["receipt_id"]
+    assert count_activities(db, user_id) == 0
+
+    assert buffer.flush() == 10
+    assert count_activities(db, user_id) == 10
+    stats = buffer.stats()
+    assert stats["flushes"] == 3
+    assert stats["batch_size_max"] == 4
+    assert stats["queue_depth"] == 0
+
+def test_full_queue_applies_backpressure(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory, max_queue=2)
+    buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=1))
+    buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=2))
+    with pytest.raises(BufferFull):
+        buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=3))
+    assert buffer.stats()["rejected"] == 1
+
+def test_stop_flushes_pending_samples(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory, flush_interval_ms=10_000)
+    buffer.start()
+    for i in range(3):
+        buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=i))
+    buffer.stop()
+    assert count_activities(db, user_id) == 3
+
+def test_bad_rows_do_not_sink_the_batch(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory)
+    buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=1))
+    buffer.submit(user_id, PhysicalActivityCreate.model_construct(activity_type=None, duration=1, external_id=None))
+    buffer.flush()
+    assert count_activities(db, user_id) == 1
+    assert buffer.stats()["rows_failed"] == 1
+
+def test_concurrent_submits_are_all_counted(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory)
+
+    def submit_many():
+        for i in range(200):
+            buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=i))
+
+    threads = [threading.Thread(target=submit_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert buffer.stats()["accepted"] == 1600
+
+def test_unknown_user_is_rejected_before_queueing(client):
+    response = client.post("/activities/buffered?user_id=999999", json={"activity_type": "walking", "duration": 1})
+    assert response.status_code == 404
+
+def test_samples_of_users_deleted_before_the_flush_are_dropped(session_factory, db, user_id):
+    buffer = WriteBehindBuffer(session_factory)
+    buffer.submit(user_id, PhysicalActivityCreate(activity_type="walking", duration=1))
+    crud.soft_delete_user(db, user_id)
+    assert buffer.flush() == 0
+    assert buffer.stats()["rows_failed"] == 1
+    assert count_activities(db, user_id) == 0
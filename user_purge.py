@@ -0,0 +1,71 @@
+"""Asynchronous purge of soft-deleted users.
+
+DELETE /users/{id}?purge=async hides the user immediately (users.deleted_at)
+and hands the data removal to purge_user, which deletes rows in batches of
+PURGE_BATCH_SIZE, committing after each one so no single transaction holds
+locks on a large account for long. Purges interrupted by a restart can be
+resumed with:
+
+    python user_purge.py
+"""
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from changefeed import mark_changed
+from crud import USER_DATA_MODELS
+from healthDB import ActivityDailyAggregate, SleepNight, SleepSession, User, UserScore
+
+PURGE_BATCH_SIZE = 5000
+
+
+def _purge_batch(db: Session, model, user_id: int, batch_size: int) -> int:
+    if model in (ActivityDailyAggregate, SleepNight, SleepSession, UserScore):
+        # At most a few rows per day / night / session / user; small enough to go in one statement
+        return db.execute(delete(model).where(model.user_id == user_id)).rowcount
+    batch = select(model.id).where(model.user_id == user_id).limit(batch_size)
+    return db.execute(delete(model).where(model.id.in_(batch.scalar_subquery()))).rowcount
+
+
+def purge_user(db: Session, user_id: int, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Delete a soft-deleted user's data batch by batch, then the user row.
+    Returns the number of data rows removed."""
+    removed = 0
+    for model in USER_DATA_MODELS:
+        while True:
+            deleted = _purge_batch(db, model, user_id, batch_size)
+            db.commit()
+            removed += deleted
+            if deleted < batch_size:
+                break
+    db.execute(delete(User).where(User.id == user_id, User.deleted_at.is_not(None)))
+    mark_changed(db, [user_id])
+    db.commit()
+    return removed
+
+
+def purge_user_in_background(bind, user_id: int):
+    """BackgroundTasks entry point; uses its own session since the request's is closed."""
+    with Session(bind=bind) as db:
+        purge_user(db, user_id)
+
+
+def purge_pending_users(db: Session, batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Finish purges for every soft-deleted user still present. Returns the
+    number of users purged."""
+    user_ids = list(db.scalars(select(User.id).where(User.deleted_at.is_not(None))))
+    for user_id in user_ids:
+        purge_user(db, user_id, batch_size)
+    return len(user_ids)
+
+
+def main():
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        print(f"{purge_pending_users(db)} users purged")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Write-behind ingestion for high-frequency activity samples.
+
+POST /activities/buffered checks that the user exists, puts the sample on a
+bounded in-process queue and answers 202 with a receipt. A background thread drains the queue into
+multi-row upserts, one transaction per batch, whenever FLUSH_ROWS samples
+are waiting or FLUSH_INTERVAL_MS has passed since the batch started. A full
+queue is reported to the client as 503 + Retry-After. Samples still queued
+at shutdown are flushed before the process exits; samples accepted but not
+yet flushed are lost if the process is killed.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+
+import crud
+from database import SessionLocal
+from healthDB import utcnow
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10_000))
+FLUSH_ROWS = int(os.getenv("WRITE_BEHIND_FLUSH_ROWS", 500))
+FLUSH_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", 200))
+
+
+class BufferFull(Exception):
+    pass
+
+
+# Queued by stop() to wake the flusher without waiting out its timeout
+_WAKE = object()
+
+
+class WriteBehindBuffer:
+    def __init__(self, session_factory, max_queue: int = MAX_QUEUE,
+                 flush_rows: int = FLUSH_ROWS, flush_interval_ms: int = FLUSH_INTERVAL_MS):
+        self.session_factory = session_factory
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._flush_lock = threading.Lock()
+        # submit() runs on request threads and _write() on the flusher
+        self._counter_lock = threading.Lock()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.rows_failed = 0
+        self._recent_latencies = deque(maxlen=100)
+        self._recent_batches = deque(maxlen=100)
+
+    def submit(self, user_id: int, activity) -> dict:
+        receipt = {"receipt_id": uuid.uuid4().hex, "accepted_at": utcnow()}
+        try:
+            self._queue.put_nowait((user_id, activity, receipt["accepted_at"]))
+        except queue.Full:
+            with self._counter_lock:
+                self.rejected += 1
+            raise BufferFull()
+        with self._counter_lock:
+            self.accepted += 1
+        return receipt
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        """Stop the flusher after it has drained everything queued so far."""
+        if self._thread is not None:
+            self._stopping.set()
+            try:
+                self._queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass  # the flusher is busy and will notice _stopping on its own
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is _WAKE:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _WAKE:
+                    break
+                batch.append(item)
+            self._write(batch)
+        self.flush()
+
+    def flush(self) -> int:
+        """Synchronously write out everything currently queued."""
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < self.flush_rows:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _WAKE:
+                    batch.append(item)
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def _write(self, batch: list) -> int:
+        started = time.perf_counter()
+        with self._flush_lock:
+            db = self.session_factory()
+            rows = batch
+            try:
+                # Users deleted since their samples were accepted
+                live = crud.live_user_ids(db, [item[0] for item in batch])
+                rows = [item for item in batch if item[0] in live]
+                if len(rows) < len(batch):
+                    logger.warning("Dropping %d buffered activities of deleted users", len(batch) - len(rows))
+                crud.ingest_physical_activities(db, rows)
+                written = len(rows)
+            except Exception:
+                db.rollback()
+                logger.exception("Write-behind batch of %d failed; retrying rows individually", len(batch))
+                written = self._write_individually(db, rows)
+            finally:
+                db.close()
+        with self._counter_lock:
+            self.flushes += 1
+            self.rows_flushed += written
+            self.rows_failed += len(batch) - written
+            self._recent_latencies.append(time.perf_counter() - started)
+            self._recent_batches.append(len(batch))
+        return written
+
+    def _write_individually(self, db, batch: list) -> int:
+        written = 0
+        for item in batch:
+            try:
+                crud.ingest_physical_activities(db, [item])
+                written += 1
+            except Exception:
+                db.rollback()
+                logger.warning("Dropping buffered activity for user %s", item[0])
+        return written
+
+    def stats(self) -> dict:
+        with self._counter_lock:
+            latencies = sorted(self._recent_latencies)
+            batches = list(self._recent_batches)
+            counters = {
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "flushes": self.flushes,
+                "rows_flushed": self.rows_flushed,
+                "rows_failed": self.rows_failed,
+            }
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            **counters,
+            "flush_latency_ms_p50": latencies[len(latencies) // 2] * 1000 if latencies else None,
+            "flush_latency_ms_max": latencies[-1] * 1000 if latencies else None,
+            "batch_size_mean": sum(batches) / len(batches) if batches else None,
+            "batch_size_max": max(batches) if batches else None,
+        }
+
+
+activity_buffer = WriteBehindBuffer(SessionLocal)
+
+
+def get_activity_buffer() -> WriteBehindBuffer:
+    return activity_buffer